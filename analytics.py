@@ -0,0 +1,363 @@
+#
+# Statistics over the games archived in a SQLite database (see event_store.py), computed with NumPy.
+#
+# Usage:
+#   python tournament.py --games 1000 --db games.db --record    # --record for the response times of the players
+#   python analytics.py games.db
+#   python analytics.py games.db --output analytics.json
+#
+# The events are loaded once into columns (one NumPy array per field, the names and roles as integer codes):
+# the win rates by role, who votes for whom, how often the players speak, their response times and the length
+# of the games are then computed over whole columns: about 10s for 10k games, most of it to read them.
+# Only the events and the values needed are loaded: SQLite reads the context of the events (json_extract) and
+# counts the speeches, the rest stays on disk.
+#
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from event_store import DB_PATH
+from roles import SEER, VILLAGER, WEREWOLF
+
+ROLES: List[str] = [VILLAGER, SEER, WEREWOLF]
+# the side of each role of ROLES, as GameArchive.winner
+ROLE_SIDES: np.ndarray = np.array([0, 0, 1], dtype=np.int8)
+SIDES: List[str] = [VILLAGER, WEREWOLF]
+NO_WINNER: int = -1  # a game stopped after a number of nights
+# the events that start and end the phases, as GameArchive.event_type
+PHASE_EVENTS: List[str] = ["NIGHT_START", "MORNING_VICTIM", "VOTE_RESULT"]
+PERCENTILES: List[float] = [50, 90, 99]
+
+# seconds since the epoch of a timestamp of the archive, computed by SQLite (to the millisecond)
+EPOCH_SECONDS: str = "(julianday(timestamp) - 2440587.5) * 86400.0"
+
+
+@dataclass
+class GameArchive:
+    """
+    The archived games, as columns. Games, players and roles are integer codes:
+    the index of the game in game_ids, of the name in names (-1 for none), of the role in ROLES.
+    """
+    game_ids: np.ndarray  # str
+    winner: np.ndarray  # per game, the index of the side in SIDES, NO_WINNER if not over
+    days: np.ndarray  # per game, nights played
+    rounds: np.ndarray  # per game, speeches
+    events: np.ndarray  # per game, events
+    names: np.ndarray  # str, the names of the players of all the games
+    # the events of PHASE_EVENTS, in the order of the games: game, type (index in PHASE_EVENTS), time (seconds since the epoch)
+    event_game: np.ndarray
+    event_type: np.ndarray
+    event_time: np.ndarray
+    # the roles: game, player, role
+    role_game: np.ndarray
+    role_player: np.ndarray
+    role: np.ndarray
+    # the day votes, of all the players alive: game, voter, target
+    vote_game: np.ndarray
+    vote_voter: np.ndarray
+    vote_target: np.ndarray
+    # the players who speak: game, player, speeches
+    speaker_game: np.ndarray
+    speaker: np.ndarray
+    speeches: np.ndarray
+    speech_length: np.ndarray  # of each speech, in characters
+    # the eliminations by the villagers (vote) and the werewolves (night): game, player, by the werewolves
+    elimination_game: np.ndarray
+    elimination_player: np.ndarray
+    elimination_night: np.ndarray
+    # the responses of the players (recorded games only): call (index in calls), latency in seconds (NaN if none)
+    calls: np.ndarray  # str
+    response_call: np.ndarray
+    response_latency: np.ndarray
+
+    def player_keys(self, games: np.ndarray, players: np.ndarray) -> np.ndarray:
+        """A single integer for each (game, player), e.g. to join the votes with the roles."""
+        return games.astype(np.int64) * len(self.names) + players
+
+    def roles_of(self, games: np.ndarray, players: np.ndarray) -> np.ndarray:
+        """The role of each (game, player), -1 if unknown."""
+        index = find(self.player_keys(self.role_game, self.role_player), self.player_keys(games, players))
+        return np.where((index >= 0) & (players >= 0), self.role[index], -1)
+
+
+def find(keys: np.ndarray, wanted: np.ndarray) -> np.ndarray:
+    """The index in `keys` (not sorted) of each of `wanted`, -1 for the ones that are not in keys."""
+    if len(keys) == 0:
+        return np.full(len(wanted), -1, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    found = order[np.minimum(np.searchsorted(keys, wanted, sorter=order), len(keys) - 1)]
+    return np.where(keys[found] == wanted, found, -1)
+
+
+def codes(values: Sequence[Optional[str]], vocabulary: np.ndarray) -> np.ndarray:
+    """The index of each value in `vocabulary`, -1 for None."""
+    values = np.array([value if value is not None else "" for value in values], dtype=str)
+    return np.where(values != "", find(vocabulary, values), -1)
+
+
+def columns(rows: List[tuple], count: int) -> List[List[Any]]:
+    """The columns of the rows of a query."""
+    return [list(column) for column in zip(*rows)] if rows else [[] for _ in range(count)]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a database of event_store.py read-only: a wrong path is an error, not a new empty database."""
+    return sqlite3.connect(f"{Path(path).absolute().as_uri()}?mode=ro", uri=True)
+
+
+def load(connection: sqlite3.Connection) -> GameArchive:
+    """Load the archived games of a database (see connect)."""
+    game_ids, events = columns(connection.execute("SELECT game_id, events FROM games ORDER BY game_id").fetchall(), 2)
+    game_ids = np.array(game_ids, dtype=str)
+
+    # the context of the events is read by SQLite (json_extract, json_each), only the values needed come out
+    game, types, seconds = columns(connection.execute(
+        f"SELECT game_id, type, {EPOCH_SECONDS} FROM events WHERE type IN ({', '.join('?' * len(PHASE_EVENTS))}) "
+        "ORDER BY game_id, seq", PHASE_EVENTS
+    ).fetchall(), 3)
+
+    over_game, winner, days, rounds = columns(connection.execute(
+        "SELECT game_id, json_extract(context_data, '$.winner'), json_extract(context_data, '$.days'), "
+        "json_extract(context_data, '$.rounds') FROM events WHERE type = 'GAME_OVER'"
+    ).fetchall(), 4)
+    role_game, role_player, role = columns(connection.execute(
+        "SELECT game_id, target_name, json_extract(context_data, '$.role') FROM events WHERE type = 'ROLE_ASSIGNMENT'"
+    ).fetchall(), 3)
+    vote_game, voter, target = columns(connection.execute(
+        "SELECT e.game_id, json_extract(v.value, '$[0]'), json_extract(v.value, '$[1]') "
+        "FROM events e, json_each(e.context_data, '$.votes') v WHERE e.type = 'VOTE_RESULT'"
+    ).fetchall(), 3)
+    speaker_game, speaker, speeches = columns(connection.execute(
+        "SELECT game_id, actor_name, count(*) FROM events WHERE type = 'SPEECH' GROUP BY game_id, actor_name"
+    ).fetchall(), 3)
+    (speech_length,) = columns(connection.execute("SELECT length(content) FROM events WHERE type = 'SPEECH'").fetchall(), 1)
+    eliminated_game, eliminated, eliminated_type = columns(connection.execute(
+        "SELECT game_id, json_extract(context_data, '$.victim'), type FROM events "
+        "WHERE type IN ('VOTE_RESULT', 'MORNING_VICTIM') AND json_extract(context_data, '$.victim') IS NOT NULL"
+    ).fetchall(), 3)
+    call, latency = columns(connection.execute(
+        "SELECT json_extract(context_data, '$.call'), json_extract(context_data, '$.latency') FROM events "
+        "WHERE type = 'PLAYER_RESPONSE'"
+    ).fetchall(), 2)
+
+    names = np.unique(np.array([name for name in role_player + speaker if name is not None], dtype=str))
+    calls, response_call = np.unique(np.array(call, dtype=str), return_inverse=True)
+    # the games without GAME_OVER (e.g. still being played) are not over
+    over = codes(over_game, game_ids)
+    games_winner = np.full(len(game_ids), NO_WINNER, dtype=np.int8)
+    games_winner[over] = codes(winner, np.array(SIDES))
+    games_days, games_rounds = np.zeros(len(game_ids), np.int32), np.zeros(len(game_ids), np.int32)
+    games_days[over] = np.array(days, dtype=np.int32)
+    games_rounds[over] = np.array(rounds, dtype=np.int32)
+    return GameArchive(
+        game_ids=game_ids,
+        winner=games_winner,
+        days=games_days,
+        rounds=games_rounds,
+        events=np.array(events, dtype=np.int32),
+        names=names,
+        event_game=codes(game, game_ids),
+        event_type=codes(types, np.array(PHASE_EVENTS)).astype(np.int8),
+        event_time=np.array(seconds, dtype=np.float64),
+        role_game=codes(role_game, game_ids),
+        role_player=codes(role_player, names),
+        role=codes(role, np.array(ROLES)).astype(np.int8),
+        vote_game=codes(vote_game, game_ids),
+        vote_voter=codes(voter, names),
+        vote_target=codes(target, names),
+        speaker_game=codes(speaker_game, game_ids),
+        speaker=codes(speaker, names),
+        speeches=np.array(speeches, dtype=np.int32),
+        speech_length=np.array(speech_length, dtype=np.int32),
+        elimination_game=codes(eliminated_game, game_ids),
+        elimination_player=codes(eliminated, names),
+        elimination_night=np.array(eliminated_type, dtype=str) == "MORNING_VICTIM",
+        calls=calls,
+        response_call=response_call.astype(np.int16),
+        response_latency=np.array([value if value is not None else np.nan for value in latency], dtype=np.float64),
+    )
+
+
+def describe(values: np.ndarray) -> Dict[str, Optional[float]]:
+    """Count, mean and percentiles of some values (NaN ignored)."""
+    values = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+    if len(values) == 0:
+        return {"count": 0, "mean": None, **{f"p{p:g}": None for p in PERCENTILES}, "max": None}
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        **{f"p{p:g}": float(value) for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        "max": float(values.max()),
+    }
+
+
+def win_rates(archive: GameArchive) -> Dict[str, Any]:
+    """The win rate of each side, and of the players of each role (the seer wins with the villagers)."""
+    over = archive.winner != NO_WINNER
+    player_won = archive.winner[archive.role_game] == ROLE_SIDES[archive.role]
+    player_over = over[archive.role_game]
+    games = np.bincount(archive.role[player_over], minlength=len(ROLES))
+    wins = np.bincount(archive.role[player_over & player_won], minlength=len(ROLES))
+    return {
+        "games": int(len(archive.game_ids)),
+        "finished": int(over.sum()),
+        "sides": {side: float(np.mean(archive.winner[over] == i)) if over.any() else None for i, side in enumerate(SIDES)},
+        "roles": {role: float(wins[i] / games[i]) if games[i] else None for i, role in enumerate(ROLES)},
+    }
+
+
+def vote_matrix(archive: GameArchive) -> Dict[str, Any]:
+    """
+    Who votes for whom, by role: counts[voter role][target role] of the day votes (the werewolves vote too), and the
+    accuracy of each role, the share of its votes against a werewolf.
+    """
+    voter_role = archive.roles_of(archive.vote_game, archive.vote_voter)
+    target_role = archive.roles_of(archive.vote_game, archive.vote_target)
+    known = (voter_role >= 0) & (target_role >= 0)
+    counts = np.bincount(voter_role[known] * len(ROLES) + target_role[known],
+                         minlength=len(ROLES) ** 2).reshape(len(ROLES), len(ROLES))
+    totals = counts.sum(axis=1)
+    werewolf = ROLES.index(WEREWOLF)
+    return {
+        "roles": ROLES,
+        "counts": counts.tolist(),
+        "accuracy": {role: float(counts[i, werewolf] / totals[i]) if totals[i] else None for i, role in enumerate(ROLES)},
+    }
+
+
+def speech_frequency(archive: GameArchive) -> Dict[str, Any]:
+    """The speeches per player and per game, by role (the players who never speak count), and their length."""
+    # the speeches of each player of role_*
+    speaker = find(archive.player_keys(archive.role_game, archive.role_player),
+                   archive.player_keys(archive.speaker_game, archive.speaker))
+    speeches = np.bincount(speaker[speaker >= 0], weights=archive.speeches[speaker >= 0], minlength=len(archive.role))
+    return {
+        "per_player": {role: describe(speeches[archive.role == i].astype(np.float64)) for i, role in enumerate(ROLES)},
+        "length": describe(archive.speech_length.astype(np.float64)),
+    }
+
+
+def latencies(archive: GameArchive) -> Dict[str, Any]:
+    """The response times of the players, by call, and the share of calls without response."""
+    return {
+        call: {
+            **describe(archive.response_latency[archive.response_call == i]),
+            "no_response": float(np.isnan(archive.response_latency[archive.response_call == i]).mean()),
+        }
+        for i, call in enumerate(archive.calls)
+    }
+
+
+def phase_durations(archive: GameArchive) -> Dict[str, Any]:
+    """
+    The durations of the nights (NIGHT_START to MORNING_VICTIM) and of the days (MORNING_VICTIM to VOTE_RESULT),
+    from the times of the events.
+    """
+    night_start, morning, vote = (PHASE_EVENTS.index(t) for t in ("NIGHT_START", "MORNING_VICTIM", "VOTE_RESULT"))
+    # a phase is between two events that follow each other in a game
+    types, games, times = archive.event_type, archive.event_game, archive.event_time
+    same_game = games[1:] == games[:-1]
+    durations = times[1:] - times[:-1]
+    return {
+        "night": describe(durations[same_game & (types[:-1] == night_start) & (types[1:] == morning)]),
+        "day": describe(durations[same_game & (types[:-1] == morning) & (types[1:] == vote)]),
+    }
+
+
+def lengths(archive: GameArchive) -> Dict[str, Any]:
+    """The nights and speeches of the finished games, and who is eliminated at night or by vote, by role."""
+    over = archive.winner != NO_WINNER
+    role = archive.roles_of(archive.elimination_game, archive.elimination_player)
+    eliminated = {}
+    for cause, rows in (("night", archive.elimination_night), ("vote", ~archive.elimination_night)):
+        counts = np.bincount(role[rows & (role >= 0)], minlength=len(ROLES))
+        eliminated[cause] = {r: int(counts[i]) for i, r in enumerate(ROLES)}
+    return {
+        "days": describe(archive.days[over].astype(np.float64)),
+        "rounds": describe(archive.rounds[over].astype(np.float64)),
+        "events_per_game": describe(archive.events.astype(np.float64)),
+        "eliminated": eliminated,
+    }
+
+
+def report(archive: GameArchive) -> Dict[str, Any]:
+    return {
+        "win_rates": win_rates(archive),
+        "votes": vote_matrix(archive),
+        "speeches": speech_frequency(archive),
+        "latency": latencies(archive),
+        "phase_durations": phase_durations(archive),
+        "lengths": lengths(archive),
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    def fmt(value: Optional[float], digits: int = 2) -> str:
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    def line(label: str, d: Dict[str, Optional[float]]) -> str:
+        return (f"  {label:<20} n {d['count']:>8}  mean {fmt(d['mean'])}  p50 {fmt(d['p50'])}  p90 {fmt(d['p90'])}  "
+                f"p99 {fmt(d['p99'])}  max {fmt(d['max'])}")
+
+    wins = result["win_rates"]
+    print("*" * 80)
+    print(f"Games: {wins['games']} ({wins['finished']} finished)")
+    for label, rates in (("side", wins["sides"]), ("role", wins["roles"])):
+        print(f"Win rate by {label}: " + ", ".join(f"{name} {fmt(rate)}" for name, rate in rates.items()))
+    votes = result["votes"]
+    print("Day votes (rows: voter role, columns: target role):")
+    print(f"  {'':<12}" + "".join(f"{role:>12}" for role in votes["roles"]) + f"{'accuracy':>12}")
+    for role, row in zip(votes["roles"], votes["counts"]):
+        print(f"  {role:<12}" + "".join(f"{count:>12}" for count in row) + f"{fmt(votes['accuracy'][role]):>12}")
+    print("Speeches per player and game:")
+    for role, d in result["speeches"]["per_player"].items():
+        print(line(role, d))
+    print(line("speech length", result["speeches"]["length"]))
+    print("Response times of the players (s):" if result["latency"] else "Response times: none, the games were not recorded (--record)")
+    for call, d in result["latency"].items():
+        print(line(call, d) + f"  no response {fmt(d['no_response'], 3)}")
+    print("Phases (s):")
+    for phase, d in result["phase_durations"].items():
+        print(line(phase, d))
+    lengths = result["lengths"]
+    print("Games:")
+    for key in ("days", "rounds", "events_per_game"):
+        print(line(key, lengths[key]))
+    for cause, counts in lengths["eliminated"].items():
+        print(f"  eliminated at {cause:<6} " + ", ".join(f"{role} {count}" for role, count in counts.items()))
+    print("*" * 80)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Statistics over the archived games.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="the SQLite database, see event_store.py")
+    parser.add_argument("--output", help="also write the statistics to this JSON file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"No database {args.db}")
+        sys.exit(1)
+    start = time.perf_counter()
+    connection = connect(args.db)
+    archive = load(connection)
+    connection.close()
+    if len(archive.game_ids) == 0:
+        print(f"No games found in {args.db}")
+        sys.exit(1)
+    loaded = time.perf_counter()
+    result = report(archive)
+    print_report(result)
+    print(f"Loaded {len(archive.game_ids)} games ({int(archive.events.sum())} events) in {loaded - start:.2f}s, "
+          f"statistics in {time.perf_counter() - loaded:.2f}s")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+        print(f"Statistics written to {args.output}")
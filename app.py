@@ -1,32 +1,171 @@
 # 
 # Webapp to display game logs. 
 # You DON'T NEED to run this, it will be automatically started by game_leader.py
+# To display a recorded game again, replay it: python replay.py games.db --game GAME_ID --time-scale 1 --web
+#
+# GET /api/logs returns the entries logged so far, as a JSON list. A page of them with ?since=N&limit=M:
+# the entries after the first N logged by the web page, at most M of them. N is a position in the log of all the
+# games together, not the seq of an entry within its game.
+# The response tells the next since in X-Next-Since, and has an ETag: a client polling with If-None-Match
+# gets a 304 until there is something new.
+#
+# Socket.IO: the new entries are sent by a background thread, a batch every EMIT_INTERVAL, in the event
+# new_log_entries: {"since": N, "next": M, "entries": [...]}, N and M as the since of /api/logs.
+# A client is sent the entries of all the games after emitting subscribe: {}, or of a single one after emitting
+# subscribe: {"game_id": ID}. It acknowledges the batches by emitting ack: {"since": M}. A client that acknowledges
+# and is sent more than MAX_UNACKED_ENTRIES entries it has not acknowledged yet is not sent any more batches but
+# resync: {"since": N}, and catches up with /api/logs?since=N before subscribing again.
+# The clients that don't subscribe (the web pages written before the batches) are sent every entry alone, in the
+# event new_log_entry, and are never sent resync.
+#
+# The memory of the web page is bounded: the latest entries are kept in memory (MEMORY_LIMIT bytes of JSON), the older
+# ones are moved to a file (in the temporary directory), from where /api/logs reads them. The limit is for all the
+# games together, not for each game: a long game can push the entries of the others out to the file.
+#   WebLogger(memory_limit=64 * 2**20, spill_dir="logs")
 #
 from abc import ABC, abstractmethod
+from array import array
+from collections import deque
 from datetime import datetime, timezone
+from itertools import islice
+import atexit
+import gzip
 import json
 import logging
+import os
+import struct
+import tempfile
 import threading
 import time
 import webbrowser
-from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
-from flask import Flask, request, jsonify, render_template, send_from_directory, Response
-from flask_socketio import SocketIO
-from pydantic import BaseModel
+from metrics import REGISTRY, Registry
+
+# Flask and Flask-SocketIO are only imported by WebLogger: the game leader without -w, the tournaments and the
+# replays only need GameLogEntry and Logger, and importing them would double their startup time.
 
 # mute Flask and Werkzeug logs
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 logging.getLogger('flask.app').setLevel(logging.ERROR)
 
-class GameLogEntry(BaseModel):
-    timestamp: datetime = datetime.now(timezone.utc)
+MAX_LOGS_PAGE: int = 1000  # max entries returned by /api/logs with a limit
+NEXT_SINCE_HEADER: str = "X-Next-Since"
+MIN_COMPRESSED_SIZE: int = 1024  # bytes, smaller responses are not compressed
+EMIT_INTERVAL: float = 0.05  # seconds, the entries logged within are sent together
+MAX_UNACKED_ENTRIES: int = 2000  # entries sent to a Socket.IO client and not acknowledged yet
+ALL_GAMES_ROOM: str = "games"  # the Socket.IO room of the clients following all the games
+LEGACY_ROOM: str = "entries"  # the Socket.IO room of the clients that don't subscribe, sent new_log_entry
+MEMORY_LIMIT: int = 16 * 2**20  # bytes, of the JSON of the entries kept in memory by WebLogger
+SPILL_INDEX_STRIDE: int = 256  # the position in the spill file of one entry out of this many is kept in memory
+
+# the binary encoding of an entry: seq (-1 if None), timestamp (seconds since the epoch), monotonic, public,
+# then type, actor_name, target_name, content, game_id and the JSON of context_data, each as a length (NONE_LENGTH
+# if None) and UTF-8 bytes
+BINARY_HEADER = struct.Struct("<qdd?")
+BINARY_LENGTH = struct.Struct("<I")
+NONE_LENGTH: int = 0xFFFFFFFF
+
+
+def _json_dumps(value: Any) -> str:
+    # e.g. the tuples of the votes become lists, sets and other objects strings
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+@dataclass(slots=True, kw_only=True)
+class GameLogEntry:
+    """
+    An event of a game. The entries are created by the thousands in tournaments: a plain slotted dataclass,
+    without validation, encoded to JSON once (see to_json) however many loggers and clients get it.
+    An entry must not be changed once logged: the clients may have it already.
+    """
     type: str
+    content: str
     actor_name: Optional[str] = "GameLeader"
     target_name: Optional[str] = None
-    content: str
     public: bool = True
     context_data: Optional[Dict[str, Any]] = None
+    game_id: Optional[str] = None  # set by GameLeader.log
+    seq: Optional[int] = None  # position of the entry in its game, set by GameLeader.log
+    timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    # time.monotonic() when the entry was created, for the durations between entries (the clock may be set meanwhile).
+    # None for the entries read back from the SQLite archive
+    monotonic: Optional[float] = field(default_factory=time.monotonic)
+    _json: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+    # the fields when _json was encoded: a field set since then (e.g. seq, by GameLeader.log) is encoded again
+    _json_fields: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if isinstance(self.timestamp, str):
+            # e.g. from a JSON list of entries
+            self.timestamp = datetime.fromisoformat(self.timestamp)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The entry as JSON values, the timestamp in ISO format."""
+        return {
+            "timestamp": self.timestamp.isoformat(),
+            "type": self.type,
+            "actor_name": self.actor_name,
+            "target_name": self.target_name,
+            "content": self.content,
+            "public": self.public,
+            "context_data": self.context_data,
+            "game_id": self.game_id,
+            "seq": self.seq,
+            "monotonic": self.monotonic,
+        }
+
+    def _fields(self) -> tuple:
+        # compared by identity first: cheaper than hooking __setattr__, which would slow down every entry created
+        return (self.type, self.content, self.actor_name, self.target_name, self.public, self.context_data,
+                self.game_id, self.seq, self.timestamp, self.monotonic)
+
+    def to_json(self) -> bytes:
+        """
+        The entry in JSON (UTF-8), encoded once as long as its fields are not set again.
+        The changes inside context_data are not seen.
+        """
+        fields = self._fields()
+        if self._json is None or fields != self._json_fields:
+            self._json = _json_dumps(self.to_dict()).encode()
+            self._json_fields = fields
+        return self._json
+
+    def to_binary(self) -> bytes:
+        """A compact encoding of the entry, see from_binary."""
+        context = _json_dumps(self.context_data) if self.context_data is not None else None
+        parts = [BINARY_HEADER.pack(self.seq if self.seq is not None else -1, self.timestamp.timestamp(),
+                                    self.monotonic if self.monotonic is not None else float("nan"), self.public)]
+        for text in (self.type, self.actor_name, self.target_name, self.content, self.game_id, context):
+            if text is None:
+                parts.append(BINARY_LENGTH.pack(NONE_LENGTH))
+            else:
+                data = text.encode()
+                parts.append(BINARY_LENGTH.pack(len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    @classmethod
+    def from_binary(cls, data: bytes) -> "GameLogEntry":
+        seq, timestamp, monotonic, public = BINARY_HEADER.unpack_from(data)
+        offset = BINARY_HEADER.size
+        texts: List[Optional[str]] = []
+        for _ in range(6):
+            (length,) = BINARY_LENGTH.unpack_from(data, offset)
+            offset += BINARY_LENGTH.size
+            if length == NONE_LENGTH:
+                texts.append(None)
+            else:
+                texts.append(data[offset:offset + length].decode())
+                offset += length
+        type, actor_name, target_name, content, game_id, context = texts
+        return cls(
+            type=type, content=content, actor_name=actor_name, target_name=target_name, public=public,
+            context_data=json.loads(context) if context is not None else None, game_id=game_id,
+            seq=seq if seq >= 0 else None, timestamp=datetime.fromtimestamp(timestamp, timezone.utc),
+            monotonic=monotonic if monotonic == monotonic else None,  # NaN for None
+        )
 
     def to_string(self, sequence_number: int = 0) -> str:
         parts = [f"[{sequence_number}] Event: {self.type}"]
@@ -46,14 +185,173 @@ class Logger(ABC):
     def log(self, entry: GameLogEntry) -> None:
         pass
 
+    def close(self) -> None:
+        """Called once the game is over, for loggers that buffer their entries."""
+        pass
+
+
+def game_room(game_id: Optional[str]) -> str:
+    """The Socket.IO room of the clients following a game."""
+    return f"game:{game_id}"
+
+
+class SpilledLog:
+    """
+    The JSON of the entries of a WebLogger, by position. The latest ones are kept in memory, up to memory_limit
+    bytes, the older ones are appended to a file, one per line, and read from there when asked for.
+    Only an index of one position out of SPILL_INDEX_STRIDE stays in memory for the spilled entries.
+    """
+
+    def __init__(self, memory_limit: int = MEMORY_LIMIT, spill_dir: Optional[str] = None):
+        """
+        Args:
+            memory_limit: Bytes of JSON kept in memory, at least the entries not sent yet (see keep_from)
+            spill_dir: Where the file of the older entries is created, the temporary directory if None
+        """
+        self.memory_limit: int = memory_limit
+        self.spill_dir: Optional[str] = spill_dir
+        self.spill_path: Optional[str] = None  # created when the memory is full for the first time
+        # the latest entries (game_id, JSON), the first one at position self._spilled
+        self._recent: Deque[Tuple[Optional[str], bytes]] = deque()
+        self._recent_size: int = 0
+        self._spilled: int = 0
+        # the entries from this position are kept in memory, e.g. until they are sent to the Socket.IO clients
+        self.keep_from: int = 0
+        self._spill_file = None
+        self._spill_size: int = 0
+        self._spill_index: array = array('q')  # offset of the entry SPILL_INDEX_STRIDE * i in the file
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._recent)
+
+    def append(self, game_id: Optional[str], encoded: bytes) -> None:
+        with self._lock:
+            self._recent.append((game_id, encoded))
+            self._recent_size += len(encoded)
+            while self._recent_size > self.memory_limit and self._spilled < self.keep_from:
+                self._spill()
+
+    def _spill(self) -> None:
+        """Move the oldest entry in memory to the file."""
+        if self._spill_file is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix="web_logs_", suffix=".jsonl", dir=self.spill_dir)
+            self._spill_file = os.fdopen(fd, "wb")
+            atexit.register(self.close)
+        _, encoded = self._recent.popleft()
+        self._recent_size -= len(encoded)
+        if self._spilled % SPILL_INDEX_STRIDE == 0:
+            self._spill_index.append(self._spill_size)
+        # the JSON of an entry has no line breaks, they are escaped
+        self._spill_file.write(encoded + b"\n")
+        self._spill_size += len(encoded) + 1
+        self._spilled += 1
+
+    def recent(self, since: int) -> List[Tuple[Optional[str], bytes]]:
+        """The entries from `since` on, with their game, `since` must be at least keep_from."""
+        with self._lock:
+            assert since >= self._spilled, f"Entry {since} is no longer in memory"
+            return list(islice(self._recent, since - self._spilled, None))
+
+    def read(self, since: int, end: int) -> List[bytes]:
+        """The JSON of the entries from `since` to `end` (excluded), from memory or from the file."""
+        with self._lock:
+            spilled = self._spilled
+            encoded = [e for _, e in islice(self._recent, max(0, since - spilled), max(0, end - spilled))]
+            if since < spilled:
+                self._spill_file.flush()
+        if since >= spilled:
+            return encoded
+        # the file is only appended to, its first `spilled` lines don't change
+        start = since - since % SPILL_INDEX_STRIDE
+        with open(self.spill_path, "rb") as f:
+            f.seek(self._spill_index[start // SPILL_INDEX_STRIDE])
+            lines = islice(f, since - start, min(end, spilled) - start)
+            return [line.rstrip(b"\n") for line in lines] + encoded
+
+    def close(self) -> None:
+        """Delete the file of the older entries, called at exit."""
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                os.remove(self.spill_path)
+                self._spill_file = None
+
+
+@dataclass
+class WebClient:
+    """A Socket.IO client of the web page."""
+    room: str
+    acked: int  # the since of the entries it has received
+    acks: bool = False  # whether it acknowledges the batches, the clients that don't are never resynced
+    # the next and the number of entries of the batches sent to it and not acknowledged yet
+    unacked: Deque[Tuple[int, int]] = field(default_factory=deque)
+
+    def lag(self) -> int:
+        """The number of entries sent to the client and not acknowledged yet."""
+        return sum(count for _, count in self.unacked)
+
+    def ack(self, since: int) -> None:
+        self.acks = True
+        self.acked = max(self.acked, since)
+        while self.unacked and self.unacked[0][0] <= since:
+            self.unacked.popleft()
+
 
 class WebLogger(Logger):
 
-    def __init__(self, port=4999):
-        self.entries = []
+    def __init__(self, port=4999, metrics: Registry = REGISTRY, compress: bool = False,
+                 memory_limit: int = MEMORY_LIMIT, spill_dir: Optional[str] = None):
+        """
+        Args:
+            port: Port of the web page
+            metrics: The metrics shown on /metrics
+            compress: Compress the responses of /api/logs with gzip, for the clients that accept it
+            memory_limit: Bytes of JSON of the latest entries kept in memory, the older ones are moved to a file
+            spill_dir: Where that file is created, the temporary directory if None
+        """
+        from flask import Flask, Response, request, send_from_directory
+        from flask_socketio import SocketIO
+
+        # the JSON of each entry (see GameLogEntry.to_json). /api/logs only joins them
+        self._entries: SpilledLog = SpilledLog(memory_limit, spill_dir)
+        # in the ETags, so that the pages of another game leader (e.g. after a restart) don't match
+        self._etag_prefix = os.urandom(4).hex()
         self.port = port
+        self.metrics = metrics
+        self.compress = compress
+        # the entries not sent to the Socket.IO clients yet are the ones from self._emitted on
+        self._emitted = 0
+        self._clients: Dict[str, WebClient] = {}
+        self._lock = threading.Lock()
+        self._emit_lock = threading.Lock()  # the batches are sent in order
+        self._new_entries = threading.Event()
+        self._emitted_batches = metrics.counter("web_log_batches_total", "Batches of entries sent to the web page")
+        self._resyncs = metrics.counter("web_client_resyncs_total", "Web page clients too far behind, sent to /api/logs")
         self.app = Flask(__name__, static_folder='public', static_url_path='/static')
         self.socketio = SocketIO(self.app, cors_allowed_origins="*")
+
+        @self.socketio.on('connect')
+        def connect():
+            self._subscribe(request.sid, LEGACY_ROOM, None)
+
+        @self.socketio.on('disconnect')
+        def disconnect(*args):
+            with self._lock:
+                self._clients.pop(request.sid, None)
+
+        @self.socketio.on('subscribe')
+        def subscribe(data):
+            data = data or {}
+            game_id = data.get('game_id')
+            self._subscribe(request.sid, game_room(game_id) if game_id is not None else ALL_GAMES_ROOM, data.get('since'))
+
+        @self.socketio.on('ack')
+        def ack(data):
+            with self._lock:
+                client = self._clients.get(request.sid)
+                if client is not None and isinstance(data, dict) and isinstance(data.get('since'), int):
+                    client.ack(data['since'])
         
         @self.app.route('/')
         def index():
@@ -61,18 +359,38 @@ class WebLogger(Logger):
         
         @self.app.route('/api/logs')
         def get_logs():
-            # Convert all entries to dict and ensure timestamp is a string
-            return jsonify([
-                {
-                    **entry.dict(),
-                    "timestamp": entry.timestamp.isoformat() if isinstance(entry.timestamp, datetime) else entry.timestamp
-                }
-                for entry in self.entries
-            ])
+            # the entries are only appended: a page is the same as long as its bounds are
+            end = len(self._entries)
+            since = min(max(0, request.args.get('since', 0, type=int)), end)
+            limit = request.args.get('limit', type=int)
+            if limit is not None:
+                end = min(end, since + min(max(0, limit), MAX_LOGS_PAGE))
+            etag = f"{self._etag_prefix}-{since}-{end}"
+            headers = {NEXT_SINCE_HEADER: str(end)}
+            if request.if_none_match.contains(etag):
+                response = Response(status=304, headers=headers)
+                response.set_etag(etag)
+                return response
+            body = b"[" + b",".join(self._entries.read(since, end)) + b"]"
+            response = Response(body, mimetype='application/json', headers=headers)
+            response.set_etag(etag)
+            if self.compress:
+                response.vary.add('Accept-Encoding')
+                if len(body) >= MIN_COMPRESSED_SIZE and 'gzip' in request.accept_encodings:
+                    response.set_data(gzip.compress(body, compresslevel=5))
+                    response.content_encoding = 'gzip'
+            return response
+
+        @self.app.route('/metrics')
+        def get_metrics():
+            # Prometheus text format, see metrics.py
+            return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
         
         # Start the server in a background thread
         self._server_thread = threading.Thread(target=self._run_server, daemon=True)
         self._server_thread.start()
+        self._emitter_thread = threading.Thread(target=self._run_emitter, name="web-emitter", daemon=True)
+        self._emitter_thread.start()
         # open browser after a short delay
         threading.Timer(0.5, lambda: webbrowser.open_new(f'http://localhost:{self.port}/')).start()
 
@@ -80,23 +398,76 @@ class WebLogger(Logger):
         # debug=False, use_reloader=False to avoid thread issue
         self.socketio.run(self.app, port=self.port, debug=False, use_reloader=False)
 
+    def _subscribe(self, sid: str, room: str, since: Optional[int]) -> None:
+        """Move a client (in a Socket.IO handler) to `room`, it has received the entries before `since`."""
+        from flask_socketio import join_room, leave_room
+        with self._lock:
+            client = self._clients.get(sid)
+            if client is not None:
+                leave_room(client.room)
+            join_room(room)
+            # without since, the client starts with the next batch
+            self._clients[sid] = WebClient(room, since if isinstance(since, int) else self._emitted)
+
+    def _run_emitter(self):
+        while True:
+            self._new_entries.wait()
+            # let the entries of a burst (e.g. the votes of a round) pile up, they are sent together
+            time.sleep(EMIT_INTERVAL)
+            self._new_entries.clear()
+            self._emit()
+
+    def _emit(self) -> None:
+        """Send the new entries to the clients, one batch per game."""
+        with self._emit_lock:
+            self._emit_new_entries()
+
+    def _emit_new_entries(self) -> None:
+        with self._lock:
+            since = self._emitted
+            entries = self._entries.recent(since)
+            end = self._emitted = since + len(entries)
+            games: Dict[Optional[str], List[bytes]] = {}
+            for game_id, encoded in entries:
+                games.setdefault(game_id, []).append(encoded)
+            # the entries each room is sent now
+            counts = {game_room(game_id): len(encoded) for game_id, encoded in games.items()}
+            counts[ALL_GAMES_ROOM] = len(entries)
+            # the clients too far behind are sent to /api/logs instead of being sent more. Only the entries of its room
+            # count: a client following a game that is over isn't behind the other games
+            lagging = [(sid, client) for sid, client in self._clients.items() if client.lag() > MAX_UNACKED_ENTRIES]
+            for sid, client in lagging:
+                del self._clients[sid]
+                self.socketio.server.leave_room(sid, client.room, namespace='/')
+            legacy = False
+            for client in self._clients.values():
+                legacy = legacy or client.room == LEGACY_ROOM
+                if client.acks and counts.get(client.room):
+                    client.unacked.append((end, counts[client.room]))
+        for sid, client in lagging:
+            self._resyncs.inc()
+            self.socketio.emit('resync', {"since": client.acked}, to=sid)
+        if since == end:
+            return
+        if legacy:
+            for _, encoded in entries:
+                self.socketio.emit('new_log_entry', json.loads(encoded), to=LEGACY_ROOM)
+        for game_id, encoded in games.items():
+            # the entries are already encoded, the batch is sent as a JSON string
+            batch = f'{{"since": {since}, "next": {end}, "entries": [{b",".join(encoded).decode()}]}}'
+            self.socketio.emit('new_log_entries', batch, to=game_room(game_id))
+            self._emitted_batches.inc()
+        if len(games) > 1:
+            # the clients following all the games get all the entries in one batch
+            batch = f'{{"since": {since}, "next": {end}, "entries": [{b",".join(e for _, e in entries).decode()}]}}'
+        self.socketio.emit('new_log_entries', batch, to=ALL_GAMES_ROOM)
+        # the entries sent can be moved to the file
+        self._entries.keep_from = end
+
     def log(self, entry: GameLogEntry) -> None:
-        self.entries.append(entry)
-        entry_dict = entry.dict()  # fails with model_dump_json() because of datetime
-        entry_dict['timestamp'] = entry.timestamp.isoformat()
-        self.socketio.emit('new_log_entry', entry_dict)
-
-if __name__ == "__main__":
-    #########################################################
-    # NOT MEANT TO BE RUN, ONLY FOR TESTING
-    #########################################################
-    logger = WebLogger()
-    # load the game logs from the file
-    with open("game_logs3.json", "r", encoding="utf-8") as f:
-        game_logs = json.load(f)
-
-    for log in game_logs:
-        time.sleep(0.2)
-        print("Logging entry:", log)
-        logger.log(GameLogEntry(**json.loads(log)))
-    time.sleep(10)
\ No newline at end of file
+        self._entries.append(entry.game_id, entry.to_json())
+        self._new_entries.set()
+
+    def close(self) -> None:
+        # the last entries of the game are not left waiting for the emitter thread
+        self._emit()
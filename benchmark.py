@@ -0,0 +1,279 @@
+#
+# Benchmarks of the game leader's game loop, with stub players (no LLM) and fixed seeds.
+#
+# Usage:
+#   python benchmark.py --output bench.json                    # in-process players
+#   python benchmark.py --transport http --output bench.json   # players behind werewolf_server.py --stub
+#   python benchmark.py --compare old.json new.json            # compare two runs
+#
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from game_leader import ApiCalls, GameLeader, Intent, NullLogger, Player
+from log_setup import setup_logging
+from lobby import lobby_names
+from werewolf import StubWerewolfPlayer
+
+LOG = logging.getLogger(__name__)
+
+# the methods of GameLeader whose latency is measured
+TIMED_METHODS: List[str] = ["announce_to_all", "discussion_segment", "choose_next_speaker", "validate_votes", "compute_victim"]
+SCALING_SIZES: List[int] = [6, 10, 14, 25, 50, 100, 200]
+HTTP_PORT: int = 5099
+
+
+class InProcessApiCalls(ApiCalls):
+    """
+    ApiCalls that hosts stub players in the leader's process instead of calling their servers,
+    so that only the leader's own logic is measured.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.hosted: Dict[int, StubWerewolfPlayer] = {}
+
+    async def aclose(self) -> None:
+        pass
+
+    async def post_new_game(self, player: Player, players_names: List[str], werewolves_cnt: int, werewolves: List[Optional[str]],
+                            game_id: Optional[str] = None, seers_cnt: int = 1) -> int:
+        player_id = len(self.hosted)
+        self.hosted[player_id] = StubWerewolfPlayer.create(player.name, player.role, players_names.copy(), werewolves_cnt, list(werewolves),
+                                                           seers_cnt)
+        return player_id
+
+    async def post_speech(self, player: Player) -> Optional[str]:
+        return self.hosted[player.player_id].speak()
+
+    async def post_notify(self, player: Player, message: str) -> Optional[Intent]:
+        intent = self.hosted[player.player_id].notify(message)
+        return self.parse_intent(player, intent.model_dump(mode="json"))
+
+    async def post_batch_notify(self, players: List[Player], message: str) -> Dict[str, Optional[Intent]]:
+        return {player.name: await self.post_notify(player, message) for player in players}
+
+    async def post_end_game(self, server: str, game_id: str) -> None:
+        pass
+
+    async def post_warmup(self, player: Player) -> Optional[float]:
+        return 0.0
+
+
+class TimedGameLeader(GameLeader):
+    """GameLeader recording the duration (seconds) of every call to TIMED_METHODS."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timings: Dict[str, List[float]] = {method: [] for method in TIMED_METHODS}
+
+    async def announce_to_all(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = await super().announce_to_all(*args, **kwargs)
+        self.timings["announce_to_all"].append(time.perf_counter() - start)
+        return result
+
+    async def discussion_segment(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = await super().discussion_segment(*args, **kwargs)
+        self.timings["discussion_segment"].append(time.perf_counter() - start)
+        return result
+
+    def choose_next_speaker(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = super().choose_next_speaker(*args, **kwargs)
+        self.timings["choose_next_speaker"].append(time.perf_counter() - start)
+        return result
+
+    def validate_votes(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = super().validate_votes(*args, **kwargs)
+        self.timings["validate_votes"].append(time.perf_counter() - start)
+        return result
+
+    def compute_victim(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = super().compute_victim(*args, **kwargs)
+        self.timings["compute_victim"].append(time.perf_counter() - start)
+        return result
+
+
+def latency_stats(values: List[float]) -> Dict[str, Optional[float]]:
+    """Count, mean and percentiles, in milliseconds."""
+    if not values:
+        return {"count": 0, "mean_ms": None, "p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    values = sorted(values)
+
+    def pct(p: float) -> float:
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000
+
+    return {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) * 1000,
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "max_ms": values[-1] * 1000,
+    }
+
+
+async def run_games(num_players: int, games: int, seed: int, transport: str, max_days: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Play `games` games one after the other and measure them.
+
+    Args:
+        num_players: Size of the lobby
+        games: Number of games
+        seed: Seed of the first game, game i uses seed + i
+        transport: "inprocess" or "http" (a stub werewolf_server.py must listen on HTTP_PORT)
+        max_days: Stop each game after this many nights, None to play until the end
+
+    Returns:
+        Games per second, nights per second and the latency of each of TIMED_METHODS
+    """
+    api = InProcessApiCalls() if transport == "inprocess" else ApiCalls()
+    timings: Dict[str, List[float]] = {method: [] for method in TIMED_METHODS}
+    days = 0
+    start = time.perf_counter()
+    try:
+        for i in range(games):
+            players = [Player(name=n, is_female=False, api_base_url=f"http://localhost:{HTTP_PORT}/") for n in lobby_names(num_players)]
+            game = TimedGameLeader(players, NullLogger(), api=api, seed=seed + i)
+            assert await game.start_game(), f"game {i} could not start"
+            await game.run(max_days=max_days)
+            days += game.day
+            for method, values in game.timings.items():
+                timings[method].extend(values)
+    finally:
+        await api.aclose()
+    duration = time.perf_counter() - start
+    return {
+        "players": num_players,
+        "games": games,
+        "max_days": max_days,
+        "duration_s": duration,
+        "games_per_second": games / duration,
+        "nights_per_second": days / duration,
+        "latency": {method: latency_stats(values) for method, values in timings.items()},
+    }
+
+
+def start_stub_server(port: int, seed: int) -> subprocess.Popen:
+    """Start a single-process werewolf_server.py with stub players, and wait until it answers."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(
+        [sys.executable, "-c", f"from werewolf_server import run_app; run_app({port}, stub=True, seed={seed})"],
+        cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://localhost:{port}/", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"stub werewolf_server did not start on port {port}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run_suite(transport: str, seed: int, games: int, players: int, sizes: List[int], scaling_days: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    print(f"end-to-end: {games} games of {players} players ({transport})")
+    results["end_to_end"] = await run_games(players, games, seed, transport)
+    print(f"  {results['end_to_end']['games_per_second']:.2f} games/s")
+
+    results["scaling"] = []
+    for size in sizes:
+        r = await run_games(size, 1, seed, transport, max_days=scaling_days)
+        results["scaling"].append(r)
+        print(f"scaling: {size:>4} players  {r['nights_per_second']:8.2f} nights/s  "
+              f"announce_to_all p50 {r['latency']['announce_to_all']['p50_ms']:.3f}ms  "
+              f"choose_next_speaker p50 {r['latency']['choose_next_speaker']['p50_ms']:.3f}ms")
+    return results
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Print the speedup of every measure of new_path over old_path."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    def row(label: str, before: Optional[float], after: Optional[float], higher_is_better: bool) -> None:
+        if not before or not after:
+            print(f"{label:<45} {'-':>12} {'-':>12}")
+            return
+        ratio = after / before if higher_is_better else before / after
+        print(f"{label:<45} {before:>12.4f} {after:>12.4f}   x{ratio:.2f}")
+
+    print(f"{'':<45} {old['meta'].get('commit') or old_path:>12} {new['meta'].get('commit') or new_path:>12}")
+    row("end_to_end games/s", old["results"]["end_to_end"]["games_per_second"], new["results"]["end_to_end"]["games_per_second"], True)
+    for method in TIMED_METHODS:
+        row(f"end_to_end {method} p50 ms", old["results"]["end_to_end"]["latency"][method]["p50_ms"],
+            new["results"]["end_to_end"]["latency"][method]["p50_ms"], False)
+    new_scaling = {r["players"]: r for r in new["results"]["scaling"]}
+    for r in old["results"]["scaling"]:
+        if r["players"] in new_scaling:
+            row(f"scaling {r['players']} players nights/s", r["nights_per_second"], new_scaling[r["players"]]["nights_per_second"], True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the game leader with stub players.")
+    parser.add_argument("--transport", choices=["inprocess", "http"], default="inprocess",
+                        help="call the stub players in-process, or over HTTP through werewolf_server.py")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the leader and of the stub players")
+    parser.add_argument("--games", type=int, default=20, help="number of end-to-end games")
+    parser.add_argument("--players", type=int, default=14, help="lobby size of the end-to-end games")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SCALING_SIZES, help="lobby sizes of the scaling curve")
+    parser.add_argument("--scaling-days", type=int, default=2, help="nights played per lobby size of the scaling curve")
+    parser.add_argument("--log-level", default="WARNING", help="level of the game leader's logs during the benchmark")
+    parser.add_argument("--output", default="benchmark.json", help="where the JSON results are written")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two JSON results and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    setup_logging(args.log_level.upper(), args.log_level.upper())
+    StubWerewolfPlayer.seed = args.seed
+    server = start_stub_server(HTTP_PORT, args.seed) if args.transport == "http" else None
+    try:
+        results = asyncio.run(run_suite(args.transport, args.seed, args.games, args.players, args.sizes, args.scaling_days))
+    finally:
+        if server is not None:
+            server.kill()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "transport": args.transport,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {args.output}")
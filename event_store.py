@@ -0,0 +1,241 @@
+#
+# Persistent archive of the game events, in a SQLite database.
+#
+# Usage:
+#   python game_leader.py --db games.db                 # archive a game (also: tournament.py --db games.db)
+#   python event_store.py games.db                      # list the archived games
+#   python event_store.py games.db --game 3f2a9c1b7d4e  # print the events of a game
+#   python event_store.py games.db --type VOTE_RESULT --actor Aline
+#
+import argparse
+import dataclasses
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app import GameLogEntry, Logger
+
+LOG = logging.getLogger(__name__)
+
+DB_PATH: str = "games.db"
+BATCH_SIZE: int = 500  # max number of entries written in a single transaction
+FLUSH_INTERVAL: float = 0.5  # seconds, max time an entry waits before being written
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS events (
+    game_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    type TEXT NOT NULL,
+    actor_name TEXT,
+    target_name TEXT,
+    content TEXT NOT NULL,
+    public INTEGER NOT NULL,
+    context_data TEXT,
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_type ON events (type, game_id, seq);
+CREATE INDEX IF NOT EXISTS events_actor ON events (actor_name, game_id, seq);
+CREATE INDEX IF NOT EXISTS events_seq ON events (seq);
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    events INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_start ON games (start);
+"""
+COLUMNS: List[str] = ["game_id", "seq", "timestamp", "type", "actor_name", "target_name", "content", "public", "context_data"]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open the database, creating its tables if needed.
+    With a write-ahead log, readers don't block the writer, and commits only fsync at checkpoints.
+    """
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def to_row(entry: GameLogEntry) -> tuple:
+    return (
+        entry.game_id,
+        entry.seq,
+        entry.timestamp.isoformat(),
+        entry.type,
+        entry.actor_name,
+        entry.target_name,
+        entry.content,
+        int(entry.public),
+        json.dumps(entry.context_data, ensure_ascii=False, default=str) if entry.context_data is not None else None,
+    )
+
+
+def from_row(row: tuple) -> GameLogEntry:
+    values = dict(zip(COLUMNS, row))
+    values["timestamp"] = datetime.fromisoformat(values["timestamp"])
+    values["public"] = bool(values["public"])
+    values["context_data"] = json.loads(values["context_data"]) if values["context_data"] is not None else None
+    # the monotonic clock of another process means nothing
+    return GameLogEntry(**values, monotonic=None)
+
+
+class EventStore:
+    """
+    Queries on the archived games. The indexes on (game_id, seq), (type, ...), (actor_name, ...) and seq
+    keep the queries below in the milliseconds, even with thousands of games.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path: str = path
+        self.connection: sqlite3.Connection = connect(path)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def games(self) -> List[Dict[str, Any]]:
+        """The archived games, oldest first, with their number of events and when they started and ended."""
+        rows = self.connection.execute("SELECT game_id, events, start, end FROM games ORDER BY start").fetchall()
+        return [{"game_id": r[0], "events": r[1], "start": r[2], "end": r[3]} for r in rows]
+
+    def events(self, game_id: Optional[str] = None, type: Optional[str] = None, actor_name: Optional[str] = None,
+               since_seq: Optional[int] = None, limit: Optional[int] = None) -> List[GameLogEntry]:
+        """
+        The events matching all the given filters, in the order of their game then of their sequence number.
+
+        Args:
+            game_id: Only the events of this game
+            type: Only the events of this type, e.g. "SPEECH"
+            actor_name: Only the events of this actor
+            since_seq: Only the events after this sequence number
+            limit: At most this many events
+        """
+        conditions = []
+        params: List[Any] = []
+        for column, value in (("game_id", game_id), ("type", type), ("actor_name", actor_name)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since_seq is not None:
+            conditions.append("seq > ?")
+            params.append(since_seq)
+        query = f"SELECT {', '.join(COLUMNS)} FROM events"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY game_id, seq"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [from_row(row) for row in self.connection.execute(query, params)]
+
+
+class SQLiteLogger(Logger):
+    """
+    Appends every entry to the SQLite store.
+
+    log() only puts the entry in a queue: a writer thread writes the entries in batches
+    (one transaction per BATCH_SIZE entries, or every FLUSH_INTERVAL), so that the game loop never waits for the disk.
+    Entries without game_id or seq (not logged through GameLeader.log) get default ones.
+    """
+
+    def __init__(self, path: str = DB_PATH, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.path: str = path
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.connection: sqlite3.Connection = connect(path)
+        self._default_game_id: str = f"unknown-{int(time.time())}"
+        self._next_seq: Dict[str, int] = {}
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write, name="sqlite_logger", daemon=True)
+        self._writer.start()
+
+    def log(self, entry: GameLogEntry) -> None:
+        game_id = entry.game_id if entry.game_id is not None else self._default_game_id
+        seq = entry.seq if entry.seq is not None else self._next_seq.get(game_id, 0)
+        self._next_seq[game_id] = seq + 1
+        if entry.game_id != game_id or entry.seq != seq:
+            entry = dataclasses.replace(entry, game_id=game_id, seq=seq)
+        self._queue.put(entry)
+
+    def flush(self) -> None:
+        """Wait until all the entries logged so far are written."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Write the remaining entries and stop the writer thread."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self.connection.close()
+
+    def _write(self) -> None:
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # wait a little for more entries, they are written in the same transaction
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stop = True
+            entries = [entry for entry in batch if entry is not None]
+            try:
+                if entries:
+                    rows = [to_row(entry) for entry in entries]
+                    # the games table summarizes the events table, so that listing the games doesn't read all the events
+                    games: Dict[str, list] = {}
+                    for row in rows:
+                        game = games.setdefault(row[0], [row[0], row[2], row[2], 0])
+                        game[1], game[2], game[3] = min(game[1], row[2]), max(game[2], row[2]), game[3] + 1
+                    # an event written twice is an error: replacing it would count it twice in games.events
+                    with self.connection:
+                        self.connection.executemany(
+                            f"INSERT INTO events ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                            rows
+                        )
+                        self.connection.executemany(
+                            "INSERT INTO games (game_id, start, end, events) VALUES (?, ?, ?, ?) ON CONFLICT (game_id) DO UPDATE SET "
+                            "start = MIN(start, excluded.start), end = MAX(end, excluded.end), events = events + excluded.events",
+                            list(games.values())
+                        )
+            except Exception as e:
+                LOG.error("Could not write %d game events to %s: %s", len(entries), self.path, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the archived games.")
+    parser.add_argument("db", nargs="?", default=DB_PATH, help="the SQLite database")
+    parser.add_argument("--game", help="print the events of this game")
+    parser.add_argument("--type", help="only the events of this type")
+    parser.add_argument("--actor", help="only the events of this actor")
+    parser.add_argument("--limit", type=int, help="at most this many events")
+    args = parser.parse_args()
+
+    store = EventStore(args.db)
+    start = time.perf_counter()
+    if args.game is None and args.type is None and args.actor is None:
+        games = store.games()
+        for game in games:
+            print(f"{game['game_id']}  {game['events']:>5} events  {game['start']} -> {game['end']}")
+        count = len(games)
+    else:
+        entries = store.events(game_id=args.game, type=args.type, actor_name=args.actor, limit=args.limit)
+        for entry in entries:
+            print(f"[{entry.game_id} {entry.seq}] {entry.type} {entry.actor_name or ''} -> {entry.target_name or ''}: {entry.content}")
+        count = len(entries)
+    print(f"{count} results in {(time.perf_counter() - start) * 1000:.1f}ms")
+    store.close()
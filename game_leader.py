@@ -1,53 +1,82 @@
 import sys
 import random
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
 from pydantic import BaseModel
-from collections import Counter
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter, deque
+from functools import partial
+import httpx
 import math
 import json
+import os
+import time
+import uuid
 
-from app import Logger, WebLogger, GameLogEntry
-
-
-
+import argparse
 import logging
-from logging.handlers import RotatingFileHandler
 
+from app import Logger, WebLogger, GameLogEntry
+from event_store import SQLiteLogger
+from lobby import lobby_players
+from log_setup import Lazy, add_logging_arguments, setup_logging_from_args
+from metrics import COUNT_BUCKETS, METRICS_FILE, PHASE_BUCKETS, REGISTRY
+from profiling import PROFILE_DIR, Profiler, print_import_times
+from roles import SEER, VILLAGER, WEREWOLF
+from tracing import TRACE_DIR, Tracer, annotate, headers as trace_headers, span, traced
+
+# handlers are set up by the scripts (see log_setup.py), not when this module is imported
 LOG = logging.getLogger(__name__)
 
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-# Rotating file handler
-rotating_handler = RotatingFileHandler('game_leader.log', maxBytes=5*1024*1024, backupCount=50)
-#formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-formatter = logging.Formatter('%(levelname)s: %(message)s')
-rotating_handler.setFormatter(formatter)
-logger.addHandler(rotating_handler)
-# Console handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-
-
-logger.addHandler(console_handler)
-# Suppress unnecessary logs from other libs
-for lib in ['tornado', 'asyncio', 'httpx', 'httpcore', 'openai', 'urllib3', 'requests']:
-    logging.getLogger(lib).setLevel(logging.WARNING)
-LOG.info("Logging setup completed")
-
-
-
 
-SEER: str = "voyante"
-WEREWOLF: str = "loup-garou"
-VILLAGER: str = "villageois"
+# roles: 2 werewolves under 12 players, 3 up to 16, then 3 out of 14 players as in the rules (e.g. 107 out of 500)
+WEREWOLF_RATIO: float = 3 / 14
 
 # hard limits
 MAX_INTERRUPTIONS: int = 2
 MAX_ROUNDS: int = 20
 API_TIMEOUT: int = 10 # seconds
 
+# how the werewolves agree on a victim, see GameLeader.werewolves_time
+WOLF_CONSENSUS_ROUNDS: str = "rounds"  # up to 4 rounds of votes, until all werewolves vote for the same player
+WOLF_CONSENSUS_RANKED: str = "ranked"  # a single round of ranked ballots, resolved by instant-runoff
+WOLF_VOTE_ROUNDS: int = 4
+
+# speaker selection, see GameLeader.speaker_weights
+SPEAK_WEIGHT: int = 5  # weight of a player who wants to speak
+CHATTY_PENALTY: int = 3  # weight removed from a player who did all the talking so far
+STOP_WEIGHT: int = 50  # max weight of stopping the discussion
+STOP_MIDPOINT: int = 15  # discussion round where stopping weighs STOP_WEIGHT / 2
+STOP_STEEPNESS: float = 1.5
+
+# keep-alive connection pool shared by all the calls to the players
+MAX_CONNECTIONS: int = 100
+MAX_KEEPALIVE_CONNECTIONS: int = 50
+KEEPALIVE_EXPIRY: int = 60 # seconds
+
+# adaptive deadlines, see LatencyTracker. API_TIMEOUT stays the hard limit of every request
+MIN_TIMEOUT: float = 2 # seconds, the shortest deadline given to a player
+LATENCY_WINDOW: int = 50  # recent response times kept per player, for the percentiles
+LATENCY_MIN_SAMPLES: int = 5  # API_TIMEOUT is used until a player answered this many times
+LATENCY_ALPHA: float = 0.125  # weight of a new response time in the moving average
+LATENCY_BETA: float = 0.25  # weight of a new deviation in the moving deviation
+TIMEOUT_DEVIATIONS: int = 4  # deadline = average + TIMEOUT_DEVIATIONS * deviation
+HEDGE_PERCENTILE: int = 95  # a hedged request is sent when the first one is slower than this percentile
+MIN_HEDGE_DELAY: float = 0.5 # seconds, and than this
+# sent with every request; servers that echo it answer a repeated id with the first response (see werewolf_server.py)
+REQUEST_ID_HEADER: str = "X-Request-Id"
+
+# metrics, see metrics.py. the calls are labelled by endpoint and player (by server for batch_notify)
+API_REQUESTS = REGISTRY.counter("leader_api_requests_total", "Requests sent to the players", ["endpoint", "player"])
+API_LATENCY = REGISTRY.histogram("leader_api_latency_seconds", "Response time of the players", ["endpoint", "player"])
+API_FAILURES = REGISTRY.counter("leader_api_failures_total", "Requests without response, by reason (timeout, error)",
+                                ["endpoint", "player", "reason"])
+API_HEDGED = REGISTRY.counter("leader_api_hedged_total", "Requests sent a second time", ["endpoint", "player"])
+INVALID_VOTES = REGISTRY.counter("leader_invalid_votes_total", "Votes for a player who is not in the game or dead")
+WOLF_REVOTES = REGISTRY.counter("leader_werewolf_revotes_total", "Vote rounds of the werewolves after the first one")
+DISCUSSION_ROUNDS = REGISTRY.histogram("leader_discussion_rounds", "Discussion rounds per day", buckets=COUNT_BUCKETS)
+PHASE_DURATION = REGISTRY.histogram("leader_phase_duration_seconds", "Duration of the nights and days", ["phase"], PHASE_BUCKETS)
+GAMES = REGISTRY.counter("leader_games_total", "Games over, by winning side (none if stopped)", ["winner"])
+
 
 
 
@@ -58,6 +87,7 @@ class Player(BaseModel):
     role: str = "unassigned"
     api_base_url: str
     api_endpoint: str = None
+    player_id: Optional[int] = None
     is_alive: bool = True
     number_interruptions: int = 0
     spoke_at_rounds: List[int] = []
@@ -66,6 +96,11 @@ class Player(BaseModel):
         # if a player has not spoken yet, return a very old round to exagerate the time since last speech
         return self.spoke_at_rounds[-1] if self.spoke_at_rounds else -4
 
+def werewolves_count(num_players: int) -> int:
+    """The number of werewolves of a game, see WEREWOLF_RATIO."""
+    return max(2 if num_players < 12 else 3, round(num_players * WEREWOLF_RATIO))
+
+
 def name(player_or_list) -> str:
     if player_or_list is None:
         return "None"
@@ -77,11 +112,44 @@ def name(player_or_list) -> str:
         return str(player_or_list)
 
 
+class Roster:
+    """
+    The players of a game, indexed by name, and the players still alive.
+    The alive players are updated incrementally when a player is eliminated, instead of being
+    searched for in the list of players every time.
+    """
+
+    def __init__(self, players: List[Player]):
+        self.players: List[Player] = players
+        self.by_name: Dict[str, Player] = {player.name: player for player in players}
+        # dicts keep the insertion order, so that alive players stay in the order of the players
+        self.alive: Dict[str, Player] = {player.name: player for player in players if player.is_alive}
+        self._alive_list: Optional[List[Player]] = None
+
+    def get(self, player_name: Optional[str]) -> Optional[Player]:
+        return self.by_name.get(player_name) if player_name is not None else None
+
+    def is_alive(self, player_name: Optional[str]) -> bool:
+        return player_name in self.alive
+
+    def actives(self) -> List[Player]:
+        """The alive players. The list is cached until the next elimination, don't modify it."""
+        if self._alive_list is None:
+            self._alive_list = list(self.alive.values())
+        return self._alive_list
+
+    def eliminate(self, player: Player) -> None:
+        player.is_alive = False
+        del self.alive[player.name]
+        self._alive_list = None
+
+
 class Intent(BaseModel):
     player_name: str
     want_to_speak: bool
     want_to_interrupt: bool
     vote_for: Optional[str] = None
+    vote_ranking: Optional[List[str]] = None  # only for ranked werewolf votes, preferred target first
 
 
 class ConsoleLogger(Logger):
@@ -96,54 +164,270 @@ class ConsoleLogger(Logger):
         self.msg_id += 1
 
 
+class NullLogger(Logger):
+    """Drops all entries, for games nobody watches (tournaments, benchmarks)."""
+
+    def log(self, entry: GameLogEntry) -> None:
+        pass
+
+
+class MultiLogger(Logger):
+    """Sends every entry to several loggers, e.g. the web page and the SQLite archive."""
+
+    def __init__(self, loggers: List[Logger]):
+        self.loggers: List[Logger] = loggers
+
+    def log(self, entry: GameLogEntry) -> None:
+        for logger in self.loggers:
+            logger.log(entry)
+
+    def close(self) -> None:
+        for logger in self.loggers:
+            logger.close()
+
+
+def response_text(response: httpx.Response) -> str:
+    return response.text.strip()
+
+
+def endpoint_url(base_url: str, path: str) -> str:
+    """Join a player's base url and an endpoint path with a single slash."""
+    return f"{base_url.rstrip('/')}/{path.lstrip('/')}"
+
+
+class LatencyTracker:
+    """
+    Response times of each player (or server), from which their deadlines are derived.
+
+    The average and deviation are exponentially weighted moving averages, as TCP estimates its
+    retransmission timeout, and the last LATENCY_WINDOW response times are kept for percentiles.
+    """
+
+    def __init__(self, max_timeout: float = API_TIMEOUT):
+        self.max_timeout: float = max_timeout
+        self.average: Dict[str, float] = {}
+        self.deviation: Dict[str, float] = {}
+        self.samples: Dict[str, deque] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        samples = self.samples.setdefault(key, deque(maxlen=LATENCY_WINDOW))
+        if not samples:
+            self.average[key] = seconds
+            self.deviation[key] = seconds / 2
+        else:
+            self.deviation[key] += LATENCY_BETA * (abs(seconds - self.average[key]) - self.deviation[key])
+            self.average[key] += LATENCY_ALPHA * (seconds - self.average[key])
+        samples.append(seconds)
+
+    def percentile(self, key: str, p: float) -> Optional[float]:
+        """Nearest-rank percentile of the recent response times, None if there are not enough of them."""
+        samples = self.samples.get(key)
+        if samples is None or len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        values = sorted(samples)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    def timeout(self, key: str) -> float:
+        """
+        The deadline of the next request: average + TIMEOUT_DEVIATIONS * deviation,
+        between MIN_TIMEOUT and max_timeout. max_timeout until the player answered LATENCY_MIN_SAMPLES times.
+        """
+        samples = self.samples.get(key)
+        if samples is None or len(samples) < LATENCY_MIN_SAMPLES:
+            return self.max_timeout
+        return min(self.max_timeout, max(MIN_TIMEOUT, self.average[key] + TIMEOUT_DEVIATIONS * self.deviation[key]))
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {
+            key: {
+                "count": len(samples),
+                "average": self.average[key],
+                "p50": self.percentile(key, 50),
+                "p95": self.percentile(key, 95),
+                "timeout": self.timeout(key),
+            }
+            for key, samples in self.samples.items()
+        }
+
+
 class ApiCalls:
-    """Handles all API communications with players."""
-    
-    @staticmethod
-    def post_new_game(player: Player, players_names: List[str], werewolves_cnt:int, werewolves: List[Optional[str]]) -> int:
+    """
+    Handles all API communications with players.
+
+    All the calls share a single asyncio HTTP client, so that connections to the player servers
+    are kept alive and reused between messages instead of being opened for every request.
+
+    Each request gets a deadline derived from the past response times of its player (see LatencyTracker),
+    so that a slow player doesn't get the full API_TIMEOUT once it is known to answer faster.
+    With hedge=True, a slow request is sent a second time to servers that deduplicate requests,
+    and the first response wins.
+    """
+
+    def __init__(self, timeout: float = API_TIMEOUT, hedge: bool = False):
+        self.timeout: float = timeout
+        self.hedge: bool = hedge
+        self.latency: LatencyTracker = LatencyTracker(timeout)
+        # number of hedged requests sent
+        self.hedged: int = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        # servers that don't implement /batch_notify, their players are notified one by one
+        self._no_batch_servers: set = set()
+        # servers that echo REQUEST_ID_HEADER: a repeated request is answered without being handled twice
+        self._deduplicating_servers: set = set()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created lazily so that the pool is bound to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY
+                )
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the connection pool."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, url: str, key: str, server: str, json: Any = None, timeout: Optional[float] = None,
+                    hedge: bool = False) -> httpx.Response:
+        """
+        POST to url within the deadline of `key`, and record the response time of `key`.
+
+        Args:
+            url: The endpoint
+            key: Whose response times give the deadline, e.g. "Aline notify"
+            server: The api_base_url of the player(s)
+            json: The body of the request
+            timeout: A fixed deadline instead of the one of `key`
+            hedge: Send the request a second time, with the same request id, if no response came
+                after the HEDGE_PERCENTILE of `key` (and MIN_HEDGE_DELAY). Only done if self.hedge and the server deduplicates requests
+
+        Returns:
+            The first response, whatever its status
+
+        Raises:
+            httpx.TimeoutException: if no response came before the deadline
+            httpx.HTTPError: if every request failed
+        """
+        deadline = timeout if timeout is not None else self.latency.timeout(key)
+        # e.g. "Aline notify" or "http://localhost:5001/ batch_notify"
+        player, _, endpoint = key.rpartition(" ")
+        # shown on the track of the player, the server's spans of the request are its children (see tracing.py)
+        with span(endpoint, track=player, url=url):
+            API_REQUESTS.inc(endpoint=endpoint, player=player)
+            request_id = uuid.uuid4().hex
+            start = time.perf_counter()
+            hedge_delay = self.latency.percentile(key, HEDGE_PERCENTILE) if hedge and self.hedge and server in self._deduplicating_servers else None
+            if hedge_delay is not None:
+                hedge_delay = max(hedge_delay, MIN_HEDGE_DELAY)
+            hedge_at = start + hedge_delay if hedge_delay is not None and hedge_delay < deadline else None
+
+            request_headers = {REQUEST_ID_HEADER: request_id, **trace_headers()}
+
+            def send(remaining: float) -> asyncio.Task:
+                return asyncio.create_task(self.client.post(url, json=json, headers=request_headers, timeout=remaining))
+
+            attempts = [send(deadline)]
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            try:
+                while pending:
+                    wake_at = hedge_at if hedge_at is not None else start + deadline
+                    done, pending = await asyncio.wait(pending, timeout=max(0.0, wake_at - time.perf_counter()),
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    for attempt in done:
+                        if attempt.exception() is None:
+                            response = attempt.result()
+                            self.latency.record(key, time.perf_counter() - start)
+                            API_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, player=player)
+                            if response.headers.get(REQUEST_ID_HEADER) == request_id:
+                                self._deduplicating_servers.add(server)
+                            annotate(status=response.status_code, attempts=len(attempts))
+                            return response
+                        error = attempt.exception()
+                    if hedge_at is not None and time.perf_counter() >= hedge_at:
+                        hedge_at = None
+                        if pending:
+                            LOG.debug("--> hedged request to %s after %.2fs", url, hedge_delay)
+                            self.hedged += 1
+                            API_HEDGED.inc(endpoint=endpoint, player=player)
+                            attempts.append(send(start + deadline - time.perf_counter()))
+                            pending.add(attempts[-1])
+                    elif not done:
+                        break
+            finally:
+                for attempt in attempts:
+                    attempt.cancel()
+
+            if pending or isinstance(error, httpx.TimeoutException):
+                # a timeout counts as a slow response, so that the deadline of the next request is longer
+                self.latency.record(key, deadline)
+                API_FAILURES.inc(endpoint=endpoint, player=player, reason="timeout")
+                annotate(timeout=deadline, attempts=len(attempts))
+                raise httpx.TimeoutException(f"no response after {deadline:.1f}s")
+            API_FAILURES.inc(endpoint=endpoint, player=player, reason="error")
+            raise error
+
+    async def post_new_game(self, player: Player, players_names: List[str], werewolves_cnt:int, werewolves: List[Optional[str]],
+                            game_id: Optional[str] = None, seers_cnt: int = 1) -> int:
         """
         Send a POST request to /new_game endpoint.
         
         Args:
             player: The player
+            game_id: The game of the player, so that its server can drop the players of the game once it is over
+            seers_cnt: The number of seers of the game, 0 in the small games
             
         Returns:
-            bool: True if the player is connected, False otherwise
+            int: the player_id given by the player's server, -1 if the player is not connected
         """
         try:
-            LOG.debug(f"--> new_game for {player.name} ({player.role})")
-            response = requests.post(
-                f"{player.api_base_url}/new_game", 
+            LOG.debug("--> new_game for %s (%s)", player.name, player.role)
+            response = await self._post(
+                endpoint_url(player.api_base_url, "new_game"),
+                f"{player.name} new_game",
+                player.api_base_url,
                 json={
                     "role": player.role, 
                     "player_name": player.name, 
                     "players_names": players_names,
                     "werewolves_count" : werewolves_cnt,
-                    "werewolves": werewolves
-                }, 
-                timeout=API_TIMEOUT
+                    "werewolves": werewolves,
+                    "seers_count": seers_cnt,
+                    "game_id": game_id
+                },
+                timeout=self.timeout
             )
-            LOG.debug(f"<-- new_game response from {player.name}: {str(response.text).strip()}")
+            LOG.debug("<-- new_game response from %s: %s", player.name, Lazy(response_text, response))
             response.raise_for_status()
             # get the player_id
             player_id = response.json()["player_id"]
             return player_id
         except Exception as e:
-            LOG.warning(f"Error in post_new_game for {player.name}: {str(e)}")
+            LOG.warning("Error in post_new_game for %s: %s", player.name, e)
             return -1
     
-    @staticmethod
-    def post_speech(player: Player) -> Optional[str]:
+    async def post_speech(self, player: Player) -> Optional[str]:
         """
         Send a POST request to /speech endpoint.
+        A player who doesn't speak in time is eliminated, so speeches always get the full timeout (and may be hedged).
         
         Args:
             player: The player
         """
         try:
-            LOG.debug(f"--> speech for player {player.name}")
-            response = requests.post(f"{player.api_endpoint}/speak", timeout=API_TIMEOUT)
-            LOG.debug(f"<-- speech response from {player.name}: {str(response.text).strip()}")
+            LOG.debug("--> speech for player %s", player.name)
+            response = await self._post(endpoint_url(player.api_endpoint, "speak"), f"{player.name} speak", player.api_base_url,
+                                        timeout=self.timeout, hedge=True)
+            LOG.debug("<-- speech response from %s: %s", player.name, Lazy(response_text, response))
             response.raise_for_status()
             j = response.json()
             # check if the response is valid
@@ -152,14 +436,13 @@ class ApiCalls:
             speech = j["speech"]
             assert type(speech) == str, f"Speech is not a string: {speech}"
             if len(speech) == 0:
-                LOG.warning(f"Speech is empty for {player.name}")
+                LOG.warning("Speech is empty for %s", player.name)
             return speech
         except Exception as e:
-            LOG.warning(f"Error in post_speech for {player.name}: {str(e)}")
+            LOG.warning("Error in post_speech for %s: %s", player.name, e)
             return None
     
-    @staticmethod
-    def post_notify(player: Player, message: str) -> Optional[Intent]:
+    async def post_notify(self, player: Player, message: str) -> Optional[Intent]:
         """
         Send a POST request to /notify endpoint.
         
@@ -171,56 +454,292 @@ class ApiCalls:
             Dict: The intent response from the player
         """
         try:
-            LOG.debug(f"--> notify for {player.name}: {message}")
-            response = requests.post(f"{player.api_endpoint}/notify", json={"message": message}, timeout=API_TIMEOUT)
-            LOG.debug(f"<-- notify response from {player.name}: {str(response.text).strip()}")
+            LOG.debug("--> notify for %s: %s", player.name, message)
+            response = await self._post(endpoint_url(player.api_endpoint, "notify"), f"{player.name} notify", player.api_base_url,
+                                        json={"message": message}, hedge=True)
+            LOG.debug("<-- notify response from %s: %s", player.name, Lazy(response_text, response))
             response.raise_for_status()
-            j = response.json()
-            # check if the response is valid
-            assert type(j) == dict, f"Response is not a dictionary: {j}"
-            assert "want_to_speak" in j, f"want_to_speak is not in the response: {j}"
-            assert "want_to_interrupt" in j, f"want_to_interrupt is not in the response: {j}"
-            assert "vote_for" in j, f"vote_for is not in the response: {j}"
-            return Intent(player_name=player.name, want_to_speak=j["want_to_speak"], want_to_interrupt=j["want_to_interrupt"], vote_for=j["vote_for"])
-        except requests.exceptions.Timeout:
-            LOG.warning(f"Timeout in post_notify for player {player.name} after {API_TIMEOUT}s")
+            return self.parse_intent(player, response.json())
+        except httpx.TimeoutException as e:
+            LOG.warning("Timeout in post_notify for player %s: %s", player.name, e)
+            return None
+        except Exception as e:
+            LOG.warning("Error in post_notify for player %s: %s", player.name, e)
             return None
+
+    async def post_batch_notify(self, players: List[Player], message: str) -> Dict[str, Optional[Intent]]:
+        """
+        Send a single POST request to the /batch_notify endpoint of a server hosting several players.
+        Falls back to one /notify per player if the server doesn't implement /batch_notify.
+        The server answers within the longest deadline of the players, without the players that are late.
+
+        Args:
+            players: The players to notify, all hosted on the same api_base_url
+            message: The message to send
+
+        Returns:
+            Dict: The intent of each player (None for invalid responses), by player name
+        """
+        base_url = players[0].api_base_url
+        assert all(p.api_base_url == base_url for p in players), "All players must be hosted on the same server"
+        if base_url not in self._no_batch_servers:
+            deadline = max(self.latency.timeout(f"{p.name} notify") for p in players)
+            try:
+                LOG.debug("--> batch_notify for %s: %s", Lazy(name, players), message)
+                response = await self._post(
+                    endpoint_url(base_url, "batch_notify"),
+                    f"{base_url} batch_notify",
+                    base_url,
+                    # the server stops waiting for its players a little earlier, so that its answer arrives in time
+                    json={"player_ids": [p.player_id for p in players], "message": message, "timeout": deadline * 0.9},
+                    timeout=deadline,
+                    hedge=True
+                )
+                LOG.debug("<-- batch_notify response from %s: %s", base_url, Lazy(response_text, response))
+                if response.status_code in (404, 405):
+                    LOG.info("%s doesn't support batch_notify, notifying its players one by one", base_url)
+                    self._no_batch_servers.add(base_url)
+                else:
+                    response.raise_for_status()
+                    j = response.json()
+                    assert type(j) == dict and type(j.get("intents")) == dict, f"intents is not in the response: {j}"
+                    errors = j.get("errors") or {}
+                    latencies = j.get("latencies") or {}
+                    intents: Dict[str, Optional[Intent]] = {}
+                    for player in players:
+                        if str(player.player_id) in latencies:
+                            self.latency.record(f"{player.name} notify", latencies[str(player.player_id)])
+                            API_LATENCY.observe(latencies[str(player.player_id)], endpoint="notify", player=player.name)
+                        if str(player.player_id) in errors:
+                            LOG.warning("Error in batch_notify for player %s: %s", player.name, errors[str(player.player_id)])
+                            # the server doesn't wait for its late players (see werewolf_server.py's batch_notify)
+                            reason = "timeout" if errors[str(player.player_id)].startswith("No response") else "error"
+                            API_FAILURES.inc(endpoint="notify", player=player.name, reason=reason)
+                            intents[player.name] = None
+                            continue
+                        try:
+                            intents[player.name] = self.parse_intent(player, j["intents"][str(player.player_id)])
+                        except Exception as e:
+                            LOG.warning("Error in batch_notify for player %s: %s", player.name, e)
+                            intents[player.name] = None
+                    return intents
+            except httpx.TimeoutException as e:
+                LOG.warning("Timeout in post_batch_notify for %s: %s", base_url, e)
+                return {player.name: None for player in players}
+            except Exception as e:
+                LOG.warning("Error in post_batch_notify for %s: %s", base_url, e)
+                return {player.name: None for player in players}
+
+        results = await asyncio.gather(*[self.post_notify(player, message) for player in players])
+        return {player.name: intent for player, intent in zip(players, results)}
+
+    async def post_warmup(self, player: Player) -> Optional[float]:
+        """
+        Send a POST request to /warmup endpoint, so that the player opens its LLM client.
+        Servers without /warmup are only pinged, which still opens a pooled connection to them.
+
+        Args:
+            player: The player
+
+        Returns:
+            float: the time in seconds the player took to be ready, None if it did not answer
+        """
+        start = time.perf_counter()
+        try:
+            LOG.debug("--> warmup for %s", player.name)
+            response = await self._post(endpoint_url(player.api_endpoint, "warmup"), f"{player.name} warmup", player.api_base_url,
+                                        timeout=self.timeout)
+            if response.status_code in (404, 405):
+                response = await self.client.get(player.api_base_url)
+            LOG.debug("<-- warmup response from %s: %s", player.name, Lazy(response_text, response))
+            response.raise_for_status()
+            return time.perf_counter() - start
         except Exception as e:
-            LOG.warning(f"Error in post_notify for player {player.name}: {e}")
+            LOG.warning("Error in post_warmup for %s: %s", player.name, e)
             return None
 
+    async def post_end_game(self, server: str, game_id: str) -> None:
+        """
+        Send a POST request to /end_game endpoint, so that the server drops the players of the game.
+        """
+        try:
+            response = await self._post(endpoint_url(server, "end_game"), f"{server} end_game", server,
+                                        json={"game_id": game_id}, timeout=self.timeout)
+            if response.status_code in (404, 405):
+                LOG.debug("%s doesn't drop the players of its games", server)
+                return
+            response.raise_for_status()
+        except Exception as e:
+            LOG.warning("Error in post_end_game for %s: %s", server, e)
+
+    async def get_trace(self, server: str, trace_id: str) -> List[Dict[str, Any]]:
+        """
+        Fetch the spans of a trace from a player server (see tracing.py).
+
+        Returns:
+            The spans of the requests of the trace handled by the server, none if the server doesn't trace requests
+        """
+        try:
+            response = await self.client.get(endpoint_url(server, f"trace/{trace_id}"), timeout=self.timeout)
+            if response.status_code == 404:
+                LOG.info("%s doesn't trace its requests", server)
+                return []
+            response.raise_for_status()
+            return response.json()["spans"]
+        except Exception as e:
+            LOG.warning("Error in get_trace for %s: %s", server, e)
+            return []
+
+    @staticmethod
+    def parse_intent(player: Player, j: Any) -> Intent:
+        """
+        Check that a /notify response follows the schema and convert it to an Intent.
+        """
+        assert type(j) == dict, f"Response is not a dictionary: {j}"
+        assert "want_to_speak" in j, f"want_to_speak is not in the response: {j}"
+        assert "want_to_interrupt" in j, f"want_to_interrupt is not in the response: {j}"
+        assert "vote_for" in j, f"vote_for is not in the response: {j}"
+        vote_ranking = j.get("vote_ranking")  # optional, players that don't rank only give vote_for
+        assert vote_ranking is None or type(vote_ranking) == list, f"vote_ranking is not a list: {j}"
+        return Intent(player_name=player.name, want_to_speak=j["want_to_speak"], want_to_interrupt=j["want_to_interrupt"], vote_for=j["vote_for"],
+                      vote_ranking=vote_ranking)
+
+
+class RecordingApiCalls:
+    """
+    Wraps the ApiCalls of a game and logs every response of the players, as private PLAYER_RESPONSE entries
+    with the message, the response and its latency, so that replay.py can replay the game without the players.
+    """
+
+    def __init__(self, api: ApiCalls, log: Callable[[GameLogEntry], None]):
+        self.api: ApiCalls = api
+        self.log: Callable[[GameLogEntry], None] = log
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.api, attribute)
+
+    def _record(self, player: Player, call: str, message: Optional[str], response: Any, latency: float) -> None:
+        self.log(GameLogEntry(
+            type="PLAYER_RESPONSE",
+            actor_name=player.name,
+            content=message or "",
+            public=False,
+            context_data={"call": call, "message": message, "response": response, "latency": latency}
+        ))
+
+    async def post_new_game(self, player: Player, players_names: List[str], werewolves_cnt: int, werewolves: List[Optional[str]],
+                            game_id: Optional[str] = None, seers_cnt: int = 1) -> int:
+        start = time.perf_counter()
+        player_id = await self.api.post_new_game(player, players_names, werewolves_cnt, werewolves, game_id, seers_cnt)
+        self._record(player, "new_game", None, player_id, time.perf_counter() - start)
+        return player_id
+
+    async def post_speech(self, player: Player) -> Optional[str]:
+        start = time.perf_counter()
+        speech = await self.api.post_speech(player)
+        self._record(player, "speak", None, speech, time.perf_counter() - start)
+        return speech
+
+    async def post_notify(self, player: Player, message: str) -> Optional[Intent]:
+        start = time.perf_counter()
+        intent = await self.api.post_notify(player, message)
+        self._record(player, "notify", message, intent.model_dump(exclude={"player_name"}) if intent is not None else None,
+                     time.perf_counter() - start)
+        return intent
+
+    async def post_batch_notify(self, players: List[Player], message: str) -> Dict[str, Optional[Intent]]:
+        start = time.perf_counter()
+        intents = await self.api.post_batch_notify(players, message)
+        latency = time.perf_counter() - start
+        # recorded as one notify per player, a replay doesn't depend on how the players are hosted
+        for player in players:
+            intent = intents.get(player.name)
+            self._record(player, "notify", message, intent.model_dump(exclude={"player_name"}) if intent is not None else None, latency)
+        return intents
+
+    async def post_warmup(self, player: Player) -> Optional[float]:
+        start = time.perf_counter()
+        latency = await self.api.post_warmup(player)
+        self._record(player, "warmup", None, latency, time.perf_counter() - start)
+        return latency
+
 
 class GameLeader:
     
-    def __init__(self, players: List[Player], logger: Logger = ConsoleLogger()):
+    def __init__(self, players: List[Player], logger: Logger = ConsoleLogger(), api: Optional[ApiCalls] = None,
+                 seed: Optional[int] = None, game_id: Optional[str] = None, wolf_consensus: str = WOLF_CONSENSUS_ROUNDS,
+                 record_responses: bool = False, trace: bool = False, profiler: Optional[Profiler] = None):
         """
         Initialize a new game.
         
         Args:
-            player_ids: List of player identifiers
+            players: List of players
+            logger: Where the game events are logged
+            api: The API used to talk to the players, can be shared by several games
+            seed: Seed of the random choices of the leader (roles, speakers, ties), random if None
+            game_id: Identifier of the game, generated if None
+            wolf_consensus: How the werewolves agree on a victim, WOLF_CONSENSUS_ROUNDS or WOLF_CONSENSUS_RANKED
+            record_responses: Log the responses of the players too, so that the game can be replayed (see replay.py)
+            trace: Record the spans of the game and of its requests, see export_trace
+            profiler: Profiles the night, the discussion and the vote of each day (see profiling.py), if any
         """
         # list of players. players are not removed from this list, but set to is_alive = False
         self.players: List[Player] = players
+        self.roster: Roster = Roster(players)  # index of the players by name, and of the alive players
         self.__game_log: List[GameLogEntry] = []  # don't call this directly, use log() instead
-        self.api: ApiCalls = ApiCalls()
+        self.api: ApiCalls = api if api is not None else ApiCalls()
+        if record_responses:
+            self.api = RecordingApiCalls(self.api, self._log_response)
         self.logger: Logger = logger
+        self._seq: int = 0  # sequence number of the next entry logged
         self.round: int = 0  # increased everytime a player speaks (not the leader)
+        # always known, so that the game can be replayed
+        self.seed: int = seed if seed is not None else random.randrange(2**32)
+        self.rng: random.Random = random.Random(self.seed)
+        self.game_id: str = game_id if game_id is not None else uuid.uuid4().hex[:12]
+        self.day: int = 0  # number of nights played
+        self.phase_durations: Dict[str, List[float]] = {"night": [], "day": []}  # wall-clock seconds
+        assert wolf_consensus in (WOLF_CONSENSUS_ROUNDS, WOLF_CONSENSUS_RANKED), f"Invalid wolf_consensus: {wolf_consensus}"
+        self.wolf_consensus: str = wolf_consensus
+        # the messages still being delivered in the background, by player name (see announce_to_all's wait_for)
+        self._deliveries: Dict[str, asyncio.Task] = {}
+        self.tracer: Tracer = Tracer(enabled=trace)
+        self.profiler: Profiler = profiler if profiler is not None else Profiler(enabled=False)
 
 
     def log(self, entry: GameLogEntry) -> None:
+        entry.game_id = self.game_id
+        entry.seq = self._seq
+        self._seq += 1
         self.logger.log(entry)
         self.__game_log.append(entry)
 
+    def _log_response(self, entry: GameLogEntry) -> None:
+        # a response is not an event of the game, e.g. it must not change last_player_to_speak
+        entry.game_id = self.game_id
+        entry.seq = self._seq
+        self._seq += 1
+        self.logger.log(entry)
+
 
     def get_player_by_name(self, name: str) -> Optional[Player]:
-        return next((player for player in self.players if player.name == name), None)
+        return self.roster.get(name)
+
+
+    def is_active(self, player_name: Optional[str]) -> bool:
+        """
+        Check if a player is in the game and alive.
+        """
+        return self.roster.is_alive(player_name)
 
 
     def players_actives(self, exclude_player: Optional[str] = None) -> List[Player]:
         """
-        Get a list of all active players.
+        Get a list of all active players. Don't modify the returned list.
         """
-        return [p for p in self.players if p.is_alive and p.name != exclude_player]
+        if not self.roster.is_alive(exclude_player):
+            return self.roster.actives()
+        return [p for p in self.roster.actives() if p.name != exclude_player]
 
 
     def last_player_to_speak(self) -> Optional[str]:
@@ -230,40 +749,92 @@ class GameLeader:
             return None
 
 
-    def start_game(self) -> bool:
+    @traced
+    async def start_game(self) -> bool:
         """
         Start a new game by assigning roles and notifying players.
         
         Returns:
             bool: True if game started successfully, False otherwise
         """
+        # everything needed to replay the game from its responses, see replay.py
+        self.log(GameLogEntry(
+            type="GAME_START",
+            content=f"Nouvelle partie avec {len(self.players)} joueurs",
+            public=False,
+            context_data={
+                "seed": self.seed,
+                "wolf_consensus": self.wolf_consensus,
+                "players": [player.model_dump(include={"name", "is_female", "api_base_url"}) for player in self.players]
+            }
+        ))
+
         # Create role distribution
         werewolves = self._assign_roles()
 
         players_names = [player.name for player in self.players]
+        seers = sum(player.role == SEER for player in self.players)
         
-        # Initialize player states
+        # Initialize player states, all players at once
+        tasks = {
+            asyncio.create_task(self.api.post_new_game(
+                player, players_names, len(werewolves),
+                werewolves if player.role == WEREWOLF else [],  # only show werewolves to each other
+                game_id=self.game_id, seers_cnt=seers
+            )): player
+            for player in self.players
+        }
         success = True
-        for player in self.players:
-            if player.role == WEREWOLF:  # only show werewolves to each other
-                player_id = self.api.post_new_game(player, players_names, len(werewolves), werewolves)
-            else:
-                player_id = self.api.post_new_game(player, players_names, len(werewolves), [])
-            if player_id < 0:
-                success = False
-                self.log(GameLogEntry(
-                    type="ERROR",
-                    content=f"Failed to start game for player {player.name}",
-                    context_data={"werewolves": werewolves, "players_names": players_names}
-                ))
-                break
-            else:
-                # update player's api
-                player.api_endpoint = f"{player.api_base_url}{player_id}/"
+        pending = set(tasks)
+        while pending and success:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                player = tasks[task]
+                player_id = task.result()
+                if player_id < 0:
+                    success = False
+                    self.log(GameLogEntry(
+                        type="ERROR",
+                        content=f"Failed to start game for player {player.name}",
+                        context_data={"werewolves": werewolves, "players_names": players_names}
+                    ))
+                else:
+                    # update player's api
+                    player.player_id = player_id
+                    player.api_endpoint = f"{player.api_base_url}{player_id}/"
+
+        # fail fast: no need to wait for the other players if one of them could not join
+        for task in pending:
+            task.cancel()
         
         return success
 
 
+    @traced
+    async def warm_up(self) -> Dict[str, Optional[float]]:
+        """
+        Prime the connections to every player's server, and their LLM backends, before the first night.
+        Must be called after start_game.
+
+        Returns:
+            The readiness latency of each player in seconds, None if the player did not answer
+        """
+        latencies = await asyncio.gather(*[self.api.post_warmup(player) for player in self.players])
+        readiness = {player.name: latency for player, latency in zip(self.players, latencies)}
+        for player_name, latency in readiness.items():
+            if latency is not None:
+                LOG.info("%s ready in %.3fs", player_name, latency)
+            else:
+                LOG.info("%s is not ready", player_name)
+        self.log(GameLogEntry(
+            type="WARMUP",
+            content=f"{sum(latency is not None for latency in latencies)}/{len(latencies)} joueurs sont prêts",
+            public=False,
+            context_data={"readiness": readiness}
+        ))
+        return readiness
+
+
     def _assign_roles(self) -> List[str]:
         """
         Assign roles to players randomly.
@@ -272,7 +843,7 @@ class GameLeader:
             A list of werewolves' names
         """
         num_players = len(self.players)
-        num_werewolves = 2 if num_players < 12 else 3  # according to rules
+        num_werewolves = werewolves_count(num_players)  # according to rules
         has_seer = num_players >= 5  # Only add seer if enough players
         
         # Create list of roles
@@ -287,7 +858,7 @@ class GameLeader:
         werewolves = []
         
         # Shuffle roles and assign to players
-        random.shuffle(all_roles)
+        self.rng.shuffle(all_roles)
         for player, role in zip(self.players, all_roles):
             player.role = role
             if role == WEREWOLF:
@@ -314,12 +885,11 @@ class GameLeader:
         alive_villagers = 0
         
         # count alive players by role
-        for player in self.players:
-            if player.is_alive:
-                if player.role == WEREWOLF:
-                    alive_werewolves += 1
-                else:
-                    alive_villagers += 1
+        for player in self.players_actives():
+            if player.role == WEREWOLF:
+                alive_werewolves += 1
+            else:
+                alive_villagers += 1
         
         # check win conditions
         if alive_werewolves == 0:
@@ -338,86 +908,154 @@ class GameLeader:
             player: The player to eliminate
             phase: Whether night or day
         """
-        assert player in self.players and player.is_alive, f"{player.name} is not in the game or is not alive"
-        player.is_alive = False
+        assert self.roster.get(player.name) is player and player.is_alive, f"{player.name} is not in the game or is not alive"
+        self.roster.eliminate(player)
         
 
-    def announce_to_one(self, player: Player, msg: str) -> Optional[Intent]:
+    def _deliver(self, players: List[Player], send: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Call send() as a task, once the messages left in the background for these players are delivered.
+        A broadcast can return before all its messages are delivered (see announce_to_all's wait_for),
+        so the next message to a player waits for them instead of overtaking them.
+        The task is the player's last delivery as soon as it is created: a message sent concurrently
+        (e.g. the werewolf vote during the seer's turn) waits for it too.
+        """
+        previous = {self._deliveries[p.name] for p in players if p.name in self._deliveries and not self._deliveries[p.name].done()}
+
+        async def deliver():
+            if previous:
+                await asyncio.wait(previous)
+            return await send()
+
+        task = asyncio.create_task(deliver())
+        for player in players:
+            self._deliveries[player.name] = task
+        return task
+
+    async def flush(self) -> None:
+        """Wait until all the messages sent to the players are delivered."""
+        pending = {task for task in self._deliveries.values() if not task.done()}
+        if pending:
+            await asyncio.wait(pending)
+
+    async def announce_to_one(self, player: Player, msg: str) -> Optional[Intent]:
         """ 
         Announce a message to a single player.
         """
-        return self.api.post_notify(player, msg)
+        return await self._deliver([player], partial(self.api.post_notify, player, msg))
 
 
     def print_game_summary(self, verbose: bool = False) -> None:
         # print a summary of the game so far
         LOG.info("*" * 80)
-        LOG.info(f"Game summary:")
-        LOG.info(f"Initial werewolves: {[player.name for player in self.players if player.role == WEREWOLF]}")
-        LOG.info(f"Initial seer: {name(next((player for player in self.players if player.role == SEER), None))}")
+        LOG.info("Game summary:")
+        LOG.info("Initial werewolves: %s", Lazy(lambda: [player.name for player in self.players if player.role == WEREWOLF]))
+        LOG.info("Initial seer: %s", Lazy(lambda: name(next((player for player in self.players if player.role == SEER), None))))
         
         
         if verbose:
             # litst all messages
             for log_entry in self.__game_log:
                 actor_name = f"[{log_entry.actor_name}]" if log_entry.actor_name != "GameLeader" else ""
-                LOG.info(f"{log_entry.type}: {actor_name} {log_entry.content}")
+                LOG.info("%s: %s %s", log_entry.type, actor_name, log_entry.content)
         else:
             # list who has been eliminated since last night
             for log_entry in self.__game_log:
                 if log_entry.type == "VOTE_RESULT":
-                    LOG.info(f"Villageois ont éliminé   {log_entry.context_data.get('victim', "personne")} (rôle {log_entry.context_data.get('victim_role', "aucun")}).")
+                    LOG.info("Villageois ont éliminé   %s (rôle %s).", log_entry.context_data.get('victim', "personne"),
+                             log_entry.context_data.get('victim_role', "aucun"))
                 if log_entry.type == "MORNING_VICTIM":
-                    LOG.info(f"Loups-garous ont éliminé {log_entry.context_data.get('victim', "personne")} (rôle {log_entry.context_data.get('victim_role', "aucun")}).")
+                    LOG.info("Loups-garous ont éliminé %s (rôle %s).", log_entry.context_data.get('victim', "personne"),
+                             log_entry.context_data.get('victim_role', "aucun"))
         
-        LOG.info(f"Active players: {name(self.players_actives())}")
-        LOG.info(f"Active werewolves: {[player.name for player in self.players_actives() if player.role == WEREWOLF]}")
+        LOG.info("Active players: %s", Lazy(name, self.players_actives()))
+        LOG.info("Active werewolves: %s", Lazy(lambda: [player.name for player in self.players_actives() if player.role == WEREWOLF]))
 
         LOG.info("*" * 80)
 
 
-    def announce_to_all(self, msg: str, exclude_player: Optional[str] = None) -> List[Optional[Intent]]:
+    @traced
+    async def announce_to_all(self, msg: str, exclude_player: Optional[str] = None,
+                              wait_for: Optional[List[str]] = None) -> List[Optional[Intent]]:
         """
-        Announce a message to all active players asynchronously using ThreadPoolExecutor.
+        Announce a message to all active players, see announce_to.
+        Traced on its own, so that the traces tell the broadcasts from the announcements to some players (its span
+        holds the announce_to one).
+
+        Args:
+            msg: The message
+            exclude_player: A player who doesn't get the message (e.g. the speaker)
+            wait_for: The players whose intents are needed, None for all the players
+
+        Returns:
+            The intents received, in the order of the players
+        """
+        return await self.announce_to(self.players_actives(exclude_player), msg, wait_for)
+
+
+    @traced
+    async def announce_to(self, players: List[Player], msg: str, wait_for: Optional[List[str]] = None) -> List[Optional[Intent]]:
+        """
+        Announce a message to some players concurrently, over the pooled connections of ApiCalls.
+        Players hosted on the same server are notified with a single /batch_notify request.
+
+        Args:
+            players: The players who get the message
+            msg: The message
+            wait_for: The players whose intents are needed, None for all the players.
+                The announcement returns once they answered, the others get the message in the background.
+
+        Returns:
+            The intents received, in the order of the players
         """
-        active_players = [player for player in self.players_actives() if player.name != exclude_player]
         results = []
+        annotate(message=msg, players=len(players))
         
-        if not active_players:
+        if not players:
             return results
-        
-        with ThreadPoolExecutor(max_workers=len(active_players)) as executor:
-            # Submit all tasks
-            future_to_player = {
-                executor.submit(self.api.post_notify, player, msg): player 
-                for player in active_players
-            }
-            
-            # Wait for completion - each individual API call has its own timeout (API_TIMEOUT)
-            try:
-                for future in as_completed(future_to_player, timeout=API_TIMEOUT):
-                    player = future_to_player[future]
-                    try:
-                        result = future.result()  # This won't block since future is already done
-                        if result is not None:
-                            results.append(result)
-                    except Exception as e:
-                        LOG.info(f"Error getting result from {player.name}: {e}")
-                        
-            except TimeoutError:
-                # This should rarely happen since individual calls have their own timeouts
-                LOG.warning(f"Overall timeout waiting for responses in announce_to_all after {API_TIMEOUT}s")
-                
-            # Handle any remaining futures that didn't complete
-            for future, player in future_to_player.items():
-                if not future.done():
-                    LOG.warning(f"Request to {player.name} did not complete, cancelling")
-                    future.cancel()
+
+        # one request per server
+        players_by_server: Dict[str, List[Player]] = {}
+        for player in players:
+            players_by_server.setdefault(player.api_base_url, []).append(player)
+        tasks = {
+            base_url: self._deliver(
+                server_players,
+                partial(self.api.post_batch_notify, server_players, msg) if len(server_players) > 1
+                else partial(self.api.post_notify, server_players[0], msg)
+            )
+            for base_url, server_players in players_by_server.items()
+        }
+
+        # Wait for the servers of the players that matter - each API call has its own deadline (see ApiCalls)
+        needed = [task for base_url, task in tasks.items()
+                  if wait_for is None or any(p.name in wait_for for p in players_by_server[base_url])]
+        if needed:
+            await asyncio.wait(needed)
+
+        intents: Dict[str, Optional[Intent]] = {}
+        for base_url, task in tasks.items():
+            server_players = players_by_server[base_url]
+            if not task.done():
+                # still being delivered, its intents are not needed
+                continue
+            if task.exception() is not None:
+                LOG.info("Error getting result from %s: %s", name(server_players), task.exception())
+            elif isinstance(task.result(), dict):
+                intents.update(task.result())
+            else:
+                intents[server_players[0].name] = task.result()
+
+        # results are kept in the order of the players, not in the order of arrival
+        for player in players:
+            if intents.get(player.name) is not None:
+                results.append(intents[player.name])
         
         return results
 
 
-    def discussion_segment(self, speaker:Player) -> List[Intent]:
+    @traced
+    async def discussion_segment(self, speaker:Player) -> List[Intent]:
         """
         Conduct a discussion segment by choosing the next speaker, letting them speak and announcing their speech.
 
@@ -427,14 +1065,15 @@ class GameLeader:
         Returns:
             a tuple with the intents of the players after the discussion segment and a boolean indicating if the discussion should continue
         """
-        assert speaker in self.players_actives(), f"{speaker.name} is not in the game or is not alive"
+        assert self.is_active(speaker.name), f"{speaker.name} is not in the game or is not alive"
+        annotate(speaker=speaker.name)
 
         # update round and speaker's spoke_at_rounds
         self.round += 1
         speaker.spoke_at_rounds.append(self.round)
 
         # let the player speak
-        speech = self.api.post_speech(speaker)
+        speech = await self.api.post_speech(speaker)
         if speech is None:
             msg = f"{speaker.name} avec le rôle {speaker.role} n'a pas répondu à temps. Il/elle a été éliminé de la partie."    
             self.log(GameLogEntry(
@@ -443,7 +1082,7 @@ class GameLeader:
                 content=msg,
                 context_data={"reason": "no_speech_response"}
             ))
-            return self.announce_to_all(msg, exclude_player=speaker.name)
+            return await self.announce_to_all(msg, exclude_player=speaker.name)
         else:
             # log the speech
             self.log(GameLogEntry(
@@ -451,169 +1090,195 @@ class GameLeader:
                 actor_name=speaker.name,
                 content=speech
             ))            
-            return self.announce_to_all(f"{speaker.name} a dit: {speech}", exclude_player=speaker.name)
+            return await self.announce_to_all(f"{speaker.name} a dit: {speech}", exclude_player=speaker.name)
 
 
-    def choose_next_speaker(self, intents: List[Intent], discussion_round: int) -> Optional[Player]:
-        """
-        LLM chooses the next speaker from the list of intents, based on game history, player statistics, and current intents.
-        Returns None if we should stop debating for now.
+    def speaker_candidates(self, intents: List[Intent]) -> Tuple[List[str], List[str]]:
         """
+        Filter the intents of the players who can take the floor now.
 
+        Returns:
+            the names of the players who can interrupt, and of those who want to speak
+        """
+        last_player_to_speak = self.last_player_to_speak()
         valid_interrupts: List[str] = [intent.player_name 
                                        for intent in intents 
                                        if intent.want_to_interrupt 
-                                       and intent.player_name != self.last_player_to_speak()
-                                       and self.get_player_by_name(intent.player_name) in self.players_actives()
+                                       and intent.player_name != last_player_to_speak
+                                       and self.is_active(intent.player_name)
                                        and self.get_player_by_name(intent.player_name).number_interruptions < MAX_INTERRUPTIONS]
-        LOG.debug(f"valid_interrupts: {valid_interrupts}")
         valid_want_to_speak: List[str] = [intent.player_name 
                                      for intent in intents 
                                      if intent.want_to_speak 
-                                     and intent.player_name != self.last_player_to_speak()
-                                     and self.get_player_by_name(intent.player_name) in self.players_actives()
-                                     and self.get_player_by_name(intent.player_name).is_alive]
-        LOG.debug(f"valid_want_to_speak: {valid_want_to_speak}")
+                                     and intent.player_name != last_player_to_speak
+                                     and self.is_active(intent.player_name)]
+        return valid_interrupts, valid_want_to_speak
+
+
+    def speaker_weights(self, valid_want_to_speak: List[str], discussion_round: int) -> Dict[Optional[str], int]:
+        """
+        Weights of the players who want to speak, and of None (stop the discussion), used when nobody interrupts.
+
+        - a player who wants to speak weighs SPEAK_WEIGHT,
+        - minus up to CHATTY_PENALTY according to their share of all the speeches so far,
+        - stopping weighs up to STOP_WEIGHT, a sigmoid of the discussion round centered on STOP_MIDPOINT.
+        """
+        weights: Dict[Optional[str], int] = {}
+        total_speeches = sum(len(player.spoke_at_rounds) for player in self.players_actives()) + 1
+        for player_name in valid_want_to_speak:
+            speech_ratio = len(self.get_player_by_name(player_name).spoke_at_rounds) / total_speeches
+            weights[player_name] = max(0, SPEAK_WEIGHT - int(speech_ratio * CHATTY_PENALTY))
+
+        # then silent players. DISABLED for now
+        # for player in self.players_actives(self.last_player_to_speak()):
+        #     haven_t_spoken_since = self.round - player.last_spoke_at_round()
+        #     # more weight if haven't spoken for a long time
+        #     weights[player.name] = weights.get(player.name, 0) + min(30, math.floor(math.exp(0.15 * haven_t_spoken_since)) - 1)
+
+        # smoothly increases from near 0 to STOP_WEIGHT between x = 10 and x = 20 using a scaled sigmoid curve.
+        weights[None] = int(STOP_WEIGHT / (1 + math.exp(-STOP_STEEPNESS * (discussion_round - STOP_MIDPOINT))))
+        return weights
+
+
+    def speaker_distribution(self, intents: List[Intent], discussion_round: int) -> Dict[Optional[str], float]:
+        """
+        Probability of each player to be chosen by choose_next_speaker, None being the probability to stop the discussion.
+        """
+        valid_interrupts, valid_want_to_speak = self.speaker_candidates(intents)
+        if len(valid_interrupts) > 0:
+            return {player_name: 1 / len(valid_interrupts) for player_name in valid_interrupts}
+        if discussion_round > MAX_ROUNDS:
+            return {None: 1.0}
+        weights = self.speaker_weights(valid_want_to_speak, discussion_round)
+        total = sum(weights.values())
+        if total == 0:
+            return {None: 1.0}
+        return {player_name: weight / total for player_name, weight in weights.items() if weight > 0}
+
+
+    def choose_next_speaker(self, intents: List[Intent], discussion_round: int) -> Optional[Player]:
+        """
+        Chooses the next speaker from the list of intents, based on player statistics and current intents.
+        Returns None if we should stop debating for now.
+        """
+
+        valid_interrupts, valid_want_to_speak = self.speaker_candidates(intents)
+        LOG.debug("valid_interrupts: %s", valid_interrupts)
+        LOG.debug("valid_want_to_speak: %s", valid_want_to_speak)
         # strict priority to interrupters. choose at random
         if len(valid_interrupts) > 0:
-            interruptor: Player = self.get_player_by_name(random.choice(valid_interrupts))
+            interruptor: Player = self.get_player_by_name(self.rng.choice(valid_interrupts))
             interruptor.number_interruptions += 1
-            LOG.debug(f"INTERRUPTOR: {name(interruptor)}")
+            LOG.debug("INTERRUPTOR: %s", interruptor.name)
             return interruptor
         
         # hard limits if too many rounds
         if discussion_round > MAX_ROUNDS:
-            LOG.debug(f"discussion_round > MAX_ROUNDS: {discussion_round}")
+            LOG.debug("discussion_round > MAX_ROUNDS: %s", discussion_round)
             return None
-        
-        # first, add 5 * players if  want_to_speak
-        candidates: List[Player] = [self.get_player_by_name(player_name) for player_name in valid_want_to_speak] * 5
-        LOG.debug(f"want_to_speak candidates: {name(candidates)}")
-        
-        # then add silent players. DISABLED for now
-        # for player in self.players_actives(self.last_player_to_speak()):
-        #     haven_t_spoken_since = self.round - player.last_spoke_at_round()
-        #     # add multiple times if haven't spoken for a long time
-        #     factor = min(30, math.floor(math.exp(0.15 * haven_t_spoken_since)) - 1)
-        #     LOG.debug(f"silent player: {player.name} hasn't spoken for {haven_t_spoken_since} rounds, factor: {factor}")
-        #     candidates.extend([player] * factor)
 
-        # then remove players that have spoken too much
-        total_speeches = sum(len(player.spoke_at_rounds) for player in self.players_actives()) + 1
-        for player in self.players_actives():
-            speech_ratio = len(player.spoke_at_rounds) / total_speeches
-            factor = int(speech_ratio * 3)
-            LOG.debug(f"chatty player: {player.name} has spoken {len(player.spoke_at_rounds)} times out of {total_speeches}, speech_ratio: {speech_ratio}, factor: {factor}")
-            for _ in range(factor):
-                if player in candidates:
-                    candidates.remove(player)
-
-        # add multiple None to candidate list. pick a None --> stop this discussion
-        # smoothly increases from near 0 to 50 between x = 10 and x = 20 using a scaled sigmoid curve.
-        factor = int(50 / (1 + math.exp(-1.5 * (discussion_round - 15))))
-        candidates.extend([None] *  factor)
-        LOG.debug(f"number of None added: {factor}")
-        LOG.debug(f"candidates: {name(candidates)}")
-
-        if len(candidates) == 0:
-            LOG.debug(f"no candidates, returning None")
+        weights = self.speaker_weights(valid_want_to_speak, discussion_round)
+        LOG.debug("speaker weights: %s", weights)
+        if sum(weights.values()) == 0:
+            LOG.debug("no candidates, returning None")
             return None
         
-        # choose at random. 
-        chosen = random.choice(candidates)
-        LOG.debug(f"chosen: {name(chosen)}")
-        if chosen is not None:
-            if chosen.name in valid_interrupts:
-                chosen.number_interruptions += 1
+        # choose at random, proportionally to the weights
+        chosen = self.get_player_by_name(self.rng.choices(list(weights.keys()), weights=list(weights.values()))[0])
+        LOG.debug("chosen: %s", Lazy(name, chosen))
         return chosen
 
 
-    def day_time(self, victim: Optional[Player]) -> None:
-    
-        rumors = self.generate_rumors()
+    @traced
+    async def day_time(self, victim: Optional[Player]) -> None:
+        annotate(day=self.day)
+        with self.profiler.phase("discussion"):
+            rumors = self.generate_rumors()
         
-        # annonce de la victime de la nuit passée
-        if victim is None:
-            announcement = f"""C'est le matin, le village se réveille, tout le monde se réveille et ouvre les yeux... Cette nuit, personne n'a été mangé.e par les loups-garous. {rumors}"""
-            self.log(GameLogEntry(
-                type="MORNING_VICTIM",
-                content=announcement,
-                context_data={"victim": None, "victim_role": None, "rumors": rumors}
-            ))
-        else:
-            announcement = f"""C'est le matin, le village se réveille, tout le monde se réveille et ouvre les yeux... Cette nuit, {victim.name} a été mangé.e par les loups-garous. Son rôle était {victim.role}. {rumors}"""
-            self.log(GameLogEntry(
-                type="MORNING_VICTIM",
-                content=announcement,
-                context_data={"victim": victim.name, "victim_role": victim.role, "rumors": rumors}
-            ))
-        intents = self.announce_to_all(announcement)
-
-        self.print_game_summary()
-
-        # débat
-        discussion_round: int = 0
-        keep_debating: bool = True
-        while keep_debating:
-            LOG.debug(f"discussion_round: {discussion_round}")
-            speaker = self.choose_next_speaker(intents, discussion_round)
-            LOG.debug(f"speaker: {name(speaker)}")
-            if speaker is None:
-                keep_debating=False
+            # annonce de la victime de la nuit passée
+            if victim is None:
+                announcement = f"""C'est le matin, le village se réveille, tout le monde se réveille et ouvre les yeux... Cette nuit, personne n'a été mangé.e par les loups-garous. {rumors}"""
+                self.log(GameLogEntry(
+                    type="MORNING_VICTIM",
+                    content=announcement,
+                    context_data={"victim": None, "victim_role": None, "rumors": rumors}
+                ))
             else:
-                intents = self.discussion_segment(speaker)
-                discussion_round += 1
-
-        # bientôt vote
-        announcement = "Le vote va bientôt commencer. Chaque joueur peut encore prendre la parole s'il le souhaite."
-        self.log(GameLogEntry(
-            type="VOTE_SOON",
-            content=announcement
-        ))
-        intents = self.announce_to_all(announcement)
+                announcement = f"""C'est le matin, le village se réveille, tout le monde se réveille et ouvre les yeux... Cette nuit, {victim.name} a été mangé.e par les loups-garous. Son rôle était {victim.role}. {rumors}"""
+                self.log(GameLogEntry(
+                    type="MORNING_VICTIM",
+                    content=announcement,
+                    context_data={"victim": victim.name, "victim_role": victim.role, "rumors": rumors}
+                ))
+            intents = await self.announce_to_all(announcement)
+
+            self.print_game_summary()
+
+            # débat
+            discussion_round: int = 0
+            keep_debating: bool = True
+            while keep_debating:
+                LOG.debug("discussion_round: %s", discussion_round)
+                speaker = self.choose_next_speaker(intents, discussion_round)
+                LOG.debug("speaker: %s", Lazy(name, speaker))
+                if speaker is None:
+                    keep_debating=False
+                else:
+                    intents = await self.discussion_segment(speaker)
+                    discussion_round += 1
+            DISCUSSION_ROUNDS.observe(discussion_round)
 
-        # all players that want_to_speak can speak at max once
-        valid_want_to_speak: List[str] = [intent.player_name 
-            for intent in intents 
-            if intent.want_to_speak 
-            and intent.player_name != self.last_player_to_speak()
-            and intent.player_name in [p.name for p in self.players_actives()]]
-        LOG.debug(f"valid_want_to_speak: {valid_want_to_speak}")
-
-        while len(valid_want_to_speak) > 0:
-            speaker: Player = self.get_player_by_name(random.choice(valid_want_to_speak))
-            LOG.debug(f"speaker: {name(speaker)}")
-            valid_want_to_speak.remove(speaker.name)
-            intents = self.discussion_segment(speaker)
-
-        # vote, calcul victime, annonce, élimination
-        announcement = "Il est temps de voter. Donnez maintenant votre intention de vote."
-        self.log(GameLogEntry(
-            type="VOTE_NOW",
-            content=announcement
-        ))
-        intents = self.announce_to_all(announcement)
-        valid_votes = self.validate_votes(intents)
-        LOG.debug(f"valid_votes: {valid_votes}")
-        victim = self.compute_victim(valid_votes)
-        LOG.debug(f"victim: {name(victim)}")
-        msg_voted_for: str = ", ".join([f"{vote[0]} a voté pour {vote[1]}" for vote in valid_votes])
-        if victim is None:
-            announcement = f"{msg_voted_for}. Il n'y a pas de victime."
+            # bientôt vote
+            announcement = "Le vote va bientôt commencer. Chaque joueur peut encore prendre la parole s'il le souhaite."
             self.log(GameLogEntry(
-                type="VOTE_RESULT",
-                content=announcement,
-                context_data={"victim": None, "victim_role": None, "votes": valid_votes}
+                type="VOTE_SOON",
+                content=announcement
             ))
-        else:
-            announcement = f"{msg_voted_for}. Ainsi, {victim.name} est mort(e) et son rôle était {victim.role}."   
+            intents = await self.announce_to_all(announcement)
+
+            # all players that want_to_speak can speak at max once
+            valid_want_to_speak: List[str] = [intent.player_name 
+                for intent in intents 
+                if intent.want_to_speak 
+                and intent.player_name != self.last_player_to_speak()
+                and self.is_active(intent.player_name)]
+            LOG.debug("valid_want_to_speak: %s", valid_want_to_speak)
+
+            while len(valid_want_to_speak) > 0:
+                speaker: Player = self.get_player_by_name(self.rng.choice(valid_want_to_speak))
+                LOG.debug("speaker: %s", Lazy(name, speaker))
+                valid_want_to_speak.remove(speaker.name)
+                intents = await self.discussion_segment(speaker)
+
+        with self.profiler.phase("vote"):
+            # vote, calcul victime, annonce, élimination
+            announcement = "Il est temps de voter. Donnez maintenant votre intention de vote."
             self.log(GameLogEntry(
-                type="VOTE_RESULT",
-                content=announcement,
-                context_data={"victim": victim.name, "victim_role": victim.role, "votes": valid_votes}
+                type="VOTE_NOW",
+                content=announcement
             ))
-            self.eliminate_player(victim, "day")
-        self.announce_to_all(announcement)
+            intents = await self.announce_to_all(announcement)
+            valid_votes = self.validate_votes(intents)
+            LOG.debug("valid_votes: %s", valid_votes)
+            victim = self.compute_victim(valid_votes)
+            LOG.debug("victim: %s", Lazy(name, victim))
+            msg_voted_for: str = ", ".join([f"{vote[0]} a voté pour {vote[1]}" for vote in valid_votes])
+            if victim is None:
+                announcement = f"{msg_voted_for}. Il n'y a pas de victime."
+                self.log(GameLogEntry(
+                    type="VOTE_RESULT",
+                    content=announcement,
+                    context_data={"victim": None, "victim_role": None, "votes": valid_votes}
+                ))
+            else:
+                announcement = f"{msg_voted_for}. Ainsi, {victim.name} est mort(e) et son rôle était {victim.role}."   
+                self.log(GameLogEntry(
+                    type="VOTE_RESULT",
+                    content=announcement,
+                    context_data={"victim": victim.name, "victim_role": victim.role, "votes": valid_votes}
+                ))
+                self.eliminate_player(victim, "day")
+            await self.announce_to_all(announcement, wait_for=[])
 
         
     def validate_votes(self, votes: List[Intent]) -> List[Tuple[str, str]]:
@@ -630,15 +1295,41 @@ class GameLeader:
         for intent in votes:
             player_to_vote_for = self.get_player_by_name(intent.vote_for)
             if player_to_vote_for is None:
-                LOG.info(f"Le joueur {intent.vote_for} n'est pas dans la partie. {intent.player_name} ne peut pas voter pour lui.")
-            player_to_vote_for_is_alive = intent.vote_for in [p.name for p in self.players_actives()]
+                LOG.info("Le joueur %s n'est pas dans la partie. %s ne peut pas voter pour lui.", intent.vote_for, intent.player_name)
+            player_to_vote_for_is_alive = self.is_active(intent.vote_for)
             if not player_to_vote_for_is_alive:
-                LOG.info(f"Le joueur {intent.vote_for} n'est plus dans la partie. {intent.player_name} ne peut pas voter pour lui.")
+                INVALID_VOTES.inc()
+                LOG.info("Le joueur %s n'est plus dans la partie. %s ne peut pas voter pour lui.", intent.vote_for, intent.player_name)
             else:
                 valid_votes.append((intent.player_name, intent.vote_for))
         return valid_votes
 
 
+    def validate_ranking(self, intent: Intent, loup_garous: List[Player]) -> List[str]:
+        """
+        Check the targets ranked by a werewolf, as validate_votes: each one must be active, and not a werewolf.
+
+        Args:
+            intent: The intent of the werewolf, its vote_for stands for its ranking if it didn't rank its targets
+            loup_garous: The werewolves of the vote
+
+        Returns:
+            The valid targets, in the order of the ranking
+        """
+        werewolves = {player.name for player in loup_garous}
+        valid_targets: List[str] = []
+        for target in intent.vote_ranking or [intent.vote_for]:
+            if not self.is_active(target):
+                INVALID_VOTES.inc()
+                LOG.info("Le joueur %s n'est plus dans la partie. %s ne peut pas voter pour lui.", target, intent.player_name)
+            elif target in werewolves:
+                INVALID_VOTES.inc()
+                LOG.info("Le joueur %s est un Loup-Garou. %s ne peut pas voter pour lui.", target, intent.player_name)
+            else:
+                valid_targets.append(target)
+        return valid_targets
+
+
     def compute_victim(self, valid_votes: List[Tuple[str, str]]) -> Optional[Player]:
         """
         Compute the victim from the list of valid votes. Choose the player with the most votes.
@@ -661,7 +1352,7 @@ class GameLeader:
         
         # If there's a tie, return a random player from those with the highest votes
         if len(top_voted) > 1:
-            return self.get_player_by_name(random.choice(top_voted))
+            return self.get_player_by_name(self.rng.choice(top_voted))
         else:
             return self.get_player_by_name(top_voted[0])
 
@@ -673,87 +1364,271 @@ class GameLeader:
         return "" # LATER generate rumors
 
 
-    def night_time(self) -> Optional[Player]:
-
+    @traced
+    async def night_time(self) -> Optional[Player]:
+        annotate(day=self.day)
         msg = "C'est la nuit, tout le village s’endort, les joueurs ferment les yeux."
         self.log(GameLogEntry(
             type="NIGHT_START",
             content=msg
         ))
-        self.announce_to_all(msg)
+        await self.announce_to_all(msg, wait_for=[])
 
-        # voyante; on lui demande de sonder un joueur; on lui annonce le rôle de ce joueur.
+        # the seer's probe and the werewolves' vote don't depend on each other: both happen at the same time.
+        # the victim is only eliminated once both are over, so that the seer can still probe them tonight.
         seer: Optional[Player] = next((player for player in self.players_actives() if player.role == SEER), None)
-        LOG.debug(f"seer: {name(seer)}")
-        if seer is not None:
-            announcement = "La Voyante se réveille, et désigne un joueur dont elle veut sonder la véritable personnalité !"
+        loup_garous = [player for player in self.players_actives() if player.role == WEREWOLF]
+        _, victim = await asyncio.gather(self.seer_time(seer), self.werewolves_time(loup_garous))
+        if victim is not None:
+            self.eliminate_player(victim, "night")
+            LOG.debug("victim eliminated: %s", victim.name)
+        return victim
+
+
+    async def seer_time(self, seer: Optional[Player]) -> None:
+        """
+        The seer chooses a player to probe, and is told their role.
+        """
+        # voyante; on lui demande de sonder un joueur; on lui annonce le rôle de ce joueur.
+        LOG.debug("seer: %s", Lazy(name, seer))
+        if seer is None:
+            return
+        announcement = "La Voyante se réveille, et désigne un joueur dont elle veut sonder la véritable personnalité !"
+        self.log(GameLogEntry(
+            type="VOYANTE_WAKEUP",
+            content=announcement
+        ))
+        # only the seer's answer matters
+        intents = await self.announce_to_all(announcement, wait_for=[seer.name])
+        player_to_check: Optional[str] = next((intent.vote_for for intent in intents if intent.player_name == seer.name), None)
+        LOG.debug("Seer asked to check player: %s", player_to_check)
+        if self.is_active(player_to_check):
+            player_to_check_role = self.get_player_by_name(player_to_check).role
+            announcement_to_voyante = f"Le rôle de {player_to_check} est {player_to_check_role}"
+            # special case where we just notify a single player
+            await self.announce_to_one(seer, announcement_to_voyante)
             self.log(GameLogEntry(
-                type="VOYANTE_WAKEUP",
-                content=announcement
+                type="VOYANTE_ANNOUNCEMENT",
+                content=announcement_to_voyante,
+                target_name=seer.name,
+                public=False,
+                context_data={"player_to_check": player_to_check, "player_to_check_role": player_to_check_role}
             ))
-            intents = self.announce_to_all(announcement)
-            player_to_check:str = [intent.vote_for for intent in intents if intent.player_name == seer.name][0]
-            LOG.debug(f"Seer asked to check player: {player_to_check}")
-            if player_to_check in [p.name for p in self.players_actives()]:
-                player_to_check_role = self.get_player_by_name(player_to_check).role
-                announcement_to_voyante = f"Le rôle de {player_to_check} est {player_to_check_role}"
-                # special case where we just notify a single player
-                self.announce_to_one(seer, announcement_to_voyante)
-                self.log(GameLogEntry(
-                    type="VOYANTE_ANNOUNCEMENT",
-                    content=announcement_to_voyante,
-                    target_name=seer.name,
-                    public=False,
-                    context_data={"player_to_check": player_to_check, "player_to_check_role": player_to_check_role}
-                ))
-            else:
-                LOG.info(f"Le joueur {player_to_check} n'est pas dans la partie. La Voyante ne peut pas sonder.")
+        else:
+            LOG.info("Le joueur %s n'est pas dans la partie. La Voyante ne peut pas sonder.", player_to_check)
+
 
+    async def werewolves_time(self, loup_garous: List[Player]) -> Optional[Player]:
+        """
+        The werewolves choose a victim, all of them being asked at the same time.
+        With WOLF_CONSENSUS_ROUNDS they vote until they agree (at most WOLF_VOTE_ROUNDS rounds),
+        with WOLF_CONSENSUS_RANKED they rank their targets once and compute_ranked_victim decides.
+
+        Returns:
+            The victim, not eliminated yet. None if the werewolves did not agree.
+        """
         # loup garous votent
-        loup_garous = [player for player in self.players_actives() if player.role == WEREWOLF]
-        LOG.debug(f"loup_garous: {name(loup_garous)}")
+        LOG.debug("loup_garous: %s", Lazy(name, loup_garous))
         msg = f"Les Loups-Garous se réveillent, se reconnaissent et désignent une nouvelle victime !!!"
         self.log(GameLogEntry(
             type="WEREWOLF_VOTE_ANNOUNCEMENT",
             content=msg,
             context_data={"loup_garous": [name(loupgarou) for loupgarou in loup_garous]}
         ))
+
+        if self.wolf_consensus == WOLF_CONSENSUS_RANKED:
+            msg = "Les Loups-Garous votent pour une nouvelle victime !!! Classez vos cibles par ordre de préférence."
+            intents = await self.announce_to(loup_garous, msg)
+            # players that don't rank their targets still count, with their vote_for as their only choice
+            ballots = [self.validate_ranking(intent, loup_garous) for intent in intents]
+            victim = self.compute_ranked_victim(ballots)
+            LOG.debug("ranked ballots from loup garous: %s, victim: %s", ballots, Lazy(name, victim))
+            return victim
+
         last_vote = ""
         victim = None
         rounds = 0
-        while victim is None and rounds < 4:  # LATER always use 4?
+        while victim is None and rounds < WOLF_VOTE_ROUNDS:  # LATER always use 4?
             msg = f"Les Loups-Garous votent pour une nouvelle victime !!! {last_vote}"
-            votes = []
-            for loupgaroup in loup_garous: 
-                intents = self.announce_to_one(loupgaroup, msg)
-                if intents is not None:  # don't consider invalid responses
-                    votes.append(intents)
+            votes = await self.announce_to(loup_garous, msg)  # without the invalid responses
             # validate_votes returns a list of tuples (player_name, vote_for). we only care for the vote_for
             valid_votes = [vote[1] for vote in self.validate_votes(votes)]
-            LOG.debug(f"valid_votes: {valid_votes}, rounds: {rounds}")
+            LOG.debug("valid_votes: %s, rounds: %s", valid_votes, rounds)
             # if all votes validated and all loup garous voted for the same player, we have a victim
-            LOG.debug(f"valid_votes from loup garous: {valid_votes}")
+            LOG.debug("valid_votes from loup garous: %s", valid_votes)
             if len(valid_votes) == len(loup_garous) and len(set(valid_votes)) == 1:
                 victim = self.get_player_by_name(valid_votes[0])
-                LOG.debug(f"victim: {name(victim)}")
+                LOG.debug("victim: %s", Lazy(name, victim))
                 # LATER: should we log the vote? i think it's logged when village awakes...
-                self.eliminate_player(victim, "night")
-                LOG.debug(f"victim eliminated: {name(victim)}")
             else:
                 last_vote = f"Dernier vote: " + ", ".join([f"{i.player_name} a voté pour {i.vote_for}" for i in votes])
-                LOG.debug(f"no consensus found, rounds: {rounds}")
+                LOG.debug("no consensus found, rounds: %s", rounds)
             rounds += 1
-                
+
+        WOLF_REVOTES.inc(rounds - 1)
         return victim
+
+
+    def compute_ranked_victim(self, ballots: List[List[Optional[str]]]) -> Optional[Player]:
+        """
+        Compute the victim from ranked ballots (preferred target first) with instant-runoff:
+        while no target is first on more than half of the ballots, the target first on the fewest
+        ballots is removed from all of them. Ties are broken deterministically, by the lowest
+        Borda score (points for every rank of every ballot), then by the order of the players.
+        Targets that are not active, or listed twice on the same ballot, are ignored.
+
+        Returns:
+            The victim, None if no ballot names an active player
+        """
+        order = {player.name: i for i, player in enumerate(self.players)}
+        valid_ballots: List[List[str]] = []
+        for ballot in ballots:
+            valid_ballot = []
+            for target in ballot:
+                if self.is_active(target) and target not in valid_ballot:
+                    valid_ballot.append(target)
+            if valid_ballot:
+                valid_ballots.append(valid_ballot)
+
+        borda: Counter = Counter()
+        for ballot in valid_ballots:
+            for rank, target in enumerate(ballot):
+                borda[target] += len(ballot) - rank
+        remaining = set(borda)
+
+        while remaining:
+            first_choices = Counter({target: 0 for target in remaining})
+            for ballot in valid_ballots:
+                first = next((target for target in ballot if target in remaining), None)
+                if first is not None:
+                    first_choices[first] += 1
+            total = sum(first_choices.values())
+            leader, leader_count = max(first_choices.items(), key=lambda item: (item[1], borda[item[0]], -order[item[0]]))
+            if leader_count * 2 > total or len(remaining) == 1:
+                return self.get_player_by_name(leader)
+            loser = min(remaining, key=lambda target: (first_choices[target], borda[target], -order[target]))
+            remaining.remove(loser)
+        return None
     
 
+    async def export_trace(self, directory: str = TRACE_DIR) -> Optional[str]:
+        """
+        Write the trace of the game, with the spans of the servers that handled its requests, in the Chrome trace format.
+        Open it in https://ui.perfetto.dev or chrome://tracing.
+
+        Returns:
+            The path of the trace, None if the game is not traced
+        """
+        if not self.tracer.enabled:
+            return None
+        servers = {player.api_base_url for player in self.players}
+        for spans in await asyncio.gather(*[self.api.get_trace(server, self.tracer.trace_id) for server in servers]):
+            self.tracer.add(spans)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.game_id}.json")
+        self.tracer.export(path, {"game_id": self.game_id, "seed": self.seed})
+        return path
+
+
+    async def run(self, max_days: Optional[int] = None) -> Optional[str]:
+        """
+        Play nights and days until the game is over. start_game must have been called before.
+
+        Args:
+            max_days: Stop the game after this many nights, None to play until the end
+
+        Returns:
+            Optional[str]: the winning side (see check_if_game_is_over), None if the game was stopped
+        """
+        while max_days is None or self.day < max_days:
+            self.day += 1
+
+            # NIGHT TIME
+            start = time.perf_counter()
+            with self.profiler.phase("night"):
+                victim = await self.night_time()
+            self.phase_durations["night"].append(time.perf_counter() - start)
+            PHASE_DURATION.observe(self.phase_durations["night"][-1], phase="night")
+            if self.check_if_game_is_over() is not None:
+                break
+
+            # DAY TIME
+            start = time.perf_counter()
+            await self.day_time(victim)
+            self.phase_durations["day"].append(time.perf_counter() - start)
+            PHASE_DURATION.observe(self.phase_durations["day"][-1], phase="day")
+            if self.check_if_game_is_over() is not None:
+                break
+
+        # the last announcements may still be on their way
+        await self.flush()
+        winner = self.check_if_game_is_over()
+        GAMES.inc(winner=winner or "none")
+        self.log(GameLogEntry(
+            type="GAME_OVER",
+            content=f"Game over! {winner} win!" if winner is not None else f"Game stopped after {self.day} nights.",
+            context_data={"winner": winner, "days": self.day, "rounds": self.round}
+        ))
+        await self.end_game()
+        return winner
+
+    async def end_game(self) -> None:
+        """Let the servers of the players drop them (see werewolf_server.py), the game is over."""
+        servers = {player.api_base_url for player in self.players}
+        await asyncio.gather(*[self.api.post_end_game(server, self.game_id) for server in servers])
+    
+
+async def main(players: List[Player], logger: Logger, warm_up: bool = False, wolf_consensus: str = WOLF_CONSENSUS_ROUNDS,
+               hedge: bool = False, record: bool = False, trace: bool = False, profile: bool = False) -> None:
+    # Create game and start it
+    game = GameLeader(players, logger, api=ApiCalls(hedge=hedge), wolf_consensus=wolf_consensus, record_responses=record,
+                      trace=trace, profiler=Profiler(enabled=profile))
+    try:
+        can_start = await game.start_game()
+        if not can_start:
+            LOG.error("ERROR: Failed to start game")
+            await game.end_game()
+            exit(1)
+        else:
+            if warm_up:
+                await game.warm_up()
+            game.print_game_summary()
+            await game.run()
+            game.print_game_summary(verbose=True)
+    finally:
+        trace_path = await game.export_trace()
+        if trace_path is not None:
+            LOG.info("Trace written to %s", trace_path)
+        await game.api.aclose()
+        # e.g. writes the last entries to the SQLite archive
+        game.logger.close()
+        REGISTRY.dump(METRICS_FILE)
+        LOG.info("Metrics written to %s", METRICS_FILE)
+        if game.profiler.enabled:
+            game.profiler.write(os.path.join(PROFILE_DIR, "leader"))
+
+
 if __name__ == "__main__":
 
+    # the time to import the game leader, see profiling.py
+    if '--import-time' in sys.argv:
+        print_import_times("game_leader")
+        sys.exit(0)
+
+    # logging options, see log_setup.py
+    log_parser = argparse.ArgumentParser(add_help=False)
+    add_logging_arguments(log_parser)
+    setup_logging_from_args(log_parser.parse_known_args()[0])
+
     # Load player configuration from JSON file
     with open("players_config.json", "r", encoding="utf-8") as f:
         config = json.load(f)
+    players_config = config["players"]
+    # a lobby of N players with generated names, spread over the servers of the configuration (see lobby.py)
+    if '--lobby' in sys.argv:
+        players_config = lobby_players(int(sys.argv[sys.argv.index('--lobby') + 1]), players_config)
     players = [
-        Player(name=p["name"], is_female=p["is_female"], api_base_url=p["api_base_url"]) for p in config["players"]
+        Player(name=p["name"], is_female=p["is_female"], api_base_url=p["api_base_url"]) for p in players_config
     ]
     
     # weblogger if w flag
@@ -763,30 +1638,25 @@ if __name__ == "__main__":
     else:
         logger = ConsoleLogger()
 
-    # Create game and start it
-    game = GameLeader(players, logger)
-    can_start = game.start_game()
-    if not can_start:
-        LOG.error("ERROR: Failed to start game")
-        exit(1)
-    else:
-        game.print_game_summary()
-        while True:
-            # NIGHT TIME
-            victim = game.night_time()
-            if game.check_if_game_is_over() is not None:
-                break
-            
-            # DAY TIME
-            game.day_time(victim)
-            if game.check_if_game_is_over() is not None:
-                break
-        game.print_game_summary(verbose=True)
-        game.log(GameLogEntry(
-            type="GAME_OVER",
-            content=f"Game over! {game.check_if_game_is_over()} win!"
-        ))
+    # also archive the game in a SQLite database, see event_store.py
+    if '--db' in sys.argv:
+        logger = MultiLogger([logger, SQLiteLogger(sys.argv[sys.argv.index('--db') + 1])])
+
+    # prime the connections to the players and their LLMs before the first night
+    warm_up = '--warmup' in sys.argv
+    # werewolves rank their targets once instead of voting until they agree
+    wolf_consensus = WOLF_CONSENSUS_RANKED if '--ranked-wolves' in sys.argv else WOLF_CONSENSUS_ROUNDS
+
+    # resend slow requests to the servers that deduplicate them
+    hedge = '--hedge' in sys.argv
+
+    # log the responses of the players too, so that the game can be replayed (see replay.py)
+    record = '--record' in sys.argv
+
+    # write the spans of the game and of its requests to traces/, see tracing.py
+    trace = '--trace' in sys.argv
+
+    # profile the nights, discussions and votes, written to profiles/leader/, see profiling.py
+    profile = '--profile' in sys.argv
 
-        # save the game logs to a file
-        #with open("game_logs2.json", "w", encoding="utf-8") as f:
-        #    json.dump([msg.model_dump_json() for msg in game.logger.msgs], f, indent=4)
+    asyncio.run(main(players, logger, warm_up, wolf_consensus, hedge, record, trace, profile))
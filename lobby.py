@@ -0,0 +1,50 @@
+#
+# Large lobbies: games of any number of players (50 to 500...), with generated names,
+# instead of the players of players_config.json.
+#
+# Usage:
+#   python werewolf_server.py --stub               # a single server hosts all the players
+#   python game_leader.py --lobby 200 --ranked-wolves
+#   python tournament.py --lobby 100 --games 10 --max-days 5
+#
+# The players are spread over the servers of players_config.json. The number of werewolves grows with the lobby,
+# see game_leader.werewolves_count.
+#
+from typing import Any, Dict, List, Tuple
+
+# (name, is_female), the names of players_config.json
+FIRST_NAMES: List[Tuple[str, bool]] = [
+    ("Aline", True), ("Benjamin", False), ("Chloe", True), ("David", False), ("Elise", True), ("Frédéric", False),
+    ("Gabrielle", True), ("Hugo", False), ("Inès", True), ("Julien", False), ("Karine", True), ("Léo", False),
+    ("Manon", True), ("Noé", False),
+]
+
+
+def lobby_names(num_players: int) -> List[str]:
+    """The usual names for up to 14 players, numbered ones beyond: Aline, ..., Noé, Aline1, ..., Noé1, Aline2..."""
+    return [FIRST_NAMES[i % len(FIRST_NAMES)][0] + (str(i // len(FIRST_NAMES)) if i >= len(FIRST_NAMES) else "")
+            for i in range(num_players)]
+
+
+def lobby_players(num_players: int, players_config: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The players of a lobby, as in players_config.json.
+
+    Args:
+        num_players: Size of the lobby
+        players_config: The players of players_config.json, the lobby is spread over their servers
+
+    Returns:
+        The players, with their name, is_female and api_base_url
+    """
+    # the servers in the order of the configuration, each once
+    base_urls = list(dict.fromkeys(p["api_base_url"] for p in players_config))
+    assert base_urls, "No player server in the configuration"
+    return [
+        {
+            "name": player_name,
+            "is_female": FIRST_NAMES[i % len(FIRST_NAMES)][1],
+            "api_base_url": base_urls[i % len(base_urls)],
+        }
+        for i, player_name in enumerate(lobby_names(num_players))
+    ]
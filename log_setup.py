@@ -0,0 +1,163 @@
+#
+# Logging of the game leader's processes (game_leader.py, tournament.py, ...).
+#
+# The loggers only put their records in a queue: formatting and writing them (file, console) is done by a
+# listener thread, so that the event loop waiting for the players never waits for logging.
+#
+# Command-line options (see add_logging_arguments):
+#   --log-level game_leader=INFO,httpx=WARNING   levels per module
+#   --log-file-level DEBUG                       level of game_leader.log
+#   --log-console-level INFO                     level of the console
+#   --log-sample 10                              keep 1 DEBUG line out of 10, per line of code
+#
+import argparse
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+LOG = logging.getLogger(__name__)
+
+LOG_FILE: str = "game_leader.log"
+LOG_FILE_MAX_BYTES: int = 5 * 1024 * 1024
+LOG_FILE_BACKUPS: int = 50
+LOG_FORMAT: str = "%(levelname)s: %(message)s"
+# libraries that are too verbose below WARNING
+QUIET_LIBRARIES: List[str] = ['tornado', 'asyncio', 'httpx', 'httpcore', 'openai', 'urllib3', 'requests']
+
+_listener: Optional[QueueListener] = None
+
+
+class Lazy:
+    """
+    An argument of a log call computed only if the record is formatted, on the listener thread, and only once
+    (the rotating file handler formats a record twice).
+    The arguments of the function are bound when the record is created, e.g. LOG.debug("speaker: %s", Lazy(name, speaker))
+    """
+
+    def __init__(self, function: Callable[..., Any], *args: Any):
+        self.function = function
+        self.args = args
+        self.value: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.value is None:
+            self.value = str(self.function(*self.args))
+        return self.value
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 DEBUG record out of `rate` for each line of code, and all the records of higher levels."""
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate: int = rate
+        self.counts: Dict[Tuple[str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        return count % self.rate == 0
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Puts the records in the queue without formatting them: QueueHandler formats them before, on the logging thread,
+    which is what the listener thread is for. The lists, dicts and sets of the arguments are copied instead,
+    since they may change before the record is formatted.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.args, tuple) and any(isinstance(arg, (list, dict, set)) for arg in record.args):
+            record.args = tuple(arg.copy() if isinstance(arg, (list, dict, set)) else arg for arg in record.args)
+        return record
+
+
+def parse_levels(spec: Optional[str]) -> Dict[str, int]:
+    """'game_leader=INFO,httpx=WARNING' -> {'game_leader': 20, 'httpx': 30}"""
+    levels: Dict[str, int] = {}
+    for item in (spec or "").split(","):
+        if item.strip():
+            module, _, level = item.partition("=")
+            assert level, f"Invalid log level {item}, expected module=LEVEL"
+            levels[module.strip()] = logging.getLevelName(level.strip().upper())
+            assert isinstance(levels[module.strip()], int), f"Invalid log level {level}"
+    return levels
+
+
+def setup_logging(file_level: str = "DEBUG", console_level: str = "DEBUG", module_levels: Optional[Dict[str, int]] = None,
+                  sample_rate: int = 1, log_file: Optional[str] = LOG_FILE) -> None:
+    """
+    Send the records of all the loggers to the rotating log file and the console, through a listener thread.
+    Can be called again to change the configuration.
+
+    Args:
+        file_level: Level of the log file
+        console_level: Level of the console
+        module_levels: Level of some loggers, by name (e.g. {"game_leader": logging.INFO})
+        sample_rate: Keep 1 DEBUG record out of this many, per line of code
+        log_file: The log file, None for the console only
+    """
+    stop_logging()
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers: List[logging.Handler] = []
+    if log_file is not None:
+        file_handler = RotatingFileHandler(log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS)
+        file_handler.setLevel(file_level)
+        handlers.append(file_handler)
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setLevel(console_level)
+    handlers.append(console_handler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(records)
+    if sample_rate > 1:
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    # the records below the level of every handler are not even created
+    root.setLevel(min(handler.level for handler in handlers))
+    for library in QUIET_LIBRARIES:
+        logging.getLogger(library).setLevel(logging.WARNING)
+    for module, level in (module_levels or {}).items():
+        logging.getLogger(module).setLevel(level)
+
+    global _listener
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    LOG.info("Logging setup completed")
+
+
+def stop_logging() -> None:
+    """Write the records still in the queue and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def add_logging_arguments(parser: argparse.ArgumentParser, console_level: str = "DEBUG") -> None:
+    parser.add_argument("--log-level", default=None, help="levels per module, e.g. game_leader=INFO,httpx=WARNING")
+    parser.add_argument("--log-file-level", default="DEBUG", help=f"level of {LOG_FILE}")
+    parser.add_argument("--log-console-level", default=console_level, help="level of the console")
+    parser.add_argument("--log-sample", type=int, default=1, help="keep 1 DEBUG line out of this many, per line of code")
+
+
+def setup_logging_from_args(args: argparse.Namespace) -> None:
+    setup_logging(args.log_file_level.upper(), args.log_console_level.upper(), parse_levels(args.log_level), args.log_sample)
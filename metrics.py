@@ -0,0 +1,214 @@
+#
+# Counters and histograms of the game leader: calls to the players, votes, phases.
+#
+# They are shown in the Prometheus text format on http://localhost:4999/metrics when the web page is up
+# (game_leader.py -w), and written to METRICS_FILE at the end of a game (in the report of a tournament).
+#
+import bisect
+import json
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Sequence, Tuple
+
+METRICS_FILE: str = "metrics.json"
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS: List[float] = [0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10]  # seconds
+PHASE_BUCKETS: List[float] = [1, 5, 10, 30, 60, 120, 300, 600, 1200]  # seconds
+COUNT_BUCKETS: List[float] = [0, 1, 2, 3, 4, 5, 10, 15, 20]
+
+LabelValues = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric(ABC):
+    """A metric and its values by label values. Updated from the event loop, read from the web server's thread."""
+
+    type: str = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], lock: threading.Lock):
+        self.name: str = name
+        self.help: str = help
+        self.labels: Tuple[str, ...] = tuple(labels)
+        self._lock: threading.Lock = lock
+        self._values: Dict[LabelValues, Any] = self._empty()
+
+    def _empty(self) -> Dict[LabelValues, Any]:
+        # a metric without labels is shown (as 0) before its first update
+        return {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        assert len(labels) == len(self.labels), f"{self.name} expects the labels {self.labels}, got {list(labels)}"
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_string(self, key: LabelValues, extra: str = "") -> str:
+        pairs = [f'{label}="{escape(value)}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """The lines of the metric in the Prometheus text format, without its HELP and TYPE."""
+        pass
+
+    @abstractmethod
+    def to_dict(self) -> Dict[str, Any]:
+        """The metric as JSON, see Registry.to_dict."""
+        pass
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _empty(self) -> Dict[LabelValues, Any]:
+        return {} if self.labels else {(): 0}
+
+    def inc(self, value: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self._label_string(key)} {format_value(value)}" for key, value in values]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return {
+            "type": self.type,
+            "help": self.help,
+            "values": [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in values],
+        }
+
+
+class Histogram(Metric):
+    """Counts the observations per bucket: bucket i counts the values <= buckets[i] (and > buckets[i-1])."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], lock: threading.Lock, buckets: Sequence[float]):
+        self.buckets: List[float] = sorted(buckets) + [float("inf")]
+        super().__init__(name, help, labels, lock)
+
+    def _empty(self) -> Dict[LabelValues, Any]:
+        return {} if self.labels else {(): ([0] * len(self.buckets), 0.0)}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels)) or ([0], 0.0)
+            return sum(counts)
+
+    def _snapshot(self) -> List[Tuple[LabelValues, List[int], float]]:
+        # cumulative counts, as in the Prometheus format
+        with self._lock:
+            values = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        snapshot = []
+        for key, counts, total in values:
+            cumulative, running = [], 0
+            for count in counts:
+                running += count
+                cumulative.append(running)
+            snapshot.append((key, cumulative, total))
+        return snapshot
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, cumulative, total in self._snapshot():
+            for bound, count in zip(self.buckets, cumulative):
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_string(key, le)} {count}")
+            lines.append(f"{self.name}_sum{self._label_string(key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_string(key)} {cumulative[-1]}")
+        return lines
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "help": self.help,
+            "values": [
+                {
+                    "labels": dict(zip(self.labels, key)),
+                    "buckets": {format_value(bound): count for bound, count in zip(self.buckets, cumulative)},
+                    "sum": total,
+                    "count": cumulative[-1],
+                }
+                for key, cumulative, total in self._snapshot()
+            ],
+        }
+
+
+class Registry:
+    """
+    The metrics of the process. A metric is created by the first call to counter() or histogram() with its name,
+    the next calls return the same metric.
+    """
+
+    def __init__(self):
+        self._lock: threading.Lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def _get(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        assert type(existing) is type(metric) and existing.labels == metric.labels, f"{metric.name} is already registered differently"
+        return existing
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get(Counter(name, help, labels, self._lock))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram(name, help, labels, self._lock, buckets))
+
+    def clear(self) -> None:
+        """Forget the values of all the metrics, e.g. between two benchmarks."""
+        with self._lock:
+            for metric in self._metrics.values():
+                metric._values = metric._empty()
+
+    def render(self) -> str:
+        """All the metrics, in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.to_dict() for metric in metrics}
+
+    def dump(self, path: str = METRICS_FILE) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+
+# the registry of the game leader, shown by the web page
+REGISTRY: Registry = Registry()
@@ -0,0 +1,208 @@
+#
+# Profiles of the game leader and of the player servers, by phase of the game (Python 3.12+).
+#
+# Within a phase (the leader's night, discussion and vote, the servers' notify and speak), the program is profiled
+# with cProfile. Since Python 3.12, cProfile profiles all the threads of the program and only one can be enabled
+# at a time: the phases are recorded one at a time, and a phase that starts while another is being recorded
+# (e.g. a speak handled during a batch_notify) is counted in the other one.
+#
+# Usage:
+#   python werewolf_server.py --profile          # writes profiles/server_<port>/ when the server stops
+#   python game_leader.py --profile              # writes profiles/leader/ at the end of the game
+#
+# For each phase:
+#   <phase>.prof       the cProfile profile: python -m pstats notify.prof, or snakeviz notify.prof
+#   <phase>.txt        the functions that use the most time
+#   <phase>.collapsed  the stacks, for a flamegraph: flamegraph.pl notify.collapsed > notify.svg, or https://www.speedscope.app
+# and all.collapsed, the stacks of all the phases.
+#
+# The startup of the scripts (the time to import their modules), measured with python -X importtime:
+#   python game_leader.py --import-time
+#   python werewolf_server.py --import-time
+#
+import cProfile
+import io
+import logging
+import os
+import pstats
+import subprocess
+import sys
+import threading
+from contextlib import nullcontext
+from typing import ContextManager, Dict, List, Optional, Tuple
+
+LOG = logging.getLogger(__name__)
+
+PROFILE_DIR: str = "profiles"
+TOP_FUNCTIONS: int = 30  # functions listed in <phase>.txt
+MAX_STACK_DEPTH: int = 100  # of the collapsed stacks
+TOP_IMPORTS: int = 15  # modules listed by print_import_times
+
+# a function as in pstats: (file, line, name)
+Function = Tuple[str, int, str]
+
+
+def label(function: Function) -> str:
+    """The name of a function in the collapsed stacks."""
+    file, line, name = function
+    return name if file == "~" else f"{name} ({os.path.basename(file)}:{line})"
+
+
+class Profiler:
+    """
+    Profiles the program within phases, see phase(). The profiles of the same phase, recorded several times,
+    are added up. A disabled profiler records nothing, and its phases cost nothing.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled: bool = enabled
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        # the phase being recorded, and the number of threads within it
+        self._active: Optional[str] = None
+        self._depth: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def phase(self, name: str) -> ContextManager:
+        """Profile the block as the phase `name`, e.g. with profiler.phase("night"): ..."""
+        if not self.enabled:
+            return nullcontext()
+        return PhaseContext(self, name)
+
+    def _enter(self, name: str) -> None:
+        with self._lock:
+            if self._depth == 0:
+                profile = self.profiles.setdefault(name, cProfile.Profile())
+                try:
+                    profile.enable()
+                except ValueError as e:
+                    # another profiler is running, e.g. python -m cProfile game_leader.py
+                    LOG.warning("Profiling disabled: %s", e)
+                    self.enabled = False
+                    return
+                self._active = name
+            self._depth += 1
+
+    def _exit(self) -> None:
+        with self._lock:
+            if self._depth == 0:
+                return
+            self._depth -= 1
+            if self._depth == 0:
+                self.profiles[self._active].disable()
+                self._active = None
+
+    def write(self, directory: str) -> None:
+        """Write the profile of each phase to `directory`, see the top of this file."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            profiles = dict(self.profiles)
+        with open(os.path.join(directory, "all.collapsed"), "w", encoding="utf-8") as all_file:
+            for phase, profile in sorted(profiles.items()):
+                profile.dump_stats(os.path.join(directory, f"{phase}.prof"))
+                stats = pstats.Stats(profile)
+                with open(os.path.join(directory, f"{phase}.txt"), "w", encoding="utf-8") as f:
+                    f.write(summary(phase, stats))
+                with open(os.path.join(directory, f"{phase}.collapsed"), "w", encoding="utf-8") as f:
+                    for line, microseconds in collapsed_stacks(stats):
+                        f.write(f"{line} {microseconds}\n")
+                        all_file.write(f"{phase};{line} {microseconds}\n")
+        LOG.info("Profiles of %s written to %s", ", ".join(sorted(profiles)) or "no phase", directory)
+
+
+class PhaseContext:
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler: Profiler = profiler
+        self.name: str = name
+
+    def __enter__(self) -> None:
+        self.profiler._enter(self.name)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.profiler._exit()
+
+
+def summary(phase: str, stats: pstats.Stats) -> str:
+    """The functions using the most time in a phase, by own time (tottime) and with their callees (cumtime)."""
+    stream = io.StringIO()
+    stats.stream = stream
+    stream.write(f"Phase {phase}\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    return stream.getvalue()
+
+
+def collapsed_stacks(stats: pstats.Stats) -> List[Tuple[str, int]]:
+    """
+    The stacks of a profile with their own time in microseconds, most expensive first.
+
+    cProfile only records who called whom, not the whole stacks: the time of a function is shared out between
+    the stacks of its callers in proportion to the time of each call (as flameprof or gprof2dot do).
+    """
+    callees: Dict[Function, List[Tuple[Function, float]]] = {}
+    # the time of the functions called from outside the profile, e.g. by the function that started the phase
+    roots: Dict[Function, float] = {}
+    for function, (_, _, _, cumulative, callers) in stats.stats.items():
+        for caller, (_, _, _, caller_cumulative) in callers.items():
+            callees.setdefault(caller, []).append((function, caller_cumulative))
+        outside = cumulative - sum(caller_cumulative for _, _, _, caller_cumulative in callers.values())
+        if outside > 0:
+            roots[function] = outside
+    total = sum(roots.values())
+    # shares of less than this are left out, so that the stacks of a large profile stay few
+    threshold = max(1e-6, total / 100000)
+
+    stacks: Dict[str, float] = {}
+    pending: List[Tuple[Tuple[Function, ...], float]] = [((root,), seconds) for root, seconds in roots.items()]
+    while pending:
+        stack, seconds = pending.pop()
+        function = stack[-1]
+        _, _, own, cumulative, _ = stats.stats[function]
+        share = seconds / cumulative if cumulative > 0 else 0.0
+        line = ";".join(label(f) for f in stack)
+        stacks[line] = stacks.get(line, 0.0) + own * share
+        if len(stack) >= MAX_STACK_DEPTH:
+            continue
+        for callee, callee_seconds in callees.get(function, []):
+            # a recursive call is already in the time of the outer one
+            if callee not in stack and callee_seconds * share >= threshold:
+                pending.append((stack + (callee,), callee_seconds * share))
+    return [(line, round(seconds * 1e6)) for line, seconds in sorted(stacks.items(), key=lambda item: -item[1])
+            if seconds >= 1e-6]
+
+
+def import_times(module: str) -> List[Tuple[str, int, int, int]]:
+    """
+    The modules imported by `module`, imported in a new interpreter (so that nothing is imported yet).
+
+    Returns:
+        (module, depth in the imports of `module`, own microseconds, cumulative microseconds), in the order
+        python -X importtime lists them: every module after the modules it imported, `module` last (depth 0)
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=directory,
+                            capture_output=True, text=True, check=True)
+    times = []
+    lines = [line for line in result.stderr.splitlines() if line.startswith("import time:")]
+    # the modules of the interpreter's startup (site...), before `module`
+    start = next((i + 1 for i in range(len(lines) - 1, -1, -1) if lines[i].endswith("| site")), 0)
+    for line in lines[start:]:
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # the header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), depth, int(own), int(cumulative)))
+    return times
+
+
+def print_import_times(module: str) -> None:
+    """Print the time to import `module`: its imports that take the longest, and the slowest modules."""
+    times = import_times(module)
+    total = times[-1][3] if times else 0
+    print(f"import {module}: {total / 1000:.1f}ms ({len(times)} modules)")
+    print("  its imports (with theirs):")
+    for name, depth, _, cumulative in sorted((t for t in times if t[1] == 1), key=lambda t: -t[3])[:TOP_IMPORTS]:
+        print(f"    {cumulative / 1000:8.1f}ms  {name}")
+    print("  the slowest modules (by themselves):")
+    for name, _, own, _ in sorted(times, key=lambda t: -t[2])[:TOP_IMPORTS]:
+        print(f"    {own / 1000:8.1f}ms  {name}")
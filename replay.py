@@ -0,0 +1,235 @@
+#
+# Replays a recorded game: the game leader is run again with the recorded responses of the players,
+# instead of calling them, and the events of the replay are compared with the recorded ones.
+#
+# A game is recorded with --record (and archived with --db), e.g.:
+#   python game_leader.py --record --db games.db
+#   python tournament.py --games 50 --record --db games.db
+#
+# Usage:
+#   python replay.py games.db --game 3f2a9c1b7d4e                  # at full speed
+#   python replay.py games.db --game 3f2a9c1b7d4e --time-scale 1   # as fast as the players answered
+#   python replay.py games.db --game 3f2a9c1b7d4e --time-scale 0.2 --web
+#   python replay.py game_logs.json                                # a JSON list of entries
+#
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app import GameLogEntry, Logger, WebLogger
+from event_store import EventStore
+from game_leader import ApiCalls, ConsoleLogger, GameLeader, Intent, MultiLogger, Player
+from log_setup import add_logging_arguments, setup_logging_from_args
+
+LOG = logging.getLogger(__name__)
+
+# the entries that are not events of the game, they are not compared
+NOT_COMPARED: List[str] = ["PLAYER_RESPONSE"]
+
+
+class ReplayApiCalls(ApiCalls):
+    """
+    Answers the game leader with the recorded responses of the players, without any network call.
+
+    The responses of each player are matched in order per call and message, so that a leader sending its messages
+    in another order still gets the right responses. A call without a recorded response (the leader behaves
+    differently than when the game was recorded) is answered as if the player did not respond, and is kept in `missing`.
+    """
+
+    def __init__(self, responses: List[GameLogEntry], time_scale: Optional[float] = None):
+        """
+        Args:
+            responses: The PLAYER_RESPONSE entries of the game
+            time_scale: Wait for the recorded latency of every response multiplied by this, None to answer at once
+        """
+        super().__init__()
+        self.time_scale: Optional[float] = time_scale
+        self.responses: Dict[Tuple[str, str, Optional[str]], Deque[Tuple[Any, float]]] = {}
+        for entry in responses:
+            context = entry.context_data
+            key = (entry.actor_name, context["call"], context["message"])
+            self.responses.setdefault(key, deque()).append((context["response"], context["latency"]))
+        self.missing: List[Tuple[str, str, Optional[str]]] = []
+
+    async def aclose(self) -> None:
+        pass
+
+    async def _response(self, player: Player, call: str, message: Optional[str] = None) -> Any:
+        key = (player.name, call, message)
+        queue = self.responses.get(key)
+        if not queue:
+            LOG.warning("No recorded response for %s of %s: %s", call, player.name, message)
+            self.missing.append(key)
+            return None
+        response, latency = queue.popleft()
+        if self.time_scale:
+            await asyncio.sleep(latency * self.time_scale)
+        return response
+
+    async def post_new_game(self, player: Player, players_names: List[str], werewolves_cnt: int, werewolves: List[Optional[str]],
+                            game_id: Optional[str] = None, seers_cnt: int = 1) -> int:
+        player_id = await self._response(player, "new_game")
+        return player_id if player_id is not None else -1
+
+    async def post_speech(self, player: Player) -> Optional[str]:
+        return await self._response(player, "speak")
+
+    async def post_notify(self, player: Player, message: str) -> Optional[Intent]:
+        response = await self._response(player, "notify", message)
+        return self.parse_intent(player, response) if response is not None else None
+
+    async def post_batch_notify(self, players: List[Player], message: str) -> Dict[str, Optional[Intent]]:
+        intents = await asyncio.gather(*[self.post_notify(player, message) for player in players])
+        return {player.name: intent for player, intent in zip(players, intents)}
+
+    async def post_end_game(self, server: str, game_id: str) -> None:
+        pass
+
+    async def post_warmup(self, player: Player) -> Optional[float]:
+        return await self._response(player, "warmup")
+
+    async def get_trace(self, server: str, trace_id: str) -> List[Dict[str, Any]]:
+        return []
+
+
+class ListLogger(Logger):
+    """Keeps the entries, to compare them with the recorded ones."""
+
+    def __init__(self):
+        self.entries: List[GameLogEntry] = []
+
+    def log(self, entry: GameLogEntry) -> None:
+        self.entries.append(entry)
+
+
+@dataclass
+class ReplayResult:
+    game_id: str
+    winner: Optional[str]
+    duration: float  # seconds
+    recorded: List[GameLogEntry]
+    replayed: List[GameLogEntry]
+    missing: List[Tuple[str, str, Optional[str]]] = field(default_factory=list)
+    # index of the first event that differs, None if the replay behaved as the recorded game
+    divergence: Optional[int] = None
+
+
+def comparable(entry: GameLogEntry) -> Dict[str, Any]:
+    """What must be the same in a replay: everything but the times, the game id and the sequence number."""
+    fields = entry.to_dict()
+    for key in ("timestamp", "monotonic", "game_id", "seq"):
+        del fields[key]
+    # e.g. the tuples of the votes are lists once archived
+    return json.loads(json.dumps(fields, default=str))
+
+
+def first_divergence(recorded: List[GameLogEntry], replayed: List[GameLogEntry]) -> Optional[int]:
+    recorded = [entry for entry in recorded if entry.type not in NOT_COMPARED]
+    replayed = [entry for entry in replayed if entry.type not in NOT_COMPARED]
+    for i, (before, after) in enumerate(zip(recorded, replayed)):
+        if comparable(before) != comparable(after):
+            return i
+    return None if len(recorded) == len(replayed) else min(len(recorded), len(replayed))
+
+
+async def replay(entries: List[GameLogEntry], time_scale: Optional[float] = None, logger: Optional[Logger] = None,
+                 leader_class: type = GameLeader) -> ReplayResult:
+    """
+    Replay a recorded game.
+
+    Args:
+        entries: The entries of the game, with its GAME_START and PLAYER_RESPONSE entries (see GameLeader's record_responses)
+        time_scale: Wait for the recorded latencies of the players multiplied by this, None for full speed
+        logger: Where the events of the replay are logged too, e.g. a WebLogger
+        leader_class: The GameLeader (or a subclass, e.g. to profile it)
+
+    Returns:
+        The replayed events, and where they differ from the recorded ones
+    """
+    entries = sorted(entries, key=lambda entry: entry.seq if entry.seq is not None else 0)
+    start_entry = next((entry for entry in entries if entry.type == "GAME_START"), None)
+    assert start_entry is not None, "The game has no GAME_START entry, it can't be replayed"
+    context = start_entry.context_data
+    players = [Player(**player) for player in context["players"]]
+    api = ReplayApiCalls([entry for entry in entries if entry.type == "PLAYER_RESPONSE"], time_scale)
+    recorder = ListLogger()
+    game = leader_class(players, MultiLogger([recorder, logger]) if logger is not None else recorder, api=api,
+                        seed=context["seed"], game_id=f"{start_entry.game_id}-replay", wolf_consensus=context["wolf_consensus"])
+
+    # a game stopped after a number of nights is stopped after as many nights
+    game_over = next((entry for entry in reversed(entries) if entry.type == "GAME_OVER"), None)
+    max_days = game_over.context_data["days"] if game_over is not None and game_over.context_data.get("winner") is None else None
+
+    start = time.perf_counter()
+    winner = None
+    if await game.start_game():
+        if any(entry.type == "WARMUP" for entry in entries):
+            await game.warm_up()
+        winner = await game.run(max_days=max_days)
+    duration = time.perf_counter() - start
+
+    return ReplayResult(
+        game_id=start_entry.game_id,
+        winner=winner,
+        duration=duration,
+        recorded=entries,
+        replayed=recorder.entries,
+        missing=api.missing,
+        divergence=first_divergence(entries, recorder.entries),
+    )
+
+
+def load_json(path: str) -> List[GameLogEntry]:
+    """A JSON list of entries, as dicts or as JSON strings (as in the former game_logs*.json files)."""
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    return [GameLogEntry(**(json.loads(item) if isinstance(item, str) else item)) for item in items]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded game without the players.")
+    parser.add_argument("source", help="a SQLite database (see event_store.py) or a JSON list of entries")
+    parser.add_argument("--game", help="the game to replay, from the database")
+    parser.add_argument("--time-scale", type=float, default=None,
+                        help="wait for the recorded latencies of the players multiplied by this (default: full speed)")
+    parser.add_argument("--web", action="store_true", help="show the replay in the web page")
+    parser.add_argument("--console", action="store_true", help="print the events of the replay")
+    add_logging_arguments(parser, console_level="WARNING")
+    args = parser.parse_args()
+    setup_logging_from_args(args)
+    if args.source.endswith(".json"):
+        entries = load_json(args.source)
+    else:
+        assert args.game is not None, "--game is required with a database"
+        store = EventStore(args.source)
+        entries = store.events(game_id=args.game)
+        store.close()
+    if not entries:
+        print(f"No events found in {args.source}")
+        sys.exit(1)
+
+    logger = WebLogger() if args.web else ConsoleLogger() if args.console else None
+    result = asyncio.run(replay(entries, args.time_scale, logger))
+
+    print(f"Replayed game {result.game_id} in {result.duration:.3f}s: {len(result.replayed)} events, winner {result.winner}")
+    if result.missing:
+        print(f"{len(result.missing)} calls had no recorded response, e.g. {result.missing[0]}")
+    if result.divergence is None:
+        print("The replay behaved as the recorded game.")
+    else:
+        recorded = [entry for entry in result.recorded if entry.type not in NOT_COMPARED]
+        replayed = [entry for entry in result.replayed if entry.type not in NOT_COMPARED]
+        print(f"The replay differs from the recorded game at event {result.divergence}:")
+        for label, events in (("recorded", recorded), ("replayed", replayed)):
+            event = events[result.divergence] if result.divergence < len(events) else None
+            print(f"  {label}: {event.to_string() if event is not None else 'no event'}")
+        sys.exit(2)
+    if args.web:
+        # keep the web page up
+        input("Press Enter to quit\n")
@@ -0,0 +1,7 @@
+#
+# The roles of the players, as the game leader and the players name them.
+# analytics.py needs them without importing game_leader.py (httpx, pydantic and the whole game leader).
+#
+SEER: str = "voyante"
+WEREWOLF: str = "loup-garou"
+VILLAGER: str = "villageois"
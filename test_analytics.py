@@ -0,0 +1,43 @@
+import asyncio
+from collections import Counter
+
+import numpy as np
+
+from analytics import ROLES, SIDES, codes, find, load, report
+from benchmark import InProcessApiCalls
+from event_store import SQLiteLogger, connect
+from game_leader import GameLeader, Player
+from lobby import lobby_names
+
+
+def test_find_and_codes():
+    keys = np.array([30, 10, 20])
+    assert find(keys, np.array([20, 30, 99, 10])).tolist() == [2, 0, -1, 1]
+    assert find(np.array([], dtype=np.int64), np.array([1])).tolist() == [-1]
+    assert codes(["Chloe", None, "Aline"], np.array(["Aline", "Benjamin", "Chloe"])).tolist() == [2, -1, 0]
+
+
+def test_report_of_archived_games(tmp_path):
+    path = str(tmp_path / "games.db")
+    logger = SQLiteLogger(path)
+    api = InProcessApiCalls()
+
+    async def play(seed: int) -> str:
+        players = [Player(name=name, is_female=False, api_base_url="http://localhost:5021/") for name in lobby_names(8)]
+        game = GameLeader(players, logger, api=api, seed=seed)
+        assert await game.start_game()
+        return await game.run()
+
+    winners = Counter(asyncio.run(play(seed)) for seed in range(6))
+    logger.close()
+
+    connection = connect(path)
+    archive = load(connection)
+    connection.close()
+    result = report(archive)
+    assert result["win_rates"]["games"] == result["win_rates"]["finished"] == 6
+    assert result["win_rates"]["sides"] == {side: winners[side] / 6 for side in SIDES}
+    # 8 players: 2 werewolves, a seer and 5 villagers per game
+    assert np.bincount(archive.role, minlength=len(ROLES)).tolist() == [30, 6, 12]
+    assert result["lengths"]["days"]["count"] == 6
+    assert sum(map(sum, result["votes"]["counts"])) == len(archive.vote_game) > 0
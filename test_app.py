@@ -0,0 +1,200 @@
+import gzip
+import json
+import os
+import webbrowser
+from datetime import datetime, timezone
+
+import pytest
+
+import app
+from app import NEXT_SINCE_HEADER, SPILL_INDEX_STRIDE, GameLogEntry, SpilledLog, WebLogger
+from metrics import Registry
+
+
+@pytest.fixture
+def no_server(monkeypatch):
+    """The WebLoggers don't start their server, browser and emitter thread: the tests call _emit."""
+    monkeypatch.setattr(webbrowser, "open_new", lambda url: None)
+    monkeypatch.setattr(WebLogger, "_run_server", lambda self: None)
+    monkeypatch.setattr(WebLogger, "_run_emitter", lambda self: None)
+    monkeypatch.setattr(app, "MAX_UNACKED_ENTRIES", 10)
+
+
+@pytest.fixture
+def web(no_server):
+    return WebLogger(metrics=Registry())
+
+
+def log(web: WebLogger, game_id: str, count: int) -> None:
+    for i in range(count):
+        web.log(GameLogEntry(type="SPEECH", content=str(i), game_id=game_id))
+
+
+def test_logs_are_paged_with_a_cursor(web):
+    log(web, "g1", 5)
+    client = web.app.test_client()
+    page = client.get("/api/logs?since=1&limit=2")
+    assert [entry["content"] for entry in page.json] == ["1", "2"]
+    assert page.headers[NEXT_SINCE_HEADER] == "3"
+    rest = client.get(f"/api/logs?since={page.headers[NEXT_SINCE_HEADER]}")
+    assert [entry["content"] for entry in rest.json] == ["3", "4"]
+    assert rest.headers[NEXT_SINCE_HEADER] == "5"
+    assert len(client.get("/api/logs").json) == 5
+    # out of bounds
+    assert client.get("/api/logs?since=99").json == []
+
+
+def test_polling_gets_not_modified_until_new_entries(web):
+    log(web, "g1", 2)
+    client = web.app.test_client()
+    first = client.get("/api/logs?since=0")
+    again = client.get("/api/logs?since=0", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+    assert again.headers[NEXT_SINCE_HEADER] == "2"
+    log(web, "g1", 1)
+    changed = client.get("/api/logs?since=0", headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200 and len(changed.json) == 3
+    assert changed.headers["ETag"] != first.headers["ETag"]
+
+
+def test_large_pages_are_compressed(no_server):
+    compressed = WebLogger(metrics=Registry(), compress=True)
+    compressed.log(GameLogEntry(type="SPEECH", content="Je crois que Aline ment. " * 100))
+    client = compressed.app.test_client()
+    response = client.get("/api/logs", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.data))[0]["content"].startswith("Je crois")
+    assert "Content-Encoding" not in client.get("/api/logs").headers
+
+
+def batches(client):
+    return [(message["name"], json.loads(message["args"][0]) if message["name"] == "new_log_entries" else message["args"][0])
+            for message in client.get_received()]
+
+
+def test_entries_are_sent_in_one_batch_per_room(web):
+    all_games = web.socketio.test_client(web.app)
+    all_games.emit('subscribe', {})
+    one_game = web.socketio.test_client(web.app)
+    one_game.emit('subscribe', {"game_id": "g1"})
+    log(web, "g1", 2)
+    log(web, "g2", 1)
+    web._emit()
+    [(name, batch)] = batches(all_games)
+    assert name == "new_log_entries" and (batch["since"], batch["next"]) == (0, 3)
+    assert [(e["game_id"], e["content"]) for e in batch["entries"]] == [("g1", "0"), ("g1", "1"), ("g2", "0")]
+    [(name, batch)] = batches(one_game)
+    assert [(e["game_id"], e["content"]) for e in batch["entries"]] == [("g1", "0"), ("g1", "1")]
+    assert web._emitted_batches.value() == 2
+
+
+def test_game_client_survives_other_games(web):
+    client = web.socketio.test_client(web.app)
+    client.emit('subscribe', {"game_id": "g1"})
+    log(web, "g1", 3)
+    web._emit()
+    [(name, batch)] = batches(client)
+    assert name == "new_log_entries" and len(batch["entries"]) == 3
+    client.emit('ack', {"since": batch["next"]})
+
+    # the game of the client is over, the other ones go on
+    for _ in range(5):
+        log(web, "g2", 8)
+        web._emit()
+    assert batches(client) == []
+    assert web._resyncs.value() == 0
+
+    log(web, "g1", 1)
+    web._emit()
+    [(name, batch)] = batches(client)
+    assert name == "new_log_entries" and [e["content"] for e in batch["entries"]] == ["0"]
+
+
+def test_client_not_acknowledging_is_resynced(web):
+    client = web.socketio.test_client(web.app)
+    client.emit('subscribe', {})
+    log(web, "g1", 2)
+    web._emit()
+    [(_, batch)] = batches(client)
+    client.emit('ack', {"since": batch["next"]})
+    for _ in range(3):
+        log(web, "g1", 6)
+        web._emit()
+    log(web, "g1", 1)
+    web._emit()
+    received = batches(client)
+    assert ("resync", {"since": 2}) in received
+    assert web._resyncs.value() == 1
+    log(web, "g1", 1)
+    web._emit()
+    assert batches(client) == []
+
+
+def test_legacy_client_gets_every_entry(web):
+    client = web.socketio.test_client(web.app)
+    for game_id in ("g1", "g2"):
+        log(web, game_id, 15)
+        web._emit()
+    received = client.get_received()
+    assert [message["name"] for message in received] == ["new_log_entry"] * 30
+    assert received[0]["args"][0]["content"] == "0" and received[0]["args"][0]["game_id"] == "g1"
+    assert web._resyncs.value() == 0
+
+
+def test_binary_encoding_round_trip():
+    entry = GameLogEntry(type="VOTE", content="Aline a voté pour Noé ✅", actor_name="Aline", target_name="Noé",
+                         public=False, context_data={"votes": [["Aline", "Noé"]], "round": 2}, game_id="g1", seq=41,
+                         timestamp=datetime(2026, 10, 18, 8, 30, 15, 123456, timezone.utc))
+    assert GameLogEntry.from_binary(entry.to_binary()) == entry
+    # the optional fields, as read back from the archive
+    archived = GameLogEntry(type="GAME_START", content="", actor_name=None, monotonic=None)
+    decoded = GameLogEntry.from_binary(archived.to_binary())
+    assert decoded == archived
+    assert (decoded.actor_name, decoded.context_data, decoded.game_id, decoded.seq, decoded.monotonic) == (None,) * 5
+
+
+def test_json_is_encoded_again_when_a_field_is_set():
+    entry = GameLogEntry(type="SPEECH", content="Bonjour")
+    assert entry.to_json() is entry.to_json()
+    assert json.loads(entry.to_json())["seq"] is None
+    # as in GameLeader.log
+    entry.game_id = "g1"
+    entry.seq = 3
+    assert json.loads(entry.to_json())["seq"] == 3 and json.loads(entry.to_json())["game_id"] == "g1"
+    entry.content = "Bonsoir"
+    assert json.loads(entry.to_json()) == json.loads(json.dumps(entry.to_dict()))
+
+
+def spilled_log(tmp_path, count: int) -> SpilledLog:
+    entries = SpilledLog(memory_limit=1000, spill_dir=str(tmp_path))
+    entries.keep_from = count
+    for i in range(count):
+        entries.append("g1", json.dumps({"content": f"entrée {i}"}, ensure_ascii=False).encode())
+    return entries
+
+
+def test_spilled_log_pages_across_the_file(tmp_path):
+    count = 3 * SPILL_INDEX_STRIDE + 10
+    entries = spilled_log(tmp_path, count)
+    expected = [json.dumps({"content": f"entrée {i}"}, ensure_ascii=False).encode() for i in range(count)]
+    spilled = count - len(entries.recent(entries._spilled))
+    assert 0 < spilled < count and len(entries) == count
+    for since, end in [(0, count), (0, 1), (5, SPILL_INDEX_STRIDE + 3), (SPILL_INDEX_STRIDE, 2 * SPILL_INDEX_STRIDE),
+                       (spilled - 3, spilled + 3), (spilled, count), (count - 1, count), (count, count), (7, 7)]:
+        assert entries.read(since, end) == expected[since:end], (since, end)
+    entries.close()
+    assert not os.path.exists(entries.spill_path)
+
+
+def test_spilled_log_keeps_the_entries_not_sent(tmp_path):
+    entries = spilled_log(tmp_path, 0)
+    for i in range(200):
+        entries.append("g1", b'{"content": "%d"}' % i)
+    # nothing was sent yet: all the entries stay in memory, over the limit
+    assert entries.spill_path is None
+    assert len(entries.recent(0)) == 200
+    entries.keep_from = 150
+    entries.append("g2", b'{"content": "200"}')
+    assert entries.recent(150)[0] == ("g1", b'{"content": "150"}')
+    assert entries.read(0, 201)[::50] == [b'{"content": "%d"}' % i for i in range(0, 201, 50)]
+    entries.close()
@@ -0,0 +1,19 @@
+import asyncio
+
+from benchmark import TIMED_METHODS, latency_stats, run_games
+
+
+def test_latency_stats_in_milliseconds():
+    stats = latency_stats([0.003, 0.001, 0.002])
+    assert stats["count"] == 3
+    assert stats["p50_ms"] == 2
+    assert stats["max_ms"] == 3
+    assert latency_stats([])["mean_ms"] is None
+
+
+def test_run_games_in_process_times_the_game_loop():
+    result = asyncio.run(run_games(num_players=6, games=2, seed=0, transport="inprocess"))
+    assert result["games"] == 2
+    assert result["nights_per_second"] > 0
+    assert set(result["latency"]) == set(TIMED_METHODS)
+    assert result["latency"]["announce_to_all"]["count"] > 0
@@ -0,0 +1,44 @@
+import logging
+
+from app import GameLogEntry
+from event_store import EventStore, SQLiteLogger
+
+
+def entry(seq: int) -> GameLogEntry:
+    return GameLogEntry(type="SPEECH", content=f"message {seq}", actor_name="Aline", game_id="g1", seq=seq)
+
+
+def test_events_are_archived_and_counted(tmp_path):
+    path = str(tmp_path / "games.db")
+    logger = SQLiteLogger(path, flush_interval=0.01)
+    for seq in range(3):
+        logger.log(entry(seq))
+    # no game_id nor seq: numbered by the logger
+    logger.log(GameLogEntry(type="ERROR", content="sans partie"))
+    logger.close()
+
+    store = EventStore(path)
+    [game, unknown] = sorted(store.games(), key=lambda game: game["game_id"])
+    assert (game["game_id"], game["events"]) == ("g1", 3)
+    assert unknown["game_id"].startswith("unknown-") and unknown["events"] == 1
+    assert [e.content for e in store.events(game_id="g1", since_seq=0)] == ["message 1", "message 2"]
+    assert store.events(type="ERROR")[0].seq == 0
+    store.close()
+
+
+def test_duplicate_events_are_rejected(tmp_path, caplog):
+    path = str(tmp_path / "games.db")
+    logger = SQLiteLogger(path, flush_interval=0.01)
+    for seq in range(3):
+        logger.log(entry(seq))
+    logger.flush()
+    with caplog.at_level(logging.ERROR, logger="event_store"):
+        logger.log(entry(1))
+        logger.flush()
+    logger.close()
+    assert "Could not write 1 game events" in caplog.text
+
+    store = EventStore(path)
+    [game] = store.games()
+    assert game["events"] == len(store.events(game_id="g1")) == 3
+    store.close()
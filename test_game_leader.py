@@ -0,0 +1,277 @@
+import asyncio
+from collections import Counter
+from typing import Dict, List, Optional
+
+import pytest
+
+from game_leader import (INVALID_VOTES, LATENCY_MIN_SAMPLES, LATENCY_WINDOW, MAX_INTERRUPTIONS, MAX_ROUNDS, MIN_TIMEOUT,
+                         WOLF_CONSENSUS_RANKED, GameLeader, Intent, LatencyTracker, NullLogger, Player)
+
+NAMES = ["Aline", "Benjamin", "Chloe", "David", "Elise", "Frédéric"]
+
+
+@pytest.fixture
+def leader():
+    """A seeded game of 6 players, without servers."""
+    players = [Player(name=name, is_female=False, api_base_url="http://localhost:5021/") for name in NAMES]
+    return GameLeader(players, NullLogger(), seed=42)
+
+
+def intent(player_name: str, speak: bool = False, interrupt: bool = False, vote_for=None, vote_ranking=None) -> Intent:
+    return Intent(player_name=player_name, want_to_speak=speak, want_to_interrupt=interrupt, vote_for=vote_for,
+                  vote_ranking=vote_ranking)
+
+
+class FakeApiCalls:
+    """Answers every notification at once, and keeps the requests."""
+
+    def __init__(self):
+        self.requests: List[tuple] = []
+
+    async def post_notify(self, player: Player, message: str) -> Optional[Intent]:
+        self.requests.append(("notify", player.api_base_url, [player.name]))
+        return Intent(player_name=player.name, want_to_speak=False, want_to_interrupt=False)
+
+    async def post_batch_notify(self, players: List[Player], message: str) -> Dict[str, Optional[Intent]]:
+        self.requests.append(("batch_notify", players[0].api_base_url, [player.name for player in players]))
+        return {player.name: Intent(player_name=player.name, want_to_speak=False, want_to_interrupt=False)
+                for player in players}
+
+
+def test_announce_to_all_sends_one_request_per_server():
+    # Aline, Chloe and Elise on one server, the others alone on theirs
+    players = [Player(name=name, is_female=False, api_base_url=f"http://localhost:{5021 if i % 2 == 0 else 5022 + i}/")
+               for i, name in enumerate(NAMES)]
+    players[4].is_alive = False
+    leader = GameLeader(players)
+    leader.api = FakeApiCalls()
+    intents = asyncio.run(leader.announce_to_all("C'est la nuit", exclude_player="Benjamin"))
+    assert [intent.player_name for intent in intents] == ["Aline", "Chloe", "David", "Frédéric"]
+    assert sorted(leader.api.requests) == [
+        ("batch_notify", "http://localhost:5021/", ["Aline", "Chloe"]),
+        ("notify", "http://localhost:5025/", ["David"]),
+        ("notify", "http://localhost:5027/", ["Frédéric"]),
+    ]
+
+
+class LatencyApiCalls(FakeApiCalls):
+    """The seer's wake-up takes a while to reach Benjamin, the messages are kept in the order they arrive."""
+
+    def __init__(self):
+        super().__init__()
+        self.received: Dict[str, List[str]] = {}
+
+    async def post_notify(self, player: Player, message: str) -> Optional[Intent]:
+        if player.name == "Benjamin" and message == "La Voyante se réveille":
+            await asyncio.sleep(0.05)
+        self.received.setdefault(player.name, []).append(message)
+        return await super().post_notify(player, message)
+
+
+def test_concurrent_announcements_arrive_in_order(leader):
+    # one server per player
+    for i, player in enumerate(leader.players):
+        player.api_base_url = f"http://localhost:{5021 + i}/"
+    leader.api = LatencyApiCalls()
+    werewolves = [leader.get_player_by_name("Benjamin"), leader.get_player_by_name("David")]
+
+    async def night():
+        # as in night_time: the seer's turn, and the werewolf vote meanwhile
+        seer_turn = asyncio.create_task(leader.announce_to_all("La Voyante se réveille", wait_for=["Aline"]))
+        await asyncio.sleep(0)
+        await leader.announce_to(werewolves, "Les Loups-Garous votent")
+        await seer_turn
+        await leader.flush()
+
+    asyncio.run(night())
+    assert leader.api.received["Benjamin"] == ["La Voyante se réveille", "Les Loups-Garous votent"]
+    assert leader.api.received["David"] == ["La Voyante se réveille", "Les Loups-Garous votent"]
+
+
+class SlowServerApiCalls(FakeApiCalls):
+    """Benjamin's server is down, Chloe's never answers."""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled: List[str] = []
+
+    async def post_new_game(self, player: Player, players_names: List[str], *args, **kwargs) -> int:
+        if player.name == "Benjamin":
+            return -1
+        if player.name == "Chloe":
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                self.cancelled.append(player.name)
+                raise
+        return players_names.index(player.name)
+
+    async def post_warmup(self, player: Player) -> Optional[float]:
+        return None if player.name == "Chloe" else 0.5
+
+
+def test_start_game_stops_at_first_player_that_cannot_join():
+    leader = GameLeader([Player(name=name, is_female=False, api_base_url="http://localhost:5021/") for name in NAMES[:3]])
+    leader.api = SlowServerApiCalls()
+
+    async def start():
+        started = await asyncio.wait_for(leader.start_game(), timeout=5)
+        await asyncio.sleep(0)  # lets the cancelled request run its except clause
+        return started
+
+    assert asyncio.run(start()) is False
+    assert leader.api.cancelled == ["Chloe"]
+    assert leader.players[0].api_endpoint == "http://localhost:5021/0/"
+
+
+def test_warm_up_reports_readiness_of_each_player():
+    leader = GameLeader([Player(name=name, is_female=False, api_base_url="http://localhost:5021/") for name in NAMES[:3]])
+    leader.api = SlowServerApiCalls()
+    assert asyncio.run(leader.warm_up()) == {"Aline": 0.5, "Benjamin": 0.5, "Chloe": None}
+
+
+def test_roster_follows_eliminations(leader):
+    actives = leader.players_actives()
+    leader.eliminate_player(leader.get_player_by_name("Chloe"), "nuit")
+    leader.eliminate_player(leader.get_player_by_name("Aline"), "jour")
+    assert [player.name for player in actives] == NAMES  # lists returned before an elimination are not modified
+    assert [player.name for player in leader.players_actives()] == ["Benjamin", "David", "Elise", "Frédéric"]
+    assert [player.name for player in leader.players_actives(exclude_player="David")] == ["Benjamin", "Elise", "Frédéric"]
+    # excluding a dead player changes nothing
+    assert len(leader.players_actives(exclude_player="Aline")) == 4
+    assert not leader.is_active("Chloe") and leader.is_active("Elise") and not leader.is_active(None)
+    assert leader.get_player_by_name("Chloe").is_alive is False
+
+
+def test_speaker_distribution_weighs_speakers_and_stopping(leader):
+    leader.get_player_by_name("Aline").spoke_at_rounds = [1, 2, 3]
+    distribution = leader.speaker_distribution([intent("Aline", speak=True), intent("Benjamin", speak=True),
+                                                intent("Chloe")], discussion_round=1)
+    # nobody stops the discussion before it started
+    assert set(distribution) == {"Aline", "Benjamin"}
+    assert sum(distribution.values()) == pytest.approx(1)
+    # Aline did all the talking so far
+    assert distribution["Aline"] < distribution["Benjamin"]
+    # stopping becomes likely as the discussion goes on
+    late = leader.speaker_distribution([intent("Benjamin", speak=True)], discussion_round=MAX_ROUNDS)
+    assert late[None] > 0.9
+    assert leader.speaker_distribution([intent("Benjamin", speak=True)], MAX_ROUNDS + 1) == {None: 1.0}
+
+
+def test_interruptions_come_first(leader):
+    leader.get_player_by_name("Chloe").number_interruptions = MAX_INTERRUPTIONS
+    intents = [intent("Aline", speak=True), intent("Benjamin", interrupt=True), intent("Chloe", interrupt=True),
+               intent("David", interrupt=True)]
+    assert leader.speaker_distribution(intents, discussion_round=MAX_ROUNDS + 1) == {"Benjamin": 0.5, "David": 0.5}
+
+
+def test_sampler_follows_the_distribution(leader):
+    intents = [intent("Aline", speak=True), intent("Benjamin", speak=True), intent("Chloe", speak=True)]
+    leader.get_player_by_name("Chloe").spoke_at_rounds = [1, 2, 3, 4]
+    distribution = leader.speaker_distribution(intents, discussion_round=14)
+    draws = 20000
+    chosen = Counter()
+    for _ in range(draws):
+        speaker = leader.choose_next_speaker(intents, discussion_round=14)
+        chosen[speaker.name if speaker is not None else None] += 1
+    for player_name, probability in distribution.items():
+        assert chosen[player_name] / draws == pytest.approx(probability, abs=0.015)
+
+
+def victim(leader, ballots):
+    chosen = leader.compute_ranked_victim(ballots)
+    return chosen.name if chosen is not None else None
+
+
+def test_ranked_victim_majority_of_first_choices(leader):
+    assert victim(leader, [["Chloe", "Aline"], ["Chloe", "David"], ["David", "Chloe"]]) == "Chloe"
+
+
+def test_ranked_victim_runoff_transfers_ballots(leader):
+    ballots = [["Aline", "Chloe"], ["Aline", "Chloe"], ["Benjamin", "Chloe"], ["Benjamin", "Chloe"], ["Chloe", "Benjamin"]]
+    # nobody has 3 first choices: Chloe is dropped, her ballot goes to Benjamin
+    assert victim(leader, ballots) == "Benjamin"
+
+
+def test_ranked_victim_exhausted_ballots_leave_the_count(leader):
+    ballots = [["Aline"], ["Benjamin"], ["Benjamin"], ["Chloe"], ["David"]]
+    # David, then Chloe, are dropped (the last in the order of the players), their ballots name nobody else:
+    # Benjamin has 2 of the 3 ballots left
+    assert victim(leader, ballots) == "Benjamin"
+
+
+def test_ranked_victim_ties(leader):
+    # the fewest points over all the ranks (Borda) is dropped first: Chloe
+    assert victim(leader, [["Aline", "Benjamin"], ["Benjamin", "Aline"], ["Chloe"]]) == "Aline"
+    # then the last in the order of the players
+    assert victim(leader, [["Benjamin"], ["Aline"]]) == "Aline"
+    assert victim(leader, [["Elise", "Benjamin"], ["Benjamin", "Elise"]]) == "Benjamin"
+
+
+def test_ranked_victim_ignores_invalid_targets(leader):
+    leader.roster.eliminate(leader.get_player_by_name("Aline"))
+    ballots = [["Aline", "Chloe", "Chloe"], ["Zoé", "David"], ["David", "David", "Chloe"]]
+    assert victim(leader, ballots) == "David"
+    assert victim(leader, [["Aline", None], [], ["Zoé"]]) is None
+
+
+class RankingApiCalls(FakeApiCalls):
+    """The werewolves rank their targets: Benjamin ranks himself and a dead player first."""
+
+    RANKINGS = {"Benjamin": ["Benjamin", "Aline", "Chloe"], "David": ["Chloe", "Elise"]}
+
+    async def post_batch_notify(self, players: List[Player], message: str) -> Dict[str, Optional[Intent]]:
+        return {player.name: intent(player.name, vote_ranking=self.RANKINGS[player.name]) for player in players}
+
+
+def test_ranked_werewolf_votes_are_validated(leader, caplog):
+    leader.api = RankingApiCalls()
+    leader.wolf_consensus = WOLF_CONSENSUS_RANKED
+    leader.roster.eliminate(leader.get_player_by_name("Aline"))
+    werewolves = [leader.get_player_by_name("Benjamin"), leader.get_player_by_name("David")]
+    invalid_votes = INVALID_VOTES.value()
+    with caplog.at_level("INFO", logger="game_leader"):
+        chosen = asyncio.run(leader.werewolves_time(werewolves))
+    assert chosen.name == "Chloe"
+    assert INVALID_VOTES.value() == invalid_votes + 2
+    assert "Le joueur Benjamin est un Loup-Garou. Benjamin ne peut pas voter pour lui." in caplog.text
+    assert "Le joueur Aline n'est plus dans la partie. Benjamin ne peut pas voter pour lui." in caplog.text
+    # a werewolf that didn't rank its targets is checked on its vote_for
+    assert leader.validate_ranking(intent("David", vote_for="Benjamin"), werewolves) == []
+    assert leader.validate_ranking(intent("David", vote_for="Elise"), werewolves) == ["Elise"]
+
+
+def test_deadline_waits_for_enough_samples():
+    latency = LatencyTracker(max_timeout=10)
+    assert latency.timeout("Aline notify") == 10
+    for _ in range(LATENCY_MIN_SAMPLES - 1):
+        latency.record("Aline notify", 0.5)
+    assert latency.timeout("Aline notify") == 10
+    assert latency.percentile("Aline notify", 50) is None
+
+
+def test_deadline_follows_the_response_times():
+    latency = LatencyTracker(max_timeout=10)
+    for _ in range(LATENCY_MIN_SAMPLES):
+        latency.record("Aline notify", 1.0)
+    # 1s + 4 deviations of 0.16s, but never less than MIN_TIMEOUT
+    assert latency.timeout("Aline notify") == MIN_TIMEOUT
+    # a slow response raises the deviation more than the average
+    latency.record("Aline notify", 3.0)
+    assert latency.average["Aline notify"] == pytest.approx(1.25)
+    assert latency.timeout("Aline notify") == pytest.approx(1.25 + 4 * 0.6187, abs=1e-3)
+    for _ in range(20):
+        latency.record("Aline notify", 9.0)
+    assert latency.timeout("Aline notify") == 10
+    # each key has its own deadline
+    assert latency.timeout("Benjamin notify") == 10
+
+
+def test_percentiles_of_the_recent_response_times():
+    latency = LatencyTracker()
+    for seconds in range(LATENCY_WINDOW + 10):
+        latency.record("Aline speak", float(seconds))
+    # the first 10 are out of the window
+    assert latency.percentile("Aline speak", 0) == 10
+    assert latency.percentile("Aline speak", 95) == 57
+    assert latency.percentile("Aline speak", 100) == LATENCY_WINDOW + 9
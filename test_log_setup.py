@@ -0,0 +1,71 @@
+import logging
+import queue
+import threading
+
+import pytest
+
+from log_setup import Lazy, LazyQueueHandler, SamplingFilter, parse_levels, setup_logging, stop_logging
+
+
+def record(level: int = logging.DEBUG, lineno: int = 1, msg: str = "speaker: %s", args: tuple = ()) -> logging.LogRecord:
+    return logging.LogRecord("game_leader", level, "game_leader.py", lineno, msg, args, None)
+
+
+@pytest.fixture
+def root_logger():
+    """Gives back the root logger as it was after the test."""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_sampling_keeps_one_debug_record_per_line_out_of_rate():
+    sampling = SamplingFilter(3)
+    assert [sampling.filter(record(lineno=10)) for _ in range(7)] == [True, False, False, True, False, False, True]
+    # each line of code has its own count
+    assert sampling.filter(record(lineno=11))
+    assert all(sampling.filter(record(logging.INFO, lineno=10)) for _ in range(3))
+    assert all(SamplingFilter(1).filter(record()) for _ in range(3))
+
+
+def test_queue_handler_leaves_formatting_to_the_listener():
+    calls = []
+    records = queue.SimpleQueue()
+    alive = ["Aline", "Benjamin"]
+    LazyQueueHandler(records).handle(record(msg="speaker: %s among %s", args=(Lazy(lambda: calls.append(1) or "Aline"), alive)))
+    alive.remove("Aline")
+    queued = records.get_nowait()
+    assert queued.msg == "speaker: %s among %s"
+    assert calls == []
+    # the list was copied when the record was queued
+    assert queued.args[1] == ["Aline", "Benjamin"]
+    assert queued.getMessage() == "speaker: Aline among ['Aline', 'Benjamin']"
+    assert queued.getMessage() == "speaker: Aline among ['Aline', 'Benjamin']"
+    assert calls == [1]
+
+
+def test_lazy_arguments_are_computed_on_the_listener_thread_only_if_logged(tmp_path, root_logger):
+    log_file = tmp_path / "game_leader.log"
+    threads = []
+
+    def speaker(name):
+        threads.append(threading.current_thread())
+        return name
+
+    setup_logging(file_level="INFO", console_level="CRITICAL", log_file=str(log_file))
+    logger = logging.getLogger("game_leader")
+    logger.debug("dropped: %s", Lazy(speaker, "Benjamin"))
+    logger.info("speaker: %s", Lazy(speaker, "Aline"))
+    stop_logging()
+    assert log_file.read_text().splitlines()[-1] == "INFO: speaker: Aline"
+    assert len(threads) == 1 and threads[0] is not threading.current_thread()
+
+
+def test_parse_levels():
+    assert parse_levels("game_leader=INFO, httpx=warning") == {"game_leader": logging.INFO, "httpx": logging.WARNING}
+    assert parse_levels(None) == {}
+    with pytest.raises(AssertionError):
+        parse_levels("game_leader")
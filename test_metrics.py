@@ -0,0 +1,42 @@
+import pytest
+
+from metrics import Registry
+
+
+def test_render_in_the_prometheus_text_format():
+    registry = Registry()
+    requests = registry.counter("werewolf_requests_total", "Requests to the players", ["endpoint", "player"])
+    requests.inc(endpoint="notify", player="Aline")
+    requests.inc(2, endpoint="notify", player='Benjamin "Ben"')
+    latency = registry.histogram("werewolf_phase_seconds", "Duration of the phases", buckets=[1, 5])
+    latency.observe(0.5)
+    latency.observe(1)
+    latency.observe(7.25)
+    assert registry.render() == "\n".join([
+        "# HELP werewolf_requests_total Requests to the players",
+        "# TYPE werewolf_requests_total counter",
+        'werewolf_requests_total{endpoint="notify",player="Aline"} 1',
+        'werewolf_requests_total{endpoint="notify",player="Benjamin \\"Ben\\""} 2',
+        "# HELP werewolf_phase_seconds Duration of the phases",
+        "# TYPE werewolf_phase_seconds histogram",
+        'werewolf_phase_seconds_bucket{le="1"} 2',
+        'werewolf_phase_seconds_bucket{le="5"} 2',
+        'werewolf_phase_seconds_bucket{le="+Inf"} 3',
+        "werewolf_phase_seconds_sum 8.75",
+        "werewolf_phase_seconds_count 3",
+    ]) + "\n"
+
+
+def test_metrics_are_registered_once():
+    registry = Registry()
+    games = registry.counter("werewolf_games_total", "Finished games", ["winner"])
+    assert registry.counter("werewolf_games_total", "Finished games", ["winner"]) is games
+    with pytest.raises(AssertionError):
+        registry.histogram("werewolf_games_total", "Finished games", ["winner"])
+    games.inc(winner="Villageois")
+    assert registry.to_dict()["werewolf_games_total"]["values"] == [{"labels": {"winner": "Villageois"}, "value": 1}]
+    registry.clear()
+    assert games.value(winner="Villageois") == 0
+    # a metric without labels is shown before its first update
+    registry.counter("werewolf_votes_rejected_total", "Rejected votes")
+    assert "werewolf_votes_rejected_total 0" in registry.render()
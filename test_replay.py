@@ -0,0 +1,37 @@
+import asyncio
+
+from app import GameLogEntry
+from benchmark import InProcessApiCalls
+from game_leader import GameLeader, Player
+from lobby import lobby_names
+from replay import ListLogger, first_divergence, replay
+
+
+def entry(content: str, type: str = "SPEECH") -> GameLogEntry:
+    return GameLogEntry(type=type, actor_name="Aline", content=content)
+
+
+def test_first_divergence_ignores_times_and_responses():
+    recorded = [entry("Bonjour"), entry("{}", type="PLAYER_RESPONSE"), entry("Je vote Chloe")]
+    replayed = [entry("Bonjour"), entry("Je vote Chloe")]
+    assert first_divergence(recorded, replayed) is None
+    assert first_divergence(recorded, [entry("Bonjour"), entry("Je vote David")]) == 1
+    # a replay that stops early, or goes on, differs where the shorter one ends
+    assert first_divergence(recorded, replayed[:1]) == 1
+    assert first_divergence(recorded, replayed + [entry("Encore")]) == 2
+
+
+def test_recorded_game_replays_identically():
+    players = [Player(name=name, is_female=False, api_base_url="http://localhost:5021/") for name in lobby_names(8)]
+    recorder = ListLogger()
+    game = GameLeader(players, recorder, api=InProcessApiCalls(), seed=7, record_responses=True)
+
+    async def play():
+        assert await game.start_game()
+        return await game.run()
+
+    winner = asyncio.run(play())
+    result = asyncio.run(replay(recorder.entries))
+    assert result.missing == []
+    assert result.divergence is None
+    assert result.winner == winner
@@ -0,0 +1,30 @@
+import asyncio
+from typing import List
+
+from game_leader import Player
+from tournament import play_game
+
+PLAYERS = [{"name": name, "is_female": False, "api_base_url": f"http://localhost:{port}/"}
+           for name, port in [("Aline", 5021), ("Benjamin", 5021), ("Chloe", 5022)]]
+
+
+class FailingServerApiCalls:
+    """Chloe's server is down, and the servers are told when a game is over."""
+
+    def __init__(self):
+        self.ended: List[tuple] = []
+
+    async def post_new_game(self, player: Player, players_names: List[str], *args, **kwargs) -> int:
+        return -1 if player.name == "Chloe" else players_names.index(player.name)
+
+    async def post_end_game(self, server: str, game_id: str) -> None:
+        self.ended.append((server, game_id))
+
+
+def test_game_that_cannot_start_is_ended():
+    api = FailingServerApiCalls()
+    outcome = asyncio.run(play_game(PLAYERS, api, seed=1, max_days=1))
+    assert outcome["started"] is False and outcome["winner"] is None
+    # Aline and Benjamin may have joined before Chloe failed: their server drops them
+    assert sorted(api.ended) == [("http://localhost:5021/", outcome["game_id"]),
+                                 ("http://localhost:5022/", outcome["game_id"])]
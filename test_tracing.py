@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from tracing import (LEADER_PROCESS, PARENT_SPAN_HEADER, TRACE_ID_HEADER, Tracer, chrome_trace, headers, span,
+                     traced)
+from werewolf import StubWerewolfPlayer
+from werewolf_server import create_app
+
+
+def server_span(name: str, parent_id: str, start: float, duration: float) -> dict:
+    return {"name": name, "span_id": f"{name}-span", "parent_id": parent_id, "process": "werewolf_server localhost:5021",
+            "track": "Aline", "start": start, "duration": duration, "args": {}}
+
+
+def test_spans_nest_under_the_current_span():
+    tracer = Tracer()
+
+    class Game:
+        def __init__(self):
+            self.tracer = tracer
+
+        @traced
+        async def night_time(self):
+            with span("notify", track="Aline", endpoint="notify"):
+                return headers()
+
+    sent = asyncio.run(Game().night_time())
+    notify, night = tracer.spans
+    assert (night["name"], night["track"], night["parent_id"]) == ("night_time", "leader", None)
+    assert (notify["track"], notify["parent_id"], notify["args"]) == ("Aline", night["span_id"], {"endpoint": "notify"})
+    assert sent == {TRACE_ID_HEADER: tracer.trace_id, PARENT_SPAN_HEADER: notify["span_id"]}
+    # outside a trace, and with a disabled tracer, nothing is recorded
+    assert headers() == {}
+    with Tracer(enabled=False).span("night_time"):
+        with span("notify"):
+            assert headers() == {}
+
+
+def test_chrome_trace_links_requests_to_their_handling():
+    leader = {"name": "notify", "span_id": "leader-span", "parent_id": None, "process": LEADER_PROCESS, "track": "Aline",
+              "start": 100.0, "duration": 0.5, "args": {"endpoint": "notify"}}
+    # the clock of the server is a little early
+    spans = [leader, server_span("notify", "leader-span", 99.999, 0.2)]
+    trace = chrome_trace(spans, {"game_id": "g1"})
+    assert trace["otherData"] == {"game_id": "g1"}
+    events = trace["traceEvents"]
+    names = [(event["ph"], event["args"]["name"]) for event in events if event["ph"] == "M"]
+    assert names == [("M", "werewolf_server localhost:5021"), ("M", "Aline"), ("M", LEADER_PROCESS), ("M", "Aline")]
+    complete = [event for event in events if event["ph"] == "X"]
+    assert [(event["ts"], event["dur"]) for event in complete] == [(0, 200000), (pytest.approx(1000), 500000)]
+    assert complete[1]["args"] == {"endpoint": "notify", "span_id": "leader-span", "parent_id": None}
+    start, finish = [event for event in events if event.get("cat") == "flow"]
+    # the arrow starts within the request of the leader, and ends at its handling
+    assert (start["ph"], start["ts"], start["pid"]) == ("s", pytest.approx(1000), complete[1]["pid"])
+    assert (finish["ph"], finish["ts"], finish["pid"]) == ("f", 0, complete[0]["pid"])
+    assert chrome_trace([], {})["traceEvents"] == []
+
+
+def test_server_keeps_the_spans_of_traced_requests():
+    client = create_app(StubWerewolfPlayer).test_client()
+    player_id = client.post("/new_game", json={"role": "villageois", "player_name": "Aline", "players_names": ["Aline", "Benjamin"],
+                                               "werewolves_count": 1, "werewolves": []}).json["player_id"]
+    client.post(f"/{player_id}/notify", json={"message": "C'est la nuit"},
+                headers={TRACE_ID_HEADER: "trace-1", PARENT_SPAN_HEADER: "leader-span"})
+    client.post(f"/{player_id}/notify", json={"message": "C'est la nuit"})
+    spans = client.get("/trace/trace-1").json["spans"]
+    assert [(s["name"], s["track"], s["parent_id"]) for s in spans] == [("notify", "Aline", "leader-span")]
+    # the spans are given once
+    assert client.get("/trace/trace-1").json["spans"] == []
@@ -0,0 +1,46 @@
+from lobby import lobby_names
+from werewolf import game_rules, parse_message, roster_patterns
+
+# Aline1 to Noé3 too, with names that start with other names
+NAMES = tuple(lobby_names(50))
+
+
+def parse(message: str) -> dict:
+    return parse_message(message, roster_patterns(NAMES))
+
+
+def test_parse_message_reads_the_names_of_a_large_lobby():
+    assert len(set(NAMES)) == 50 and "Aline3" in NAMES
+    assert parse("Le rôle de Aline3 est loup-garou") == {"type": "voyante_result", "player": "Aline3", "role": "loup-garou"}
+    assert parse("Aline1 a dit: Je soupçonne Aline.") == {"type": "speech", "speaker": "Aline1", "speech": "Je soupçonne Aline."}
+    assert parse("Aline a voté pour Noé2, Léo1 a voté pour Aline2. Ainsi, Noé2 est mort(e) et son rôle était villageois.") == {
+        "type": "vote_result", "victim": "Noé2", "role": "villageois", "votes": [("Aline", "Noé2"), ("Léo1", "Aline2")]}
+    assert parse("Les Loups-Garous votent pour une nouvelle victime !!! Dernier vote: Hugo3 a voté pour Inès1")["werewolves_votes"] == [
+        ("Hugo3", "Inès1")]
+
+
+def test_parse_morning_messages():
+    morning = "C'est le matin, le village se réveille, tout le monde se réveille et ouvre les yeux... "
+    assert parse(morning + "Cette nuit, Frédéric2 a été mangé.e par les loups-garous. Son rôle était voyante. Chloe1 ment.") == {
+        "type": "morning_victim", "victim": "Frédéric2", "role": "voyante", "rumor": "Chloe1 ment."}
+    assert parse(morning + "Cette nuit, personne n'a été mangé.e par les loups-garous. Chloe1 ment.") == {
+        "type": "morning_no_victim", "rumor": "Chloe1 ment."}
+    assert parse(morning + "Cette nuit, personne n'a été mangé.e par les loups-garous. ") == {"type": "morning_no_victim"}
+
+
+def test_parse_timeout():
+    message = "Julien1 avec le rôle loup-garou n'a pas répondu à temps. Il/elle a été éliminé de la partie."
+    assert parse(message) == {"type": "timeout", "player": "Julien1", "role": "loup-garou"}
+
+
+def test_rules_give_the_roles_of_the_game():
+    rules = game_rules(14, 3, 1)
+    assert "14 joueurs : 3 loups-garous, 1 voyante, 10 villageois." in rules
+    assert "Voyante se réveille" in rules
+
+
+def test_rules_without_seer():
+    rules = game_rules(4, 2, 0)
+    assert "4 joueurs : 2 loups-garous, 2 villageois." in rules
+    assert "Pas de voyante dans cette partie." in rules
+    assert "la voyante" not in rules and "Villageois + voyante" not in rules
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+from werewolf import StubWerewolfPlayer
+from werewolf_server import REQUEST_ID_HEADER, PlayerRegistry, create_app
+
+NAMES = ["Aline", "Benjamin", "Chloe"]
+NIGHT = "C'est la nuit, tout le village s’endort, les joueurs ferment les yeux."
+
+
+def new_game(client, names=NAMES):
+    return [client.post("/new_game", json={"role": "villageois", "player_name": name, "players_names": names,
+                                           "werewolves_count": 1, "werewolves": []}).json["player_id"]
+            for name in names]
+
+
+def test_batch_notify_answers_for_each_player():
+    client = create_app().test_client()
+    player_ids = new_game(client)
+    response = client.post("/batch_notify", json={"player_ids": player_ids + [99], "message": NIGHT})
+    assert response.status_code == 200
+    assert set(response.json["intents"]) == {str(player_id) for player_id in player_ids}
+    assert response.json["intents"][str(player_ids[0])] == {"want_to_speak": False, "want_to_interrupt": False,
+                                                            "vote_for": None, "vote_ranking": None}
+    assert response.json["errors"] == {"99": "Player 99 not found"}
+
+
+class CountingPlayer(StubWerewolfPlayer):
+    """Counts the messages it really received."""
+    created = 0
+    notified = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CountingPlayer.created += 1
+
+    def notify(self, message):
+        CountingPlayer.notified += 1
+        return super().notify(message)
+
+
+def test_repeated_requests_are_handled_once(monkeypatch):
+    monkeypatch.setattr(CountingPlayer, "created", 0)
+    monkeypatch.setattr(CountingPlayer, "notified", 0)
+    client = create_app(CountingPlayer).test_client()
+    game = {"role": "villageois", "player_name": "Aline", "players_names": NAMES, "werewolves_count": 1, "werewolves": []}
+    first = client.post("/new_game", json=game, headers={REQUEST_ID_HEADER: "new_game-Aline"})
+    retry = client.post("/new_game", json=game, headers={REQUEST_ID_HEADER: "new_game-Aline"})
+    assert retry.json == first.json
+    assert retry.headers[REQUEST_ID_HEADER] == "new_game-Aline"
+    assert CountingPlayer.created == 1
+
+    player_id = first.json["player_id"]
+    for _ in range(2):
+        response = client.post(f"/{player_id}/notify", json={"message": NIGHT}, headers={REQUEST_ID_HEADER: "notify-1"})
+        assert response.status_code == 200
+    assert CountingPlayer.notified == 1
+    # without a request id, every request is handled
+    client.post(f"/{player_id}/notify", json={"message": NIGHT})
+    client.post(f"/{player_id}/notify", json={"message": NIGHT})
+    assert CountingPlayer.notified == 3
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic() under the control of the test."""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def add_game(registry: PlayerRegistry, game_id, players: int = 7):
+    return [registry.add(object(), game_id) for _ in range(players)]
+
+
+def test_concurrent_ids_are_unique():
+    registry = PlayerRegistry()
+    ids = []
+
+    def add(game_id):
+        ids.extend(add_game(registry, game_id, 100))
+
+    threads = [threading.Thread(target=add, args=(f"g{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ids) == list(range(400))
+
+
+def test_finished_games_are_dropped():
+    registry = PlayerRegistry(max_finished_games=2)
+    games = [add_game(registry, f"g{i}") for i in range(5)]
+    for i in range(5):
+        assert registry.end_game(f"g{i}") == 7
+    assert registry.stats()["players"] == 14
+    assert registry.get(games[2][0]) is None
+    assert registry.get(games[3][0]) is not None
+    assert registry.end_game("unknown") == 0
+
+
+def test_full_registry_drops_finished_games_only():
+    registry = PlayerRegistry(max_players=14)
+    first = add_game(registry, "g1")
+    second = add_game(registry, "g2")
+    registry.end_game("g2")
+    add_game(registry, "g3")
+    assert registry.get(second[0]) is None
+    # the games still running are kept, over the limit
+    add_game(registry, "g4")
+    assert registry.get(first[0]) is not None
+    assert registry.stats()["players"] == 21
+
+
+def test_players_without_game_are_not_dropped_when_full():
+    registry = PlayerRegistry(max_players=5)
+    ids = [registry.add(object()) for _ in range(8)]
+    assert all(registry.get(player_id) is not None for player_id in ids)
+
+
+def test_idle_games_are_dropped_on_any_request(clock):
+    registry = PlayerRegistry(idle_ttl=60)
+    idle = add_game(registry, "g1")
+    clock[0] += 30
+    active = add_game(registry, "g2")
+    clock[0] += 40
+    assert registry.stats()["games"] == 1
+    assert registry.get(idle[0]) is None
+    assert registry.get(active[0]) is not None  # the request resets the idle time
+    clock[0] += 50
+    assert registry.get(active[1]) is not None
+    clock[0] += 61
+    assert registry.end_game("g2") == 0
+    assert registry.stats()["players"] == 0
+
+
+def test_stats_and_end_game_endpoints():
+    client = create_app(StubWerewolfPlayer).test_client()
+    for name in NAMES:
+        response = client.post("/new_game", json={"role": "villageois", "player_name": name, "players_names": NAMES,
+                                                  "werewolves_count": 1, "werewolves": [], "game_id": "g1"})
+        assert response.json["ack"]
+    assert client.get("/stats").json["players"] == 3
+    assert client.post("/end_game", json={"game_id": "g1"}).json == {"ack": True, "players": 3}
+    assert client.get("/stats").json["finished_games"] == 1
@@ -0,0 +1,207 @@
+#
+# Tournament runner: plays many games concurrently against the player servers and reports win rates.
+#
+# Usage:
+#   python tournament.py --games 200 --concurrency 8 --seed 42 --output tournament_report.json
+#
+# The player servers must be running (see werewolf_server.py), as for a single game.
+#
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+from app import Logger
+from event_store import SQLiteLogger
+from game_leader import ApiCalls, GameLeader, NullLogger, Player, VILLAGER, WEREWOLF, WOLF_CONSENSUS_RANKED, WOLF_CONSENSUS_ROUNDS
+from lobby import lobby_players
+from log_setup import add_logging_arguments, setup_logging_from_args
+from metrics import REGISTRY
+
+LOG = logging.getLogger(__name__)
+
+# a game that is not over after this many nights is stopped and counted as unfinished
+MAX_DAYS: int = 30
+
+
+def load_players(config_path: str) -> List[Dict[str, Any]]:
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)["players"]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, None if there are no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def describe(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values) if values else None,
+        "min": min(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values) if values else None,
+    }
+
+
+async def play_game(players_config: List[Dict[str, Any]], api: ApiCalls, seed: int, max_days: int,
+                    wolf_consensus: str = WOLF_CONSENSUS_ROUNDS, logger: Optional[Logger] = None,
+                    record: bool = False, trace: bool = False) -> Dict[str, Any]:
+    """
+    Play a single game and return its outcome.
+
+    Args:
+        players_config: The players, as in players_config.json
+        api: The API shared by all the games of the tournament
+        seed: The seed of the game's roles and leader choices
+        max_days: Stop the game after this many nights
+        wolf_consensus: How the werewolves agree on a victim
+        logger: Where the game events are logged, shared by all the games of the tournament. None to drop them
+        record: Log the responses of the players too, so that the game can be replayed (see replay.py)
+        trace: Write the trace of the game to traces/, see tracing.py
+
+    Returns:
+        The outcome of the game: winner, length and phase timings
+    """
+    players = [Player(name=p["name"], is_female=p["is_female"], api_base_url=p["api_base_url"]) for p in players_config]
+    game = GameLeader(players, logger if logger is not None else NullLogger(), api=api, seed=seed, wolf_consensus=wolf_consensus,
+                      record_responses=record, trace=trace)
+    start = time.perf_counter()
+    winner = None
+    started = await game.start_game()
+    if started:
+        winner = await game.run(max_days=max_days)
+    else:
+        # the players that joined before the failure are still on their servers
+        await game.end_game()
+    duration = time.perf_counter() - start
+    trace_path = await game.export_trace()
+    return {
+        "game_id": game.game_id,
+        "seed": seed,
+        "started": started,
+        "winner": winner,
+        "days": game.day,
+        "rounds": game.round,
+        "werewolves": [p.name for p in players if p.role == WEREWOLF],
+        "phase_durations": game.phase_durations,
+        "duration": duration,
+        "trace": trace_path,
+    }
+
+
+async def run_tournament(players_config: List[Dict[str, Any]], games: int, concurrency: int, seed: int,
+                         max_days: int = MAX_DAYS, wolf_consensus: str = WOLF_CONSENSUS_ROUNDS, hedge: bool = False,
+                         db: Optional[str] = None, record: bool = False, trace: bool = False) -> Dict[str, Any]:
+    """
+    Play `games` games, at most `concurrency` at the same time, and summarize their outcomes.
+    Game i uses the seed `seed + i`, so that a tournament can be replayed with the same roles.
+    The events of all the games are archived in the SQLite database `db` if given, see event_store.py,
+    with the responses of the players if `record`, see replay.py. With `trace`, each game is traced, see tracing.py.
+    """
+    api = ApiCalls(hedge=hedge)
+    logger = SQLiteLogger(db) if db is not None else None
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(i: int) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = await play_game(players_config, api, seed + i, max_days, wolf_consensus, logger, record, trace)
+            except Exception as e:
+                LOG.exception("Game %d (seed %d) crashed", i, seed + i)
+                result = {"seed": seed + i, "started": False, "error": str(e)}
+            print(f"game {i + 1}/{games} (seed {seed + i}): {result.get('winner')} after {result.get('days')} nights")
+            return result
+
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*[worker(i) for i in range(games)])
+    finally:
+        await api.aclose()
+        if logger is not None:
+            logger.close()
+    duration = time.perf_counter() - start
+
+    summary = summarize(results, duration, concurrency)
+    summary["hedged_requests"] = api.hedged
+    # response times of the players over the whole tournament, and the counters of the leader (see metrics.py)
+    return {"summary": summary, "latency": api.latency.summary(), "metrics": REGISTRY.to_dict(), "games": results}
+
+
+def summarize(results: List[Dict[str, Any]], duration: float, concurrency: int) -> Dict[str, Any]:
+    played = [r for r in results if r.get("started")]
+    finished = [r for r in played if r["winner"] is not None]
+    wins = {side: sum(r["winner"] == side for r in finished) for side in (VILLAGER, WEREWOLF)}
+    return {
+        "games": len(results),
+        "failed_to_start": len(results) - len(played),
+        "unfinished": len(played) - len(finished),
+        "wins": wins,
+        "win_rates": {side: count / len(finished) if finished else None for side, count in wins.items()},
+        "days": describe([r["days"] for r in finished]),
+        "rounds": describe([r["rounds"] for r in finished]),
+        "phase_durations": {
+            phase: describe([d for r in played for d in r["phase_durations"][phase]])
+            for phase in ("night", "day")
+        },
+        "game_duration": describe([r["duration"] for r in played]),
+        "concurrency": concurrency,
+        "wall_clock": duration,
+        "games_per_second": len(results) / duration if duration > 0 else None,
+    }
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    def fmt(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.2f}"
+
+    print("*" * 80)
+    print(f"Games: {summary['games']} (failed to start: {summary['failed_to_start']}, unfinished: {summary['unfinished']})")
+    for side, count in summary["wins"].items():
+        print(f"  {side:<12} {count:>5} wins  ({fmt(summary['win_rates'][side])})")
+    for key, label in (("days", "Nights per game"), ("rounds", "Speeches per game")):
+        d = summary[key]
+        print(f"{label:<20} mean {fmt(d['mean'])}  min {fmt(d['min'])}  p50 {fmt(d['p50'])}  max {fmt(d['max'])}")
+    for phase, d in summary["phase_durations"].items():
+        print(f"{phase + ' time (s)':<20} mean {fmt(d['mean'])}  p50 {fmt(d['p50'])}  p95 {fmt(d['p95'])}  max {fmt(d['max'])}")
+    print(f"Wall clock: {summary['wall_clock']:.1f}s with {summary['concurrency']} concurrent games "
+          f"({fmt(summary['games_per_second'])} games/s)")
+    print("*" * 80)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play many werewolf games concurrently and report win rates.")
+    parser.add_argument("--games", type=int, default=100, help="number of games to play")
+    parser.add_argument("--concurrency", type=int, default=8, help="max number of games played at the same time")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game, game i uses seed + i")
+    parser.add_argument("--max-days", type=int, default=MAX_DAYS, help="stop a game after this many nights")
+    parser.add_argument("--wolf-consensus", choices=[WOLF_CONSENSUS_ROUNDS, WOLF_CONSENSUS_RANKED], default=WOLF_CONSENSUS_ROUNDS,
+                        help="how the werewolves agree on a victim")
+    parser.add_argument("--hedge", action="store_true", help="resend slow requests to the servers that deduplicate them")
+    parser.add_argument("--db", help="archive the events of the games in this SQLite database")
+    parser.add_argument("--record", action="store_true", help="archive the responses of the players too, to replay the games")
+    parser.add_argument("--trace", action="store_true", help="write the trace of each game to traces/, see tracing.py")
+    parser.add_argument("--config", default="players_config.json", help="players configuration")
+    parser.add_argument("--lobby", type=int, help="play with this many players, with generated names, on the servers of --config")
+    parser.add_argument("--output", default="tournament_report.json", help="where the JSON report is written")
+    # the logs of the games are kept in game_leader.log only
+    add_logging_arguments(parser, console_level="WARNING")
+    args = parser.parse_args()
+    setup_logging_from_args(args)
+
+    players_config = load_players(args.config)
+    if args.lobby is not None:
+        players_config = lobby_players(args.lobby, players_config)
+    report = asyncio.run(run_tournament(players_config, args.games, args.concurrency, args.seed, args.max_days,
+                                        args.wolf_consensus, args.hedge, args.db, args.record, args.trace))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print_summary(report["summary"])
+    print(f"Report written to {args.output}")
@@ -0,0 +1,217 @@
+#
+# Spans of a game, exported in the Chrome trace format (open them in https://ui.perfetto.dev or chrome://tracing).
+#
+# The game leader traces its phases and its calls to the players, and sends TRACE_ID_HEADER with every request.
+# werewolf_server.py traces the requests that carry it (and the LLM calls of the players), keeps their spans,
+# and returns them on GET /trace/<trace_id>: they are shown in the trace of the game, under the requests of the leader.
+#
+# Usage:
+#   python game_leader.py --trace                 # writes traces/<game_id>.json
+#   python tournament.py --games 20 --trace       # one trace per game
+#
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Any, ContextManager, Dict, List, Optional
+
+TRACE_DIR: str = "traces"
+TRACE_ID_HEADER: str = "X-Trace-Id"
+PARENT_SPAN_HEADER: str = "X-Parent-Span-Id"  # the span of the leader that sent the request
+LEADER_PROCESS: str = "game_leader"
+LEADER_TRACK: str = "leader"
+# spans kept by a server until the leader fetches them
+MAX_TRACES: int = 64
+MAX_SPANS_PER_TRACE: int = 100000
+
+# the span being recorded, in the current task (leader) or thread (server)
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A span being recorded. Once over, it is added to its tracer's spans as a dict, see Tracer.span."""
+
+    def __init__(self, tracer: "Tracer", name: str, process: str, track: str, parent_id: Optional[str], args: Dict[str, Any]):
+        self.tracer: "Tracer" = tracer
+        self.name: str = name
+        self.span_id: str = os.urandom(8).hex()
+        self.process: str = process
+        self.track: str = track
+        self.parent_id: Optional[str] = parent_id
+        self.args: Dict[str, Any] = args
+
+
+class Tracer:
+    """
+    Records the spans of a trace (a game, or the requests of a game handled by a server).
+    A disabled tracer records nothing, and its spans cost almost nothing.
+    """
+
+    def __init__(self, trace_id: Optional[str] = None, process: str = LEADER_PROCESS, enabled: bool = True):
+        self.trace_id: str = trace_id if trace_id is not None else os.urandom(16).hex()
+        self.process: str = process
+        self.enabled: bool = enabled
+        self.spans: List[Dict[str, Any]] = []
+
+    def span(self, name: str, track: Optional[str] = None, parent_id: Optional[str] = None, **args: Any) -> ContextManager:
+        """
+        Record a span around a block of code, as a child of the current span.
+
+        Args:
+            name: The name of the span, e.g. "night_time"
+            track: Where the span is shown, e.g. a player name. By default the track of the current span
+            parent_id: The parent span, by default the current span (e.g. the request of the leader, on a server)
+            args: Shown with the span
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, track, parent_id, args)
+
+    def _span(self, name: str, track: Optional[str], parent_id: Optional[str], args: Dict[str, Any]) -> "SpanContext":
+        current = _current.get()
+        if track is None:
+            track = current.track if current is not None and current.tracer is self else LEADER_TRACK
+        if parent_id is None and current is not None:
+            parent_id = current.span_id
+        span = Span(self, name, self.process, track, parent_id, args)
+        return SpanContext(span)
+
+    def add(self, spans: List[Dict[str, Any]]) -> None:
+        """Add the spans recorded elsewhere, e.g. by the servers."""
+        self.spans.extend(spans)
+
+    def export(self, path: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Write the spans to `path` in the Chrome trace format."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(chrome_trace(self.spans, {"trace_id": self.trace_id, **(metadata or {})}), f)
+
+
+class SpanContext:
+    """The context manager of a span: makes it the current span, and adds it to its tracer when it is over."""
+
+    def __init__(self, span: Span):
+        self.span: Span = span
+
+    def __enter__(self) -> Span:
+        self.token = _current.set(self.span)
+        self.start = time.time()
+        self.perf_start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self.perf_start
+        _current.reset(self.token)
+        span = self.span
+        if exc_type is not None:
+            span.args["error"] = exc_type.__name__
+        span.tracer.spans.append({
+            "name": span.name,
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "process": span.process,
+            "track": span.track,
+            "start": self.start,
+            "duration": duration,
+            "args": span.args,
+        })
+
+
+def span(name: str, track: Optional[str] = None, **args: Any) -> ContextManager:
+    """A span in the current trace, e.g. around a request to a player. Nothing if there is no current trace."""
+    current = _current.get()
+    if current is None:
+        return nullcontext()
+    return current.tracer.span(name, track, **args)
+
+
+def annotate(**args: Any) -> None:
+    """Add arguments to the current span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.args.update(args)
+
+
+def headers() -> Dict[str, str]:
+    """The headers that make a server trace a request as a child of the current span."""
+    current = _current.get()
+    if current is None:
+        return {}
+    return {TRACE_ID_HEADER: current.tracer.trace_id, PARENT_SPAN_HEADER: current.span_id}
+
+
+def traced(method):
+    """Records a span around an async method of an object with a `tracer`, named after the method."""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        with self.tracer.span(method.__name__):
+            return await method(self, *args, **kwargs)
+    return wrapper
+
+
+class SpanStore:
+    """The spans of the last MAX_TRACES traces, kept by a server until the leader fetches them."""
+
+    def __init__(self, max_traces: int = MAX_TRACES):
+        self.max_traces: int = max_traces
+        self._lock: threading.Lock = threading.Lock()
+        self._traces: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+
+    def add(self, trace_id: str, spans: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            trace = self._traces.setdefault(trace_id, [])
+            trace.extend(spans[:MAX_SPANS_PER_TRACE - len(trace)])
+            self._traces.move_to_end(trace_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def pop(self, trace_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._traces.pop(trace_id, [])
+
+
+def chrome_trace(spans: List[Dict[str, Any]], metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert spans to the Chrome trace format: one process per program (the leader, each server),
+    one thread per track (the leader, each player), and an arrow from each request of the leader to its handling on a server.
+    """
+    if not spans:
+        return {"traceEvents": [], "displayTimeUnit": "ms", "otherData": metadata}
+    origin = min(s["start"] for s in spans)
+    pids: Dict[str, int] = {}
+    tids: Dict[tuple, int] = {}
+    events: List[Dict[str, Any]] = []
+
+    def ids(process: str, track: str) -> tuple:
+        if process not in pids:
+            pids[process] = len(pids) + 1
+            events.append({"name": "process_name", "ph": "M", "pid": pids[process], "args": {"name": process}})
+        if (process, track) not in tids:
+            tids[(process, track)] = len(tids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": pids[process], "tid": tids[(process, track)],
+                           "args": {"name": track}})
+        return pids[process], tids[(process, track)]
+
+    by_id = {s["span_id"]: s for s in spans}
+    for s in sorted(spans, key=lambda s: s["start"]):
+        pid, tid = ids(s["process"], s["track"])
+        start = (s["start"] - origin) * 1e6
+        events.append({
+            "name": s["name"], "cat": s["process"], "ph": "X", "pid": pid, "tid": tid,
+            "ts": start, "dur": s["duration"] * 1e6,
+            "args": {**s["args"], "span_id": s["span_id"], "parent_id": s["parent_id"]},
+        })
+        parent = by_id.get(s["parent_id"])
+        if parent is not None and parent["process"] != s["process"]:
+            # the clocks of the programs may differ a little: the arrow starts within the parent
+            parent_start = (parent["start"] - origin) * 1e6
+            flow_start = min(max(start, parent_start), parent_start + parent["duration"] * 1e6)
+            parent_pid, parent_tid = ids(parent["process"], parent["track"])
+            events.append({"name": "request", "cat": "flow", "ph": "s", "id": s["span_id"], "pid": parent_pid, "tid": parent_tid,
+                           "ts": flow_start})
+            events.append({"name": "request", "cat": "flow", "ph": "f", "bp": "e", "id": s["span_id"], "pid": pid, "tid": tid,
+                           "ts": start})
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": metadata}
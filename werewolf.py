@@ -1,24 +1,50 @@
 from operator import truediv
-import openai
 from pydantic import BaseModel
 from abc import ABC, abstractmethod
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import functools
 import random
 import re
-from api_key import OPENAI_API_KEY
+import threading
+
+from tracing import span
+
+if TYPE_CHECKING:
+    import openai
+
+_client = None
+_client_lock = threading.Lock()
+
+#API KEY, only read when the LLM is used for the first time (the stub player doesn't need it)
+#openai too: importing it takes most of the startup of a server
+def get_client() -> "openai.OpenAI":
+    global _client
+    with _client_lock:
+        if _client is None:
+            import openai
+            from api_key import OPENAI_API_KEY
+            _client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+#One call to the LLM, traced under the request of the leader that asked for it (see tracing.py)
+def complete(prompt: str, purpose: str) -> str:
+    with span("llm", model="gpt-4.1", purpose=purpose):
+        return get_client().chat.completions.create(
+            model="gpt-4.1",
+            messages=[{"role": "user", "content": prompt}]
+        ).choices[0].message.content
 
-#API KEY
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
-PLAYER_NAMES = ["Aline", "Benjamin", "Chloe", "David", "Elise", "Frédéric", "Gabrielle", "Hugo", "Inès", "Julien", "Karine", "Léo", "Manon", "Noé"]
 PLAYER_ROLES = ["villageois", "voyante", "loup-garou"]
+# rosters (lists of players' names) whose regexes are kept, see roster_patterns
+MAX_CACHED_ROSTERS: int = 64
 
-#Rules for caching
-rules = """"
+#Rules for caching: the same text for all the prompts of a game, see game_rules
+RULES = """"
        Tu joues à "LLMs-Garous", une adaptation LLM du jeu Les Loups-Garous de Thiercelieux.
         🎯 Objectif :
-        - 14 joueurs : 3 loups-garous, 1 voyante, 10 villageois.
-        - Loups-garous : éliminer tous les villageois et la voyante.
-        - Villageois + voyante : identifier et éliminer les loups-garous.
+        - {players_count} joueurs : {roles}.
+        - Loups-garous : éliminer tous les {village}.
+        - {village_side} : identifier et éliminer les loups-garous.
         
         🕓 Déroulement des tours :
         Chaque tour comporte deux phases : nuit et jour.
@@ -26,7 +52,7 @@ rules = """"
         🌙 Nuit :
         - Meneur : "C’est la nuit, tout le village s’endort."
         - Loups-garous se réveillent, se reconnaissent, votent une victime.
-        - Voyante se réveille et peut sonder un joueur.
+        - {seer_night}
         - Villageois dorment.
         
         🌞 Jour :
@@ -47,17 +73,54 @@ rules = """"
         - Ton but est de faire gagner ton camp.
        """
 
+
+@functools.lru_cache(maxsize=MAX_CACHED_ROSTERS)
+def game_rules(players_count: int, werewolves_count: int, seers_count: int = 1) -> str:
+    """The rules, with the numbers of players, werewolves and seers of the game (small games have no seer)."""
+    villagers_count = max(0, players_count - werewolves_count - seers_count)
+    if seers_count > 0:
+        return RULES.format(players_count=players_count,
+                            roles=f"{werewolves_count} loups-garous, {seers_count} voyante, {villagers_count} villageois",
+                            village="villageois et la voyante", village_side="Villageois + voyante",
+                            seer_night="Voyante se réveille et peut sonder un joueur.")
+    return RULES.format(players_count=players_count, roles=f"{werewolves_count} loups-garous, {villagers_count} villageois",
+                        village="villageois", village_side="Villageois", seer_night="Pas de voyante dans cette partie.")
+
+
+@functools.lru_cache(maxsize=MAX_CACHED_ROSTERS)
+def roster_patterns(players_names: Tuple[str, ...]) -> Dict[str, re.Pattern]:
+    """
+    The regexes of parse_message for the players of a game, compiled once per roster: with hundreds of players,
+    compiling them takes longer than parsing a message. A player gets them once, when the game starts.
+    """
+    # the longest names first, so that Aline1 is not read as Aline
+    name_pattern = r"(" + "|".join(re.escape(n) for n in sorted(players_names, key=len, reverse=True)) + ")"
+    role_pattern = r"(" + "|".join(PLAYER_ROLES) + ")"
+    return {
+        "voyante_result": re.compile(rf"Le rôle de {name_pattern} est {role_pattern}"),
+        "vote": re.compile(rf"{name_pattern} a voté pour {name_pattern}"),
+        "morning_victim": re.compile(
+            rf"Cette nuit, {name_pattern} a été mangé\.e par les loups.?garous\. Son rôle était {role_pattern}\.(.*)"),
+        "vote_result": re.compile(rf"Ainsi, {name_pattern} est mort\(e\) et son rôle était {role_pattern}"),
+        "speech": re.compile(rf"{name_pattern} a dit: (.+)"),
+        "timeout": re.compile(rf"{name_pattern} avec le rôle {role_pattern} n'a pas répondu à temps"),
+    }
+
+
 #This function parse the raw message (given by the game leader) and find the important informations
-def parse_message(message: str) -> dict:
+def parse_message(message: str, patterns: Dict[str, re.Pattern]) -> dict:
+    """
+    Args:
+        message: The message of the game leader
+        patterns: The regexes of the players of the game, see roster_patterns
+    """
     data = {}
-    name_pattern = r"(" + "|".join(PLAYER_NAMES) + ")"
-    role_pattern = r"(" + "|".join(PLAYER_ROLES) + ")"
 
     # Voyante
     if message.startswith("La Voyante se réveille"):
         data["type"] = "voyante_wakeup"
     elif message.startswith("Le rôle de"):
-        m = re.match(rf"Le rôle de {name_pattern} est {role_pattern}", message)
+        m = patterns["voyante_result"].match(message)
         if m:
             data["type"] = "voyante_result"
             data["player"] = m.group(1)
@@ -68,22 +131,20 @@ def parse_message(message: str) -> dict:
         data["type"] = "werewolves_wakeup"
     elif "Les Loups-Garous votent pour une nouvelle victime" in message:
         data["type"] = "werewolves_vote"
-        vote_pattern = rf"{name_pattern} a voté pour {name_pattern}"
-        data["werewolves_votes"] = re.findall(vote_pattern, message)
+        data["werewolves_votes"] = patterns["vote"].findall(message)
+        data["ranked"] = "Classez vos cibles" in message
 
     # Nuit
     elif "C'est la nuit" in message:
         data["type"] = "night_start"
     elif "Cette nuit, personne n'a été mangé.e" in message:
-        m = re.search(r"Cette nuit, personne n'a été mangé\.e par les", message)
+        m = re.search(r"Cette nuit, personne n'a été mangé\.e par les loups.?garous\.(.*)", message)
         data["type"] = "morning_no_victim"
         rumor_text = m.group(1).strip() if m and m.group(1) else ""
         if rumor_text:
             data["rumor"] = rumor_text # type: ignore
     elif "Cette nuit, " in message and "a été mangé.e" in message:
-        m = re.search(
-            rf"Cette nuit, {name_pattern} a été mangé\.e par les loups.?garous\. Son rôle était {role_pattern}\.(.*)",
-            message)
+        m = patterns["morning_victim"].search(message)
         if m:
             data["type"] = "morning_victim"
             data["victim"] = m.group(1)
@@ -99,21 +160,19 @@ def parse_message(message: str) -> dict:
     elif message.startswith("Il est temps de voter"):
         data["type"] = "vote_now"
     elif "est mort(e) et son rôle était" in message:
-        m = re.search(rf"Ainsi, {name_pattern} est mort\(e\) et son rôle était {role_pattern}", message)
+        m = patterns["vote_result"].search(message)
         if m:
             data["type"] = "vote_result"
             data["victim"] = m.group(1)
             data["role"] = m.group(2)
-        vote_pattern = rf"{name_pattern} a voté pour {name_pattern}"
-        data["votes"] = re.findall(vote_pattern, message)
+        data["votes"] = patterns["vote"].findall(message)
     elif "Il n'y a pas de victime" in message:
         data["type"] = "vote_no_victim"
-        vote_pattern = rf"{name_pattern} a voté pour {name_pattern}"
-        data["votes"] = re.findall(vote_pattern, message)
+        data["votes"] = patterns["vote"].findall(message)
 
     # Discours
     elif " a dit: " in message:
-        m = re.match(rf"{name_pattern} a dit: (.+)", message)
+        m = patterns["speech"].match(message)
         if m:
             data["type"] = "speech"
             data["speaker"] = m.group(1)
@@ -121,7 +180,7 @@ def parse_message(message: str) -> dict:
 
     # Timeout
     elif "n'a pas répondu à temps" in message:
-        m = re.match(rf"({name_pattern}) avec le rôle ({role_pattern}) n’a pas répondu à temps", message)
+        m = patterns["timeout"].match(message)
         if m:
             data["type"] = "timeout"
             data["player"] = m.group(1)
@@ -133,30 +192,38 @@ class Intent(BaseModel):
     want_to_speak: bool = False
     want_to_interrupt: bool = False
     vote_for: str = None
+    vote_ranking: Optional[List[str]] = None  # vote des loups-garous par classement, cible préférée en premier
 
 
 class WerewolfPlayerInterface(ABC):
     @classmethod
     def create(cls, name: str, role: str, players_names: List[str], werewolves_count: int,
-               werewolves: List[str]) -> 'WerewolfPlayerInterface':
-        return cls(name, role, players_names, werewolves_count, werewolves)
+               werewolves: List[str], seers_count: int = 1) -> 'WerewolfPlayerInterface':
+        return cls(name, role, players_names, werewolves_count, werewolves, seers_count)
     @abstractmethod
     def speak(self) -> str:
         pass
     @abstractmethod
     def notify(self, message: str) -> Intent:
         pass
+    def warmup(self) -> None:
+        # called once before the first night, to open connections (LLM...) ahead of time
+        pass
 
 
 class WerewolfPlayer(WerewolfPlayerInterface):
     #This code is exectuted only at the beginning of the game
-    def __init__(self, name: str, role: str, players_names: List[str], werewolves_count: int, werewolves: List[str]) -> None:
+    def __init__(self, name: str, role: str, players_names: List[str], werewolves_count: int, werewolves: List[str],
+                 seers_count: int = 1) -> None:
         #Information about myself and my role
         self.name = name
         self.role = role
         self.players_names = players_names
         self.werewolves_count = werewolves_count
+        self.seers_count = seers_count
         self.werewolves = werewolves
+        self.rules = game_rules(len(players_names), werewolves_count, seers_count)
+        self.patterns = roster_patterns(tuple(players_names))  # to parse the messages, see parse_message
 
         #Information updated during the game
         self.messages = []
@@ -177,6 +244,11 @@ class WerewolfPlayer(WerewolfPlayerInterface):
         self.suspected_player = set()
         self.number_tour = 0
 
+    #Open the connection to the LLM before the game starts
+    def warmup(self) -> None:
+        with span("llm", model="gpt-4.1", purpose="warmup"):
+            get_client().models.retrieve("gpt-4.1")
+
     #This function say the last message written in msg_to_say
     def speak(self) -> str:
         self.speech_count_myself += 1
@@ -202,7 +274,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
 
         # 🎯 Prompt enrichi
         prompt = f"""
-            {rules}
+            {self.rules}
             🎮 CONTEXTE DU JOUEUR :
             - Nom : {self.name}
             - Rôle : {self.role}
@@ -263,10 +335,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
             - "SILENT" si tu ne dis rien.
         """
         # Appel à GPT
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}]
-        ).choices[0].message.content.strip().replace('\u202f', ' ')
+        response = complete(prompt, "choose_to_speak_interrupt").strip().replace('\u202f', ' ')
         response = response.replace('\u2009', ' ')
 
         # 🎮 Interprétation
@@ -319,7 +388,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
 
         # 🎯 Construction du prompt complet
         prompt = f"""
-            {rules}
+            {self.rules}
         
             🎭 Ton rôle : {self.role}
             👤 Ton nom : {self.name}
@@ -360,10 +429,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
             - Donne **UNIQUEMENT le nom du joueur que tu veux éliminer**.
     """
 
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}]
-        ).choices[0].message.content.strip().replace('\u202f', ' ')
+        response = complete(prompt, "choose_vote").strip().replace('\u202f', ' ')
 
         response = response.replace('\u2009', ' ')
 
@@ -380,7 +446,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
         suspected_player = ", ".join(p for p in self.suspected_player if p in self.alive_players)
 
         prompt = f"""
-            {rules}
+            {self.rules}
 
             Tu es la voyante dans une partie de Loups-Garous de Thiercelieux.
 
@@ -396,10 +462,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
             - Priorise les joueurs suspects ou hostiles envers toi.
             - Donne UNIQUEMENT le nom du joueur que tu veux sonder.
             """
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}]
-        ).choices[0].message.content.strip()
+        response = complete(prompt, "choose_vote_voyante").strip()
 
         response = response.replace('\u202f', ' ')
         response = response.replace('\u2009', ' ')
@@ -407,7 +470,8 @@ class WerewolfPlayer(WerewolfPlayerInterface):
         print(response)
         return response
 
-    def choose_vote_wolf(self) -> str:
+    #Returns the ranking of the targets, preferred first (a single target if not ranked)
+    def choose_vote_wolf(self, ranked: bool = False) -> List[str]:
         if self.last_vote_target not in self.alive_players:
             self.last_vote_target = None
 
@@ -420,10 +484,30 @@ class WerewolfPlayer(WerewolfPlayerInterface):
         recent_attackers = ", ".join(self.voted_me_last_round)
         suspected_player = ", ".join(p for p in self.suspected_player if p in self.alive_players)
 
-        if not wolf_votes:
+        if ranked:
             prompt = f"""
 
-                      {rules}
+                      {self.rules}
+                      Ton nom : {self.name}
+                      Tu es un loup-garou. 
+                      Joueurs en vie : {alive}. 
+                      Loups : {wolves}. 
+                      Ont voté contre toi : {recent_attackers}.
+                      Suspects : {suspected_player}
+                      Speeches : {statements}
+                      Messages : {messages}.
+
+                      TA TÂCHE :
+                      - Les loups ne votent qu'une fois : classe jusqu'à 3 cibles parmi les non-loups, de la plus à la moins souhaitée.
+                      - Si tu penses savoir qui est la voyante mets-la en premier.
+                      - Ne classe jamais des loups
+                      - Donne la priorité aux joueurs les plus hostiles envers toi ou les plus suspects.
+                      - Donne UNIQUEMENT les noms, séparés par des virgules.
+                      """
+        elif not wolf_votes:
+            prompt = f"""
+
+                      {self.rules}
                       Ton nom : {self.name}
                       Tu es un loup-garou. 
                       Joueurs en vie : {alive}. 
@@ -445,7 +529,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
             votes = ", ".join(f"{v} → {t}" for v, t in wolf_votes)
             prompt = f"""
 
-                      {rules}
+                      {self.rules}
                       Ton nom : {self.name}
                       Tu es un loup-garou. 
                       Joueurs en vie : {alive}. 
@@ -465,17 +549,19 @@ class WerewolfPlayer(WerewolfPlayerInterface):
                       - Sinon, vote pour celle qui est la plus souvent ciblée.
                       - Donne UNIQUEMENT le nom d'un joueur.
                       """
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": prompt}]
-        ).choices[0].message.content.strip()
+        response = complete(prompt, "choose_vote_wolf").strip()
 
         response = response.replace('\u202f', ' ')
         response = response.replace('\u2009', ' ')
 
         print(response)
+        if ranked:
+            names = dict.fromkeys(part.strip(" .\"'«»") for part in re.split(r"[,\n]", response))
+            ranking = [p for p in names if p in eligible_targets]
+            self.last_vote_target = ranking[0] if ranking else None
+            return ranking
         self.last_vote_target = response
-        return response
+        return [response]
 
     def display(self):
         print("\n" + "=" * 50)
@@ -546,7 +632,7 @@ class WerewolfPlayer(WerewolfPlayerInterface):
     def notify(self, message: str) -> Intent:
         self.messages.append(message)
         intent = Intent()
-        parsed = parse_message(message)
+        parsed = parse_message(message, self.patterns)
         msg_type = parsed.get("type")
 
 
@@ -566,7 +652,10 @@ class WerewolfPlayer(WerewolfPlayerInterface):
 
         elif msg_type == "werewolves_vote" and self.role == "loup-garou":
             self.last_wolf_votes = parsed.get("werewolves_votes", [])
-            intent.vote_for = self.choose_vote_wolf()
+            ranking = self.choose_vote_wolf(ranked=parsed.get("ranked", False))
+            intent.vote_for = ranking[0] if ranking else None
+            if parsed.get("ranked"):
+                intent.vote_ranking = ranking
             self.my_actions.append(("vote", intent.vote_for))
 
         # -- PHASE DE NUIT --
@@ -643,4 +732,90 @@ class WerewolfPlayer(WerewolfPlayerInterface):
 
         self.display()
 
-        return intent
\ No newline at end of file
+        return intent
+
+class StubWerewolfPlayer(WerewolfPlayerInterface):
+    """
+    Offline player that doesn't use any LLM, for load-testing and benchmarking the game.
+    Its decisions come from a cheap policy seeded by (seed, name): random votes among the players
+    it thinks are alive, speak/interrupt with fixed probabilities and canned speeches.
+    The same seed and the same messages always give the same answers.
+    """
+    # set once per server (see werewolf_server.py --stub --seed)
+    seed: int = 0
+    speak_probability: float = 0.3
+    interrupt_probability: float = 0.05
+    speeches = [
+        "Je trouve que {target} est bien silencieux.se depuis le début.",
+        "{target}, qu'as-tu fait cette nuit ?",
+        "Je suis sûr.e que {target} est un loup-garou.",
+        "Je suis simple villageois.e, je n'ai rien à cacher.",
+        "Votons pour {target}, son comportement est suspect.",
+    ]
+
+    def __init__(self, name: str, role: str, players_names: List[str], werewolves_count: int, werewolves: List[str],
+                 seers_count: int = 1) -> None:
+        self.name = name
+        self.role = role
+        self.players_names = players_names
+        self.werewolves = werewolves
+        self.patterns = roster_patterns(tuple(players_names))  # to parse the messages, see parse_message
+        self.rng = random.Random(f"{self.seed}-{name}")
+        self.alive_players = [p for p in players_names if p != name]  # a list, to keep the choices reproducible
+        # werewolves never target each other. updated with alive_players, so that a choice doesn't go through all the players
+        allies = set(werewolves) if role == "loup-garou" else set()
+        self.targets = [p for p in self.alive_players if p not in allies]
+        self.interrupt_count = 2
+        self.msg_to_say = ""
+
+    def speak(self) -> str:
+        # the leader may give the floor after a message where we chose to stay silent
+        if not self.msg_to_say:
+            self.msg_to_say = self.rng.choice(self.speeches).format(target=self.choose_target() or self.name)
+        return self.msg_to_say
+
+    def choose_target(self) -> Optional[str]:
+        return self.rng.choice(self.targets) if self.targets else None
+
+    def choose_ranking(self, size: int = 3) -> List[str]:
+        # only asked to the werewolves, whose targets are the other players
+        return self.rng.sample(self.targets, min(size, len(self.targets)))
+
+    def choose_to_speak_interrupt(self, intent: Intent) -> None:
+        draw = self.rng.random()
+        target = self.choose_target() or self.name
+        if draw < self.interrupt_probability and self.interrupt_count > 0:
+            intent.want_to_interrupt = True
+            self.interrupt_count -= 1
+        elif draw < self.interrupt_probability + self.speak_probability:
+            intent.want_to_speak = True
+        else:
+            self.msg_to_say = ""
+            return
+        self.msg_to_say = self.rng.choice(self.speeches).format(target=target)
+
+    def notify(self, message: str) -> Intent:
+        intent = Intent()
+        parsed = parse_message(message, self.patterns)
+        msg_type = parsed.get("type")
+
+        # keep track of the eliminated players
+        dead = parsed.get("victim") or (parsed.get("player") if msg_type == "timeout" else None)
+        if dead is not None and dead in self.alive_players:
+            self.alive_players.remove(dead)
+            if dead in self.targets:
+                self.targets.remove(dead)
+
+        if msg_type == "voyante_wakeup" and self.role == "voyante":
+            intent.vote_for = self.choose_target()
+        elif msg_type == "werewolves_vote" and self.role == "loup-garou":
+            if parsed.get("ranked"):
+                intent.vote_ranking = self.choose_ranking()
+                intent.vote_for = intent.vote_ranking[0] if intent.vote_ranking else None
+            else:
+                intent.vote_for = self.choose_target()
+        elif msg_type == "vote_now":
+            intent.vote_for = self.choose_target()
+        elif msg_type in ("morning_victim", "morning_no_victim", "pre_vote", "speech", "timeout"):
+            self.choose_to_speak_interrupt(intent)
+        return intent
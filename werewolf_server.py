@@ -1,17 +1,232 @@
+import argparse
+import contextvars
+import functools
+import os
+import signal
 import sys
-from flask import Flask, request, jsonify
-from werewolf import WerewolfPlayer
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from flask import Flask, Response, request, jsonify
+from werewolf import WerewolfPlayer, WerewolfPlayerInterface, StubWerewolfPlayer
+from profiling import PROFILE_DIR, Profiler, print_import_times
+from tracing import PARENT_SPAN_HEADER, TRACE_ID_HEADER, SpanStore, Tracer, span
 import logging
 import json
+import threading
 from datetime import datetime
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
 
-def create_app():
+LOG = logging.getLogger(__name__)
+
+# max number of players notified in parallel by a single /batch_notify call
+BATCH_NOTIFY_WORKERS: int = 32
+# a request repeated with the same id (a retry or a hedged request of the leader) gets the response of the first one
+REQUEST_ID_HEADER: str = "X-Request-Id"
+MAX_REMEMBERED_REQUESTS: int = 1024
+# the players of the oldest finished games are dropped beyond this many players
+MAX_PLAYERS: int = 4096
+# the players of a game that gets no request for this long (seconds) are dropped, e.g. if its leader crashed
+GAME_IDLE_TTL: float = 3600.0
+# the finished games (see /end_game) whose players are kept, for the requests still on their way
+MAX_FINISHED_GAMES: int = 4
+
+
+@dataclass
+class HostedPlayer:
+    player: WerewolfPlayerInterface
+    game_id: str
+    # a player handles one message at a time, even if the leader sends several at once (e.g. at night)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+@dataclass
+class HostedGame:
+    player_ids: List[int]
+    last_used: float  # time.monotonic() of its last request
+    finished: bool = False
+
+
+class PlayerRegistry:
+    """
+    The players hosted by a server, by player_id, grouped by game. Its memory is bounded: the players of a game are
+    dropped MAX_FINISHED_GAMES games after it ends, after GAME_IDLE_TTL without requests, or when there are more
+    than max_players players and the game is over (the finished games used the longest ago first).
+    Being over max_players never drops the players of a game still running, there are more than max_players players
+    instead; but a running game without requests for GAME_IDLE_TTL is dropped (its leader probably crashed).
+
+    The player ids are never reused, a request for a dropped player gets a 404 rather than another player.
+    """
+
+    def __init__(self, max_players: int = MAX_PLAYERS, idle_ttl: float = GAME_IDLE_TTL,
+                 max_finished_games: int = MAX_FINISHED_GAMES):
+        self.max_players: int = max_players
+        self.idle_ttl: float = idle_ttl
+        self.max_finished_games: int = max_finished_games
+        self._players: Dict[int, HostedPlayer] = {}
+        # the games, the one used the longest ago first
+        self._games: OrderedDict[str, HostedGame] = OrderedDict()
+        self._next_id: int = 0
+        self._dropped_games: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def add(self, player: WerewolfPlayerInterface, game_id: Optional[str] = None) -> int:
+        """Host a new player of the game `game_id` (None if the leader doesn't tell, the player is then its own game)."""
+        with self._lock:
+            player_id = self._next_id
+            self._next_id += 1
+            game_id = game_id if game_id is not None else f"player-{player_id}"
+            now = time.monotonic()
+            self._drop_idle(now)
+            while len(self._players) >= self.max_players:
+                oldest = next((g for g, game in self._games.items() if game.finished), None)
+                if oldest is None:
+                    if len(self._players) == self.max_players:  # once, when the limit is crossed
+                        LOG.warning("More than %d players in games still running", self.max_players)
+                    break
+                self._drop(oldest)
+            game = self._games.setdefault(game_id, HostedGame([], now))
+            game.player_ids.append(player_id)
+            self._players[player_id] = HostedPlayer(player, game_id)
+            self._touch(game_id, now)
+            return player_id
+
+    def get(self, player_id: Any) -> Optional[HostedPlayer]:
+        with self._lock:
+            now = time.monotonic()
+            self._drop_idle(now)
+            hosted = self._players.get(player_id)
+            if hosted is not None:
+                self._touch(hosted.game_id, now)
+            return hosted
+
+    def end_game(self, game_id: str) -> int:
+        """The game is over: its players are dropped later, see the class. Returns the number of players of the game."""
+        with self._lock:
+            self._drop_idle(time.monotonic())
+            game = self._games.get(game_id)
+            if game is None:
+                return 0
+            game.finished = True
+            finished = [g for g, game in self._games.items() if game.finished]
+            for g in finished[:max(0, len(finished) - self.max_finished_games)]:
+                self._drop(g)
+            return len(game.player_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._drop_idle(time.monotonic())
+            return {
+                "players": len(self._players),
+                "games": len(self._games),
+                "finished_games": sum(game.finished for game in self._games.values()),
+                "dropped_games": self._dropped_games,
+                "players_created": self._next_id,
+                "max_players": self.max_players,
+            }
+
+    def _touch(self, game_id: str, now: float) -> None:
+        game = self._games[game_id]
+        game.last_used = now
+        self._games.move_to_end(game_id)
+
+    def _drop_idle(self, now: float) -> None:
+        # on every request, not only /new_game: the players of a crashed leader are dropped even if no game starts after
+        while self._games:
+            game_id, game = next(iter(self._games.items()))
+            if now - game.last_used < self.idle_ttl:
+                break
+            self._drop(game_id)
+
+    def _drop(self, game_id: str) -> None:
+        for player_id in self._games.pop(game_id).player_ids:
+            del self._players[player_id]
+        self._dropped_games += 1
+
+
+def create_app(player_class: type[WerewolfPlayerInterface] = WerewolfPlayer, profiler: Optional[Profiler] = None):
     app = Flask(__name__)
     
-    # where players are stored. TODO check that not too many players are created; remove "old" players
-    app.config['WerewolfPlayers'] = {}
+    # where players are stored, until their game is over (see PlayerRegistry)
+    app.config['Players'] = PlayerRegistry()
+    # shared by all /batch_notify calls, so that no thread pool is created per request
+    app.config['NotifyExecutor'] = ThreadPoolExecutor(max_workers=BATCH_NOTIFY_WORKERS, thread_name_prefix="batch_notify")
     
+    # responses by request id: [event set once the response is ready, (body, status, mimetype)]
+    app.config['Responses'] = OrderedDict()
+    app.config['ResponsesLock'] = threading.Lock()
+    # spans of the requests sent with TRACE_ID_HEADER, until the leader fetches them (see tracing.py)
+    app.config['Traces'] = SpanStore()
+    # profiles of the players' notify and speak, with --profile (see profiling.py)
+    app.config['Profiler'] = profiler if profiler is not None else Profiler(enabled=False)
+
+    def notify_player(hosted: HostedPlayer, message):
+        with hosted.lock, app.config['Profiler'].phase("notify"):
+            return hosted.player.notify(message)
+
+    def timed_notify_player(hosted: HostedPlayer, message):
+        start = time.perf_counter()
+        with span("notify", track=hosted.player.name):
+            intent = notify_player(hosted, message)
+        return intent, time.perf_counter() - start
+
+    def traced(handler):
+        """
+        Trace the requests that carry TRACE_ID_HEADER, as children of the leader's span in PARENT_SPAN_HEADER,
+        on the track of their player. Their spans are kept until the leader fetches them with GET /trace/<trace_id>.
+        """
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            trace_id = request.headers.get(TRACE_ID_HEADER)
+            if trace_id is None:
+                return handler(*args, **kwargs)
+            tracer = Tracer(trace_id, process=f"werewolf_server {request.host}")
+            hosted = app.config['Players'].get(kwargs.get('player_id'))
+            track = hosted.player.name if hosted is not None else (request.get_json(silent=True) or {}).get('player_name', handler.__name__)
+            try:
+                with tracer.span(handler.__name__, track=track, parent_id=request.headers.get(PARENT_SPAN_HEADER)):
+                    return handler(*args, **kwargs)
+            finally:
+                app.config['Traces'].add(trace_id, tracer.spans)
+        return wrapper
+
+    def once(handler):
+        """
+        Handle a request only once per REQUEST_ID_HEADER: a repeated request waits for the first one and
+        gets the same response, so that the leader can retry a message without the player receiving it twice.
+        The header is echoed, to tell the leader that this server deduplicates its requests.
+        """
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            request_id = request.headers.get(REQUEST_ID_HEADER)
+            if request_id is None:
+                return handler(*args, **kwargs)
+            responses = app.config['Responses']
+            with app.config['ResponsesLock']:
+                entry = responses.get(request_id)
+                first = entry is None
+                if first:
+                    entry = responses[request_id] = [threading.Event(), None]
+                    if len(responses) > MAX_REMEMBERED_REQUESTS:
+                        responses.popitem(last=False)
+            if first:
+                try:
+                    response = app.make_response(handler(*args, **kwargs))
+                    entry[1] = (response.get_data(), response.status_code, response.mimetype)
+                finally:
+                    entry[0].set()
+            else:
+                entry[0].wait()
+            if entry[1] is None:
+                return jsonify({"error": f"Request {request_id} failed"}), 500
+            body, status, mimetype = entry[1]
+            return Response(body, status=status, mimetype=mimetype, headers={REQUEST_ID_HEADER: request_id})
+        return wrapper
+
     @app.route('/new_game', methods=['POST'])
+    @traced
+    @once
     def new_game():
         """
         Endpoint appelé par le meneur pour créer une nouvelle partie. 
@@ -24,6 +239,8 @@ def create_app():
                 "players_names": ["Aline", "Benjamin", "Chloe", ...],
                 "werewolves_count": 2 (the total # of werewolves)
                 "werewolves": ["Benjamin", "Chloe"]  # vide si le joueur est un villageois
+                "seers_count": 1  # optionnel, 0 dans les petites parties sans voyante
+                "game_id": "3f2a9c1b7d4e"  # optionnel, la partie du joueur (voir /end_game)
             }
             ```
     
@@ -35,18 +252,19 @@ def create_app():
         players_names = request.json.get("players_names")
         werewolves_count = request.json.get("werewolves_count")
         werewolves = request.json.get("werewolves")
+        seers_count = request.json.get("seers_count", 1)
+        game_id = request.json.get("game_id")
         assert role in ["villageois", "voyante", "loup-garou"], "Role invalide"
         assert player_name is not None, f"Nom de joueur manquant, player_name: {player_name}"
         assert players_names is not None, f"Liste de joueurs manquante, players_names: {players_names}"
         assert isinstance(players_names, list), f"Liste de joueurs invalide, players_names: {players_names}"
         assert len(players_names) > 0, f"Liste de joueurs vide, players_names: {players_names}"
         
-        player = WerewolfPlayer.create(player_name, role, players_names.copy(), werewolves_count, werewolves.copy())
+        player = player_class.create(player_name, role, players_names.copy(), werewolves_count, werewolves.copy(),
+                                     seers_count)
         if player:
             # add the player to the list of players
-            players = app.config['WerewolfPlayers']
-            player_id = len(players)
-            app.config['WerewolfPlayers'][player_id] = player
+            player_id = app.config['Players'].add(player, game_id)
 
             return jsonify({"ack": True, "player_id": player_id})
         else:
@@ -54,6 +272,8 @@ def create_app():
 
     
     @app.route('/<int:player_id>/speak', methods=['POST'])
+    @traced
+    @once
     def speak(player_id):
         """
         Endpoint appelé par le meneur pour donner la parole à un joueur.
@@ -71,16 +291,18 @@ def create_app():
             }
             ```
         """
-        players = app.config['WerewolfPlayers']
-        if player_id not in players:
+        hosted = app.config['Players'].get(player_id)
+        if hosted is None:
             return jsonify({"error": f"Player {player_id} not found"}), 404
         
-        player = players[player_id]
-        speech = player.speak()
+        with hosted.lock, app.config['Profiler'].phase("speak"):
+            speech = hosted.player.speak()
         return jsonify({"speech": speech})
 
 
     @app.route('/<int:player_id>/notify', methods=['POST'])
+    @traced
+    @once
     def notify(player_id):
         """
         Endpoint appelé par le meneur pour deux objectifs principaux:
@@ -121,15 +343,142 @@ def create_app():
             }
             ```
         """
-        players = app.config['WerewolfPlayers']
-        if player_id not in players:
+        hosted = app.config['Players'].get(player_id)
+        if hosted is None:
             return jsonify({"error": f"Player {player_id} not found"}), 404
         
-        player = players[player_id]
         message = request.json.get('message')
-        intent = player.notify(message)
+        intent = notify_player(hosted, message)
         return jsonify(intent.model_dump(mode="json"))
+
+    @app.route('/<int:player_id>/warmup', methods=['POST'])
+    @traced
+    def warmup(player_id):
+        """
+        Endpoint appelé par le meneur avant la première nuit pour préparer le joueur
+        (connexion à son LLM, etc.), afin que le premier vrai message ne paie pas ce coût.
+
+        Args:
+            player_id: L'identifiant du joueur
+
+        Returns:
+            un JSON avec {"ready": True} une fois le joueur prêt.
+        """
+        hosted = app.config['Players'].get(player_id)
+        if hosted is None:
+            return jsonify({"error": f"Player {player_id} not found"}), 404
+
+        with hosted.lock:
+            hosted.player.warmup()
+        return jsonify({"ready": True})
+
+    @app.route('/batch_notify', methods=['POST'])
+    @traced
+    @once
+    def batch_notify():
+        """
+        Endpoint appelé par le meneur pour envoyer le même message à plusieurs joueurs hébergés sur ce serveur.
+        Les `notify` des joueurs sont exécutés en parallèle côté serveur, ce qui évite au meneur
+        d'envoyer une requête par joueur.
+
+        Args:
+            ```json
+            {
+                "player_ids": [0, 1, 2],
+                "message": "C'est la nuit, tout le village s’endort, les joueurs ferment les yeux.",
+                "timeout": 4.5  # optionnel, en secondes: les joueurs plus lents sont renvoyés dans `errors`
+            }
+            ```
+
+        Returns:
+            Les intentions de chaque joueur, indexées par player_id (même schéma que `/notify`),
+            les erreurs éventuelles pour les joueurs qui n'ont pas pu être notifiés (ou pas à temps),
+            et le temps de réponse (secondes) de chaque joueur qui a répondu:
+            ```json
+            {
+                "intents": {"0": {"want_to_speak": False, "want_to_interrupt": False, "vote_for": None}, ...},
+                "errors": {"2": "Player 2 not found"},
+                "latencies": {"0": 1.2, ...}
+            }
+            ```
+        """
+        registry = app.config['Players']
+        player_ids = request.json.get('player_ids')
+        message = request.json.get('message')
+        timeout = request.json.get('timeout')
+        assert isinstance(player_ids, list), f"Liste de joueurs invalide, player_ids: {player_ids}"
+
+        errors = {}
+        futures = {}
+        for player_id in player_ids:
+            hosted = registry.get(player_id)
+            if hosted is None:
+                errors[str(player_id)] = f"Player {player_id} not found"
+            else:
+                # in the context of the request, so that the notify of each player is traced under it
+                futures[player_id] = app.config['NotifyExecutor'].submit(contextvars.copy_context().run, timed_notify_player,
+                                                                          hosted, message)
+        # late players still handle the message, their next message waits for them (see notify_player)
+        wait(futures.values(), timeout=timeout)
+
+        intents = {}
+        latencies = {}
+        for player_id, future in futures.items():
+            if not future.done():
+                errors[str(player_id)] = f"No response after {timeout}s"
+                continue
+            try:
+                intent, latencies[str(player_id)] = future.result()
+                intents[str(player_id)] = intent.model_dump(mode="json")
+            except Exception as e:
+                errors[str(player_id)] = str(e)
+        return jsonify({"intents": intents, "errors": errors, "latencies": latencies})
+
+    @app.route('/end_game', methods=['POST'])
+    @traced
+    def end_game():
+        """
+        Endpoint appelé par le meneur à la fin d'une partie: ses joueurs peuvent être supprimés (voir PlayerRegistry).
+
+        Args:
+            ```json
+            {"game_id": "3f2a9c1b7d4e"}
+            ```
+
+        Returns:
+            Le nombre de joueurs de la partie hébergés par ce serveur: {"ack": True, "players": 7}
+        """
+        game_id = request.json.get('game_id')
+        assert game_id is not None, "game_id manquant"
+        return jsonify({"ack": True, "players": app.config['Players'].end_game(game_id)})
+
+    @app.route('/stats', methods=['GET'])
+    def stats():
+        """
+        Endpoint pour surveiller la mémoire du serveur: les joueurs et parties hébergés, les requêtes mémorisées.
+
+        Returns:
+            ```json
+            {"players": 14, "games": 1, "finished_games": 0, "dropped_games": 12, "players_created": 182, "max_players": 4096,
+             "remembered_requests": 1024}
+            ```
+        """
+        with app.config['ResponsesLock']:
+            remembered = len(app.config['Responses'])
+        return jsonify({**app.config['Players'].stats(), "remembered_requests": remembered})
     
+    @app.route('/trace/<trace_id>', methods=['GET'])
+    def get_trace(trace_id):
+        """
+        Endpoint appelé par le meneur à la fin d'une partie tracée, pour récupérer les spans de ses requêtes (voir tracing.py).
+
+        Returns:
+            ```json
+            {"spans": [{"name": "notify", "span_id": "...", "parent_id": "...", "start": 1718000000.1, "duration": 0.8, ...}]}
+            ```
+        """
+        return jsonify({"spans": app.config['Traces'].pop(trace_id)})
+
     @app.route('/', methods=['GET', 'POST'])
     def ping():
         # prints the current time as a html page
@@ -138,19 +487,49 @@ def create_app():
 
     return app
 
-def run_app(port):
+def run_app(port, stub=False, seed=0, profile=False):
     # Suppress Flask (Werkzeug) access logs
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.CRITICAL)  # or logging.CRITICAL to suppress even more
 
-    app = create_app()
-    app.run(debug=False, port=port, host='localhost')
+    profiler = Profiler(enabled=profile)
+    if stub:
+        # set in the server's process, so that it also works with the "spawn" start method
+        StubWerewolfPlayer.seed = seed
+        app = create_app(StubWerewolfPlayer, profiler)
+    else:
+        app = create_app(profiler=profiler)
+    if not profile:
+        app.run(debug=False, port=port, host='localhost')
+        return
+    # the profiles are written when the server stops, with Ctrl+C or kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        app.run(debug=False, port=port, host='localhost')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        directory = os.path.join(PROFILE_DIR, f"server_{port}")
+        profiler.write(directory)
+        print(f"Profiles of the server on port {port} written to {directory}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Start the werewolf player servers.")
+    parser.add_argument("ports", nargs="*", type=int, help="ports to listen on, read from players_config.json if none")
+    parser.add_argument("--stub", action="store_true", help="host offline stub players instead of the LLM players")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the stub players")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the players' notify and speak, written to profiles/server_<port>/ when the server stops")
+    parser.add_argument("--import-time", action="store_true", help="print the time to import the server and exit")
+    args = parser.parse_args()
+
+    if args.import_time:
+        print_import_times("werewolf_server")
+        sys.exit(0)
 
     # if a port is provided, use it
-    if len(sys.argv) > 1:
-        ports = [int(port) for port in sys.argv[1:]]
+    if args.ports:
+        ports = args.ports
         print(f"Using ports: {ports}")
     else:
         # read from players_config.json
@@ -170,12 +549,16 @@ if __name__ == '__main__':
     processes = []
     
     for port in ports:  
-        p = multiprocessing.Process(target=run_app, args=(port,))
+        p = multiprocessing.Process(target=run_app, args=(port, args.stub, args.seed, args.profile))
         p.start()
         processes.append(p)
         print(f"Started Werewolf server on port {port}")
         print(f"To publish using ngrok:     ngrok http {port}")
     
+    if args.profile:
+        # stop the servers too, so that they write their profiles
+        signal.signal(signal.SIGTERM, lambda signum, frame: [p.terminate() for p in processes])
+
     # Wait for all processes to complete
     for p in processes:
         p.join() 
\ No newline at end of file